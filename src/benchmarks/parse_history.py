@@ -0,0 +1,83 @@
+"""
+Compares parsing a Home Assistant history response the original way (json.loads, list of dicts,
+cleaning, then arrays) against the streaming parser, reporting time and peak Python memory.
+
+Usage (from src/):
+    python benchmarks/parse_history.py [--days 30] [--resolution 1]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs.data import _readings_to_arrays  # noqa: E402
+from libs.home_assistant import STREAM_CHUNK_SIZE, clean_usage_data, parse_history_stream  # noqa: E402
+
+
+def write_history(path, days, resolution):
+    """
+    Writes a synthetic /api/history/period response with one reading every `resolution` seconds.
+    """
+    start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    state = 1000.0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[[{"entity_id": "sensor.kwh", "state": "1000.0", "attributes": {}, '
+                '"last_changed": "%s", "last_updated": "%s"}' % (start.isoformat(), start.isoformat()))
+        for i in range(1, int(days * 86400 / resolution)):
+            state += 0.0002 * resolution
+            last_changed = (start + timedelta(seconds=i * resolution)).isoformat(timespec='microseconds')
+            f.write(', {"state": "%s", "last_changed": "%s"}' % (round(state, 4), last_changed))
+        f.write(']]')
+
+
+def original(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    usage_data = json.loads(text)[0]
+    return _readings_to_arrays(clean_usage_data(usage_data))
+
+
+def streaming(path):
+    with open(path, 'rb') as f:
+        chunks = iter(lambda: f.read(STREAM_CHUNK_SIZE), b'')
+        return parse_history_stream(chunks)
+
+
+def measure(function, path):
+    started = time.perf_counter()
+    timestamps, _ = function(path)
+    elapsed = time.perf_counter() - started
+
+    # Separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    function(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, len(timestamps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--resolution", type=float, default=1, help="Seconds between readings")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.json")
+        write_history(path, args.days, args.resolution)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"Response: {size_mb:.0f} MB, {args.days:g} days at {args.resolution:g}s resolution")
+
+        for name, function in [("original", original), ("streaming", streaming)]:
+            elapsed, peak, rows = measure(function, path)
+            print(f"{name:>10}: {elapsed:.2f}s, peak {peak / 1024 / 1024:.0f} MB, {rows} readings")
+
+
+if __name__ == '__main__':
+    main()
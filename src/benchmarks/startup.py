@@ -0,0 +1,65 @@
+"""
+Reports the cold start cost of function_app: import time and peak RSS of a fresh interpreter.
+
+Usage (from src/):
+    python benchmarks/startup.py [--runs 5] [--max-seconds 1.5] [--max-rss-mb 120]
+
+Exits with status 1 if a limit is exceeded, so it can be used to catch regressions.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import os
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import function_app
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+heavy = sorted(m for m in ('pandas', 'matplotlib', 'pytz') if m in sys.modules)
+print(json.dumps({"seconds": elapsed, "rss_kb": rss, "heavy_modules": heavy}))
+"""
+
+
+def measure(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=SRC_DIR, check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, help="Fail if the median import time is higher")
+    parser.add_argument("--max-rss-mb", type=float, help="Fail if the peak RSS is higher")
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+    seconds = statistics.median(r["seconds"] for r in results)
+    rss_mb = max(r["rss_kb"] for r in results) / 1024  # ru_maxrss is in KB on Linux
+
+    print(f"function_app import: {seconds * 1000:.0f} ms (median of {args.runs})")
+    print(f"Peak RSS: {rss_mb:.1f} MB")
+    print(f"Heavy modules loaded: {', '.join(results[0]['heavy_modules']) or 'none'}")
+
+    failed = False
+    if args.max_seconds is not None and seconds > args.max_seconds:
+        print(f"FAIL: import time above {args.max_seconds}s")
+        failed = True
+    if args.max_rss_mb is not None and rss_mb > args.max_rss_mb:
+        print(f"FAIL: peak RSS above {args.max_rss_mb} MB")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
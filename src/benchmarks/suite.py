@@ -0,0 +1,249 @@
+"""
+Times the hot paths (optimiser, Home Assistant parsing, Electric Kiwi tokens, plan pricing,
+backtesting, HOP prediction and history) across data sizes on synthetic data, and compares
+them with a stored baseline.
+
+Usage (from src/):
+    python benchmarks/suite.py [--filter optimise] [--update-baseline] [--tolerance 0.5]
+
+Exits with status 1 if any case is slower than its baseline by more than the tolerance, or
+if there is no baseline to compare with.
+Times are normalised by a fixed calibration workload, so a baseline recorded on one
+machine stays meaningful on a somewhat faster or slower one.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import (DEFAULT_START, DST_ENDS, DST_STARTS, consumption, generate_readings,  # noqa: E402
+                                  history_response)
+from libs.backtest import History, backtest  # noqa: E402
+from libs.compare_plans import consumption_matrix, price_plans, simulate_hop  # noqa: E402
+from libs.cryptoJS import encrypt  # noqa: E402
+from libs.data import _readings_to_arrays, calculate_optimal_hop  # noqa: E402
+from libs.electrickiwi import ElectricKiwi  # noqa: E402
+from libs.hop_history import SQLiteDecisionStore, decision_record, summarise_decisions  # noqa: E402
+from libs.home_assistant import STREAM_CHUNK_SIZE, clean_usage_data, parse_history_stream  # noqa: E402
+from libs.tariff import EK_HOP_EXCLUDED_STARTS, Tariff  # noqa: E402
+from libs.usage_index import UsageIndex  # noqa: E402
+from libs.windows import best_day_windows  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def optimise_case(**options):
+    readings = clean_usage_data([{}] + generate_readings(**options))
+    return lambda: calculate_optimal_hop(readings)
+
+
+def parse_stream_case(**options):
+    body = history_response(generate_readings(**options))
+    chunks = [body[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(body), STREAM_CHUNK_SIZE)]
+    return lambda: parse_history_stream(chunks)
+
+
+def parse_json_case(**options):
+    body = history_response(generate_readings(**options))
+    return lambda: clean_usage_data(json.loads(body)[0])
+
+
+def token_case(count):
+    ek = ElectricKiwi(at_token="10" + "0123456789abcdef" * 4 + "ZZ")
+    return lambda: [ek._get_token('/hop/1234/5678/') for _ in range(count)]
+
+
+def encrypt_case(count):
+    return lambda: [encrypt(b'/hop/1234/5678/|1700000000|0123456789ABCDEF', b'0123456789abcdef') for _ in range(count)]
+
+
+def _plans(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [Tariff(str(i), rng.uniform(0.1, 0.4, 48), weekend=rng.uniform(0.1, 0.3, 48),
+                   daily_charge=rng.uniform(0.3, 2), discount_percent=rng.uniform(0, 15),
+                   hop_excluded_starts=EK_HOP_EXCLUDED_STARTS) for i in range(count)]
+
+
+def pricing_case(days, plans):
+    dates, kwh = consumption_matrix(consumption(days))
+    tariffs = _plans(plans)
+    return lambda: price_plans(dates, kwh, tariffs)
+
+
+def hop_simulation_case(days, plans):
+    dates, kwh = consumption_matrix(consumption(days))
+    tariffs = _plans(plans)
+    return lambda: simulate_hop(dates, kwh, tariffs)
+
+
+def windows_case(days, slots, count):
+    dates, kwh = consumption_matrix(consumption(days))
+    return lambda: best_day_windows(dates, kwh, slots=slots, count=count)
+
+
+def usage_index_case(weeks):
+    index = UsageIndex()
+    for week in range(weeks):
+        intervals = calculate_optimal_hop(generate_readings(days=1, start=DEFAULT_START + timedelta(weeks=week), seed=week))[4]
+        index.update(intervals)
+    day = intervals[0][0].date() + timedelta(weeks=1)
+    return lambda: index.predict(day)
+
+
+def decision_history_case(days, households):
+    directory = tempfile.TemporaryDirectory()
+    store = SQLiteDecisionStore(os.path.join(directory.name, "history.db"))
+    start_time, end_time, cost, kwh, intervals = calculate_optimal_hop(generate_readings(days=1))
+    for day in range(days):
+        shift = timedelta(days=day)
+        result = {"start_time": start_time, "end_time": end_time, "usage_cost": cost, "usage_kwh": kwh,
+                  "source": "live", "intervals": [(start + shift, end + shift, c, k) for start, end, c, k in intervals]}
+        for household in range(households):
+            store.append(decision_record(str(household), result))
+
+    first = intervals[0][0].date()
+
+    def month(directory=directory):  # the database is removed once the case is dropped
+        return summarise_decisions(store.query("0", first + timedelta(days=30), first + timedelta(days=60)))
+    return month
+
+
+def backtest_case(**options):
+    history = History(*_readings_to_arrays(generate_readings(**options)))
+    return lambda: backtest(history, max_workers=1)
+
+
+CASES = {
+    "optimise/1d@60s": (optimise_case, dict(days=1, resolution=60)),
+    "optimise/1d@1s": (optimise_case, dict(days=1, resolution=1)),
+    "optimise/7d@10s": (optimise_case, dict(days=7, resolution=10)),
+    "optimise/dst-ends@60s": (optimise_case, dict(days=2, resolution=60, start=DST_ENDS)),
+    "optimise/dst-starts@60s": (optimise_case, dict(days=2, resolution=60, start=DST_STARTS)),
+    "optimise/gaps-unavailable@10s": (optimise_case, dict(days=1, resolution=10, gaps=3, unavailable=0.05)),
+    "parse-stream/1d@1s": (parse_stream_case, dict(days=1, resolution=1)),
+    "parse-stream/7d@10s": (parse_stream_case, dict(days=7, resolution=10, unavailable=0.01)),
+    "parse-json/1d@1s": (parse_json_case, dict(days=1, resolution=1)),
+    "token/100": (token_case, dict(count=100)),
+    "encrypt/100": (encrypt_case, dict(count=100)),
+    "pricing/365d-10plans": (pricing_case, dict(days=365, plans=10)),
+    "pricing/1095d-500plans": (pricing_case, dict(days=1095, plans=500)),
+    "hop-simulation/365d-50plans": (hop_simulation_case, dict(days=365, plans=50)),
+    "windows/1095d-1x1h": (windows_case, dict(days=1095, slots=2, count=1)),
+    "windows/1095d-3x2h": (windows_case, dict(days=1095, slots=4, count=3)),
+    "backtest/365d@15min": (backtest_case, dict(days=365, resolution=900)),
+    "usage-index/predict": (usage_index_case, dict(weeks=4)),
+    "decision-history/month-of-365d": (decision_history_case, dict(days=365, households=2)),
+}
+
+
+def best_time(function, repeat, min_seconds=0.05):
+    """
+    Seconds per call, the fastest of repeat measurements. Fast functions are called in a loop
+    until one measurement takes at least min_seconds, so timer and scheduler noise averages out.
+    """
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            function()
+        if time.perf_counter() - started >= min_seconds:
+            break
+        loops *= 2
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            function()
+        times.append((time.perf_counter() - started) / loops)
+    return min(times)
+
+
+def calibrate(repeat=5):
+    """
+    Times a fixed mix of interpreter and numpy work, used to normalise case times.
+    """
+    values = np.random.default_rng(0).random(200_000)
+
+    def workload():
+        np.sort(values)
+        sum(i * i for i in range(200_000))
+    return best_time(workload, repeat)
+
+
+def run(cases, repeat):
+    results = {}
+    for name, (setup, options) in cases.items():
+        function = setup(**options)
+        function()  # warm up imports and caches
+        results[name] = best_time(function, repeat)
+    return results
+
+
+def compare(results, calibration, baseline, tolerance):
+    """
+    :return: List of (name, seconds, ratio to baseline or None, regressed)
+    """
+    rows = []
+    for name, seconds in results.items():
+        if name not in baseline.get("cases", {}):
+            rows.append((name, seconds, None, False))
+            continue
+        ratio = (seconds / calibration) / (baseline["cases"][name] / baseline["calibration"])
+        rows.append((name, seconds, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="Only run cases containing this text")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case, the fastest counts")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown, 0.5 is 50%%")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    elif not args.update_baseline:
+        print(f"FAIL: no baseline at {args.baseline}, record one with --update-baseline")
+        return 1
+
+    cases = {name: case for name, case in CASES.items() if args.filter in name}
+    calibration = calibrate()
+    results = run(cases, args.repeat)
+
+    regressions = 0
+    for name, seconds, ratio, regressed in compare(results, calibration, baseline, args.tolerance):
+        change = "new" if ratio is None else f"{ratio:.2f}x baseline"
+        print(f"{name:<32} {seconds * 1000:10.2f} ms  {change}{'  REGRESSION' if regressed else ''}")
+        regressions += regressed
+
+    if args.update_baseline:
+        if set(baseline.get("cases", {})) - set(results):
+            # Cases that were not run keep their times, so these are stored at the baseline's calibration
+            results = {name: seconds * baseline["calibration"] / calibration for name, seconds in results.items()}
+            calibration = baseline["calibration"]
+        baseline = {"calibration": calibration, "cases": dict(baseline.get("cases", {}), **results)}
+        with open(args.baseline, "w", encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"FAIL: {regressions} case(s) more than {args.tolerance:.0%} slower than the baseline")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
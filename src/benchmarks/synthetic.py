@@ -0,0 +1,69 @@
+"""
+Synthetic cumulative kWh meter data for the benchmarks: configurable resolution, length,
+missing periods, 'unavailable' states and New Zealand daylight saving transitions.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Local midnight before each New Zealand daylight saving change in 2024
+DST_ENDS = datetime(2024, 4, 6, 11, tzinfo=timezone.utc)     # 7 April, 3am -> 2am
+DST_STARTS = datetime(2024, 9, 28, 12, tzinfo=timezone.utc)  # 29 September, 2am -> 3am
+DEFAULT_START = datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc)
+
+
+def generate_readings(days=1, resolution=60, start=DEFAULT_START, gaps=0, gap_hours=2,
+                      unavailable=0.0, seed=0):
+    """
+    Builds Home Assistant style state objects for a cumulative kWh meter.
+
+    :param days: Length of the series in days
+    :param resolution: Seconds between readings
+    :param start: Aware datetime of the first reading, e.g. DST_ENDS or DST_STARTS
+    :param gaps: Number of periods with no readings at all (an offline meter)
+    :param gap_hours: Length of each gap
+    :param unavailable: Fraction of readings reported as 'unavailable'
+    :return: List of {"state", "last_changed"} dicts in time order
+    """
+    rng = np.random.default_rng(seed)
+    count = int(days * 86400 / resolution)
+    offsets = np.arange(count) * resolution
+
+    # Base load plus an evening peak, in kW
+    hours = (offsets / 3600 + start.hour + 12) % 24  # roughly New Zealand local time
+    power = rng.uniform(0.2, 1.0, count) + np.where((hours >= 17) & (hours < 22), 2.0, 0.0)
+    states = 1000 + np.cumsum(power * resolution / 3600)
+
+    keep = np.ones(count, dtype=bool)
+    for gap_start in rng.uniform(0, max(days * 86400 - gap_hours * 3600, 0), gaps):
+        keep &= (offsets < gap_start) | (offsets >= gap_start + gap_hours * 3600)
+    missing = rng.random(count) < unavailable
+
+    epoch = start.timestamp()
+    readings = []
+    for offset, state, is_missing in zip(offsets[keep].tolist(), states[keep].tolist(), missing[keep].tolist()):
+        last_changed = datetime.fromtimestamp(epoch + offset, timezone.utc).isoformat()
+        readings.append({"state": "unavailable" if is_missing else str(round(state, 3)),
+                         "last_changed": last_changed})
+    return readings
+
+
+def history_response(readings, entity_id="sensor.energy"):
+    """
+    Encodes readings as the body of /api/history/period?minimal_response, with the first
+    element carrying the entity metadata like Home Assistant does.
+    """
+    first = dict(readings[0], entity_id=entity_id, attributes={"unit_of_measurement": "kWh"},
+                 last_updated=readings[0]["last_changed"])
+    return json.dumps([[first] + readings[1:]]).encode()
+
+
+def consumption(days, seed=0, start=datetime(2023, 1, 1)):
+    """
+    Builds an ElectricKiwi.consumption style dict of half-hourly usage.
+    """
+    rng = np.random.default_rng(seed)
+    return {(start + timedelta(days=day)).date().isoformat(): {
+                "intervals": {str(i + 1): {"consumption": str(round(kwh, 3))} for i, kwh in enumerate(rng.uniform(0, 2, 48))}}
+            for day in range(days)}
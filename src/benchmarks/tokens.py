@@ -0,0 +1,45 @@
+"""
+Measures Electric Kiwi request token generation (ElectricKiwi._get_token) per AES backend.
+
+Usage (from src/):
+    python benchmarks/tokens.py [--seconds 1]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from libs import cryptoJS  # noqa: E402
+from libs.electrickiwi import ElectricKiwi  # noqa: E402
+
+
+def tokens_per_second(seconds):
+    ek = ElectricKiwi(at_token="10" + "0123456789abcdef" * 4 + "ZZ")
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        ek._get_token('/hop/1234/5678/')
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=1)
+    args = parser.parse_args()
+
+    default = cryptoJS.default_backend
+    for backend in cryptoJS.BACKENDS:
+        try:
+            cryptoJS.default_backend = backend()
+        except ImportError:
+            print(f"{backend.name:>12}: not installed")
+            continue
+        print(f"{backend.name:>12}: {tokens_per_second(args.seconds):,.0f} tokens/s")
+    cryptoJS.default_backend = default
+
+
+if __name__ == '__main__':
+    main()
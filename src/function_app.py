@@ -1,10 +1,15 @@
+import json
 import logging
 import os
 import azure.functions as func
-from libs.home_assistant import get_usage_data
-from libs.data import calculate_optimal_hop, plot_intervals
 from libs.pushover import send_pushover_notification
-from libs.electrickiwi import ElectricKiwi
+from libs.data import chart_or_none, render_intervals_in_background
+from libs.hop_score import format_summary
+from libs.streaming import get_streaming_optimiser, readings_from_payload
+from libs.households import (DEFAULT_MAX_WORKERS, load_households, optimise_household,
+                             provisional_household, run_households, score_household,
+                             summarise_results)
+from libs.timing import Timings
 
 app = func.FunctionApp()
 
@@ -14,45 +19,18 @@ app = func.FunctionApp()
                    arg_name="mytimer",
                    run_on_startup=False)
 def hour_of_power(mytimer: func.TimerRequest) -> None:
+    development = os.getenv("AZURE_FUNCTIONS_ENVIRONMENT") == 'Development'
+    charts = development or os.getenv("HOP_CHART", "false").lower() == "true"
     try:
-        usage_data = get_usage_data(
-            url=os.environ["HOME_ASSISTANT_URL"],
-            token=os.environ["HOME_ASSISTANT_ACCESS_TOKEN"],
-            entity_id=os.environ["HOME_ASSISTANT_ENTITY_ID"]
-        )
+        households = load_households()
+        if len(households) > 1:
+            return hour_of_power_households(households)
 
-        # clean the data
-        usage_data.pop(0)  # remove the first element as its just metadata
-        usage_data = [obj for obj in usage_data if obj["state"]
-                      != "unavailable"]  # remove any unavailable states
-
-        # start_time, end_time, total_kwh, cost = find_optimal_hop(usage_data)
-        start_time, end_time, usage_cost, usage_kwh, intervals = calculate_optimal_hop(
-            usage_data)
-
-        if os.getenv("AZURE_FUNCTIONS_ENVIRONMENT") == 'Development':
-            plot_intervals(intervals)
-
-        # Generate a list of all possible HOPs using list comprehension
-        ek_hours = [
-            '12:00 AM', '12:30 AM', '01:00 AM', '01:30 AM', '02:00 AM', '02:30 AM',
-            '03:00 AM', '03:30 AM', '04:00 AM', '04:30 AM', '05:00 AM', '05:30 AM',
-            '06:00 AM', '06:30 AM', '07:00 AM', '07:30 AM', '08:00 AM', '08:30 AM',
-            '09:00 AM', '09:30 AM', '10:00 AM', '10:30 AM', '11:00 AM', '11:30 AM',
-            '12:00 PM', '12:30 PM', '01:00 PM', '01:30 PM', '02:00 PM', '02:30 PM',
-            '03:00 PM', '03:30 PM', '04:00 PM', '04:30 PM', '05:00 PM', '05:30 PM',
-            '06:00 PM', '06:30 PM', '07:00 PM', '07:30 PM', '08:00 PM', '08:30 PM',
-            '09:00 PM', '09:30 PM', '10:00 PM', '10:30 PM', '11:00 PM', '11:30 PM'
-        ]
-
-        ek = ElectricKiwi()
-        ek.at_token()
-        ek.login(
-            email=os.environ["ELECTRIC_KIWI_EMAIL"],
-            password_hash=ek.password_hash(
-                os.environ["ELECTRIC_KIWI_PASSWORD"])
-        )
-        ek.set_hop_hour(ek_hours.index(start_time)+1)
+        timings = Timings(household=households[0]["name"])
+        result = optimise_household(households[0], timings)
+
+        # The HOP is already set, so the chart renders off the critical path while we finish up
+        chart = render_intervals_in_background(result["intervals"], timings) if charts else None
 
     except Exception as e:
         logging.error(e)
@@ -65,9 +43,111 @@ def hour_of_power(mytimer: func.TimerRequest) -> None:
         raise e
 
     else:
-        send_pushover_notification(
-            user_key=os.environ["PUSHOVER_USER_KEY"],
-            api_token=os.environ["PUSHOVER_API_TOKEN"],
-            message=f"HOP Time: {start_time} - {end_time}\nHOP Usage: {usage_kwh} kWh\nEstimated Savings: ${usage_cost}",
-            title="Hour of Power Optimiser"
-        )
+        image = chart_or_none(chart, timeout=float(os.getenv("HOP_CHART_TIMEOUT_SECONDS", 10)))
+        if result["source"] == "previous":
+            message = f"HOP Time: {result['start_time']} - {result['end_time']}\nUnchanged, no new HOP could be chosen before midnight"
+        else:
+            predicted = "\nPredicted from usage history, the live data was too slow" if result["source"] == "predicted" else ""
+            message = f"HOP Time: {result['start_time']} - {result['end_time']}\nHOP Usage: {result['usage_kwh']} kWh\nEstimated Savings: ${result['usage_cost']}{predicted}"
+        stages = f"\n\n{timings.summary()}" if development else ""
+        # The HOP is committed by now, so notifying can take as long as it needs
+        with timings.span("notify"):
+            send_pushover_notification(
+                user_key=os.environ["PUSHOVER_USER_KEY"],
+                api_token=os.environ["PUSHOVER_API_TOKEN"],
+                message=message + stages,
+                title="Hour of Power Optimiser",
+                image=image
+            )
+        logging.info(f"Hour of Power set in {timings.total():.2f}s")
+
+
+def hour_of_power_households(households):
+    """
+    Fan-out mode: optimises every configured household concurrently and sends one summary.
+    """
+    results = run_households(
+        households,
+        max_workers=int(os.getenv("HOUSEHOLD_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+        timeout=float(os.getenv("HOUSEHOLD_TIMEOUT_SECONDS", 270))  # leave headroom before midnight
+    )
+
+    send_pushover_notification(
+        user_key=os.environ["PUSHOVER_USER_KEY"],
+        api_token=os.environ["PUSHOVER_API_TOKEN"],
+        message=summarise_results(results),
+        title="Hour of Power Optimiser - Households"
+    )
+
+
+@app.function_name(name="ProvisionalHourOfPower")
+@app.timer_trigger(schedule="0 0 9 * * *",  # UTC Time (9pm NZST)
+                   arg_name="mytimer",
+                   run_on_startup=False)
+def provisional_hour_of_power(mytimer: func.TimerRequest) -> None:
+    """
+    Sets a HOP predicted from the usage index early in the evening, so a slow or failed 23:55
+    run still leaves a good hour set. Enabled with PROVISIONAL_HOP=true.
+    """
+    if os.getenv("PROVISIONAL_HOP", "false").lower() != "true":
+        return
+
+    results = run_households(
+        load_households(),
+        max_workers=int(os.getenv("HOUSEHOLD_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+        function=provisional_household
+    )
+    for name, result in results.items():
+        if result["ok"]:
+            logging.info(f"{name}: provisional HOP {result['result']['start_time']}")
+        else:
+            logging.error(f"{name}: no provisional HOP: {result['error']}")
+
+
+@app.function_name(name="MeterWebhook")
+@app.route(route="meter/{household}", methods=["POST"])
+def meter_webhook(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Receives meter readings pushed by Home Assistant (a state object, a list of them or a
+    state_changed event) for a household with home_assistant_source 'push'.
+    """
+    optimiser = get_streaming_optimiser()
+    if optimiser is None:
+        return func.HttpResponse("Push ingestion is not enabled", status_code=404)
+
+    try:
+        readings = readings_from_payload(req.get_json())
+    except (ValueError, AttributeError):
+        return func.HttpResponse("Expected a JSON state object or event", status_code=400)
+
+    slots = optimiser.ingest(req.route_params["household"], readings)
+    return func.HttpResponse(json.dumps({"readings": len(readings), "slots": slots}),
+                             mimetype="application/json")
+
+
+@app.function_name(name="HopScoreWeekly")
+@app.timer_trigger(schedule="0 0 20 * * 0",  # UTC Time (Monday 8am NZST)
+                   arg_name="mytimer",
+                   run_on_startup=False)
+def hop_score_weekly(mytimer: func.TimerRequest) -> None:
+    """
+    Sends how well the Hour of Power was chosen over the last week.
+    """
+    households = load_households()
+    results = run_households(
+        households,
+        max_workers=int(os.getenv("HOUSEHOLD_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+        function=score_household
+    )
+
+    messages = []
+    for name, result in results.items():
+        message = format_summary(result["result"]) if result["ok"] else f"An error occurred: {result['error']}"
+        messages.append(message if len(households) == 1 else f"{name}\n{message}")
+
+    send_pushover_notification(
+        user_key=os.environ["PUSHOVER_USER_KEY"],
+        api_token=os.environ["PUSHOVER_API_TOKEN"],
+        message="\n\n".join(messages),
+        title="Hour of Power Optimiser - Weekly Score"
+    )
@@ -0,0 +1,161 @@
+"""
+A columnar on-disk archive of cumulative meter readings, for years of high-resolution history.
+
+Each series (a Home Assistant entity) is a directory holding two fixed-width column files
+per UTC month:
+
+    <root>/<series>/2024-05.timestamps   little-endian int64 epoch-ns, strictly increasing
+    <root>/<series>/2024-05.kwh          little-endian float64 cumulative kWh, same length
+
+Appending only ever adds to the end of the files, and reading opens them memory-mapped, so a
+range query touches just the pages it covers instead of loading or parsing everything.
+"""
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+TIMESTAMP_DTYPE = np.dtype('<i8')
+KWH_DTYPE = np.dtype('<f8')
+
+
+def _month(timestamp):
+    return str(np.datetime64(int(timestamp), 'ns').astype('datetime64[M]'))
+
+
+class MeterArchive(object):
+    """
+    Appends and memory-maps month partitions of (timestamp, kWh) columns, see the module docstring.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, series):
+        return os.path.join(self.root, re.sub(r'[^\w.-]', '_', series))
+
+    def _paths(self, series, month):
+        base = os.path.join(self._directory(series), month)
+        return base + '.timestamps', base + '.kwh'
+
+    def months(self, series):
+        """
+        :return: Sorted 'YYYY-MM' names of the series' partitions
+        """
+        directory = self._directory(series)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len('.timestamps')] for name in os.listdir(directory) if name.endswith('.timestamps'))
+
+    def _open(self, series, month):
+        timestamps_path, kwh_path = self._paths(series, month)
+        # An interrupted append can leave one column longer; the shorter one decides
+        count = min(os.path.getsize(timestamps_path) // TIMESTAMP_DTYPE.itemsize,
+                    os.path.getsize(kwh_path) // KWH_DTYPE.itemsize if os.path.exists(kwh_path) else 0)
+        if count == 0:
+            return np.empty(0, TIMESTAMP_DTYPE), np.empty(0, KWH_DTYPE)
+        return (np.memmap(timestamps_path, TIMESTAMP_DTYPE, mode='r', shape=(count,)),
+                np.memmap(kwh_path, KWH_DTYPE, mode='r', shape=(count,)))
+
+    def _repair(self, series, month):
+        timestamps, _ = self._open(series, month)
+        for path, dtype in zip(self._paths(series, month), (TIMESTAMP_DTYPE, KWH_DTYPE)):
+            if os.path.exists(path) and os.path.getsize(path) != len(timestamps) * dtype.itemsize:
+                logging.warning(f"Truncating partially written {path}")
+                os.truncate(path, len(timestamps) * dtype.itemsize)
+
+    def watermark(self, series):
+        """
+        :return: Timestamp (epoch ns) of the newest reading, or None for an empty series
+        """
+        for month in reversed(self.months(series)):
+            timestamps, _ = self._open(series, month)
+            if len(timestamps):
+                return int(timestamps[-1])
+        return None
+
+    def append(self, series, timestamps, states):
+        """
+        Adds readings newer than the watermark. Older and repeated readings are skipped, so the
+        overlapping fetch of every run can be appended as it is.
+
+        :param timestamps: int64 epoch-ns, in any order
+        :param states: Cumulative kWh aligned with timestamps
+        :return: Number of readings added
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        states = np.asarray(states, dtype=float)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, states = timestamps[order], states[order]
+
+        with self._lock:
+            watermark = self.watermark(series)
+            keep = np.ones(len(timestamps), dtype=bool)
+            keep[1:] = timestamps[1:] > timestamps[:-1]
+            if watermark is not None:
+                keep &= timestamps > watermark
+            timestamps, states = timestamps[keep], states[keep]
+            if len(timestamps) == 0:
+                return 0
+
+            os.makedirs(self._directory(series), exist_ok=True)
+            months = timestamps.astype('datetime64[ns]').astype('datetime64[M]')
+            bounds = np.flatnonzero(months[1:] != months[:-1]) + 1
+            for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(timestamps)]):
+                month = str(months[lo])
+                timestamps_path, kwh_path = self._paths(series, month)
+                if os.path.exists(timestamps_path):
+                    self._repair(series, month)
+                # kWh first: a crash in between leaves the timestamps column as the shorter one
+                with open(kwh_path, 'ab') as f:
+                    f.write(states[lo:hi].astype(KWH_DTYPE).tobytes())
+                with open(timestamps_path, 'ab') as f:
+                    f.write(timestamps[lo:hi].astype(TIMESTAMP_DTYPE).tobytes())
+        return len(timestamps)
+
+    def read(self, series, start=None, end=None):
+        """
+        Reads the readings with start <= timestamp < end. A range within one month is returned
+        as read-only views of the memory-mapped columns, without copying.
+
+        :param start: Optional epoch-ns (default is the first reading)
+        :param end: Optional epoch-ns (default is after the last reading)
+        :return: Tuple of (timestamps, states) arrays
+        """
+        first = _month(start) if start is not None else None
+        last = _month(end) if end is not None else None
+
+        timestamp_parts, state_parts = [], []
+        for month in self.months(series):
+            if (first and month < first) or (last and month > last):
+                continue
+            timestamps, states = self._open(series, month)
+            lo = np.searchsorted(timestamps, start) if start is not None and month == first else 0
+            hi = np.searchsorted(timestamps, end) if end is not None and month == last else len(timestamps)
+            if hi > lo:
+                timestamp_parts.append(timestamps[lo:hi])
+                state_parts.append(states[lo:hi])
+
+        if not timestamp_parts:
+            return np.empty(0, np.int64), np.empty(0, float)
+        if len(timestamp_parts) == 1:
+            return timestamp_parts[0], state_parts[0]
+        return np.concatenate(timestamp_parts), np.concatenate(state_parts)
+
+
+def get_meter_archive():
+    """
+    Returns the archive configured by METER_ARCHIVE (a directory), or None when disabled.
+    """
+    root = os.getenv("METER_ARCHIVE")
+    return _build_meter_archive(root) if root else None
+
+
+@lru_cache(maxsize=4)
+def _build_meter_archive(root):
+    return MeterArchive(root)
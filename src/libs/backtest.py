@@ -0,0 +1,290 @@
+"""
+Replays stored usage history day by day through HOP selection strategies and compares the
+savings each would have realised against the best possible hour (the oracle).
+
+Usage (from src/):
+    python -m libs.backtest HISTORY_CACHE_FILE ENTITY_ID [--workers 4]
+    python -m libs.backtest METER_ARCHIVE_DIR ENTITY_ID --archive
+"""
+import argparse
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time
+from functools import partial
+
+import numpy as np
+
+from libs.data import (HALF_HOUR_NS, HOUR_NS, NZDT, _readings_to_arrays, candidate_starts,
+                       interpolated_window_usage, optimal_hop_from_arrays, sliding_window_usage, to_local)
+from libs.tariff import DEFAULT_TARIFF, SLOTS_PER_DAY, time_to_slot
+
+# The function runs at 23:55, so the last five minutes of each day are never seen
+DEFAULT_CUTOFF_NS = 5 * 60 * 10**9
+
+
+class History(object):
+    """
+    A household's meter readings, with the kWh of every candidate hour and half-hour laid out
+    as days x 48 local slot matrices.
+    """
+
+    def __init__(self, timestamps, states, tariff=DEFAULT_TARIFF, tz=NZDT):
+        """
+        :param timestamps: Sorted int64 array of reading times (epoch ns)
+        :param states: Cumulative kWh readings aligned with timestamps
+        :param tariff: Tariff used to price and restrict the hours
+        """
+        self.timestamps = timestamps
+        self.states = states
+        self.tariff = tariff
+
+        starts = candidate_starts(timestamps[0], timestamps[-1], tz)
+        local = to_local(starts, tz)
+        local_days = local.astype('datetime64[D]')
+        self.first_day = local_days[0]
+        self.days = np.arange(local_days[0], local_days[-1] + 1)
+
+        rows = (local_days - self.first_day).astype(np.int64)
+        day_types, slots = tariff.index(local)
+
+        hour_kwh, non_empty = sliding_window_usage(timestamps, states, starts)
+        half_kwh, covered = interpolated_window_usage(timestamps, states, starts, HALF_HOUR_NS)
+
+        shape = (len(self.days), SLOTS_PER_DAY)
+        self.hour_kwh = np.zeros(shape)
+        self.half_hour_kwh = np.zeros(shape)
+        self.valid = np.zeros(shape, dtype=bool)
+        self.hour_kwh[rows, slots] = hour_kwh
+        self.half_hour_kwh[rows, slots] = half_kwh
+        self.valid[rows, slots] = non_empty & covered
+
+        self.day_types = tariff.day_types(self.days)
+        self.rates = tariff.rates[self.day_types]
+        self.eligible = tariff.hop_eligible[self.day_types]
+        self.day_ends = np.array([int(datetime.combine(day.item(), time(), tz).timestamp()) * 10**9
+                                  for day in self.days + 1], dtype=np.int64)
+
+    @classmethod
+    def from_readings(cls, data, tariff=DEFAULT_TARIFF):
+        """
+        :param data: Home Assistant state objects, e.g. from a history cache store
+        """
+        timestamps, states = _readings_to_arrays(data)
+        return cls(timestamps, states, tariff)
+
+    @classmethod
+    def from_archive(cls, archive, series, start=None, end=None, tariff=DEFAULT_TARIFF):
+        """
+        :param archive: libs.archive.MeterArchive
+        :param start: Optional epoch-ns, only the partitions in range are read
+        :param end: Optional epoch-ns
+        """
+        timestamps, states = archive.read(series, start, end)
+        if len(timestamps) == 0:
+            raise ValueError(f"No readings of {series} archived in that range")
+        return cls(timestamps, states, tariff)
+
+    def costs(self):
+        """
+        :return: days x 48 value of a free hour starting in each slot, NaN where it may not start
+        """
+        return np.where(self.eligible & self.valid, self.hour_kwh * self.rates, np.nan)
+
+    def readings(self, start, end):
+        """
+        :return: Readings with start <= timestamp < end (epoch ns)
+        """
+        lo, hi = np.searchsorted(self.timestamps, [start, end])
+        return self.timestamps[lo:hi], self.states[lo:hi]
+
+
+def best_slot(history, day, kwh):
+    """
+    Picks the eligible start slot whose hour would cost the most given predicted half-hour kWh.
+
+    :return: Slot index or None when nothing is eligible
+    """
+    hours = kwh + np.append(kwh[1:], 0.0)
+    costs = np.where(history.eligible[day], hours * history.rates[day], -np.inf)
+    slot = int(np.argmax(costs))
+    return slot if np.isfinite(costs[slot]) else None
+
+
+class TodaysPeak(object):
+    """
+    What hour_of_power does: the costliest eligible hour of the last 24 hours, at 23:55.
+    """
+    name = "todays_peak"
+
+    def __init__(self, cutoff=DEFAULT_CUTOFF_NS):
+        self.cutoff = cutoff
+
+    def __call__(self, history, day):
+        decided = history.day_ends[day] - self.cutoff
+        timestamps, states = history.readings(decided - 24 * HOUR_NS, decided)
+        result = optimal_hop_from_arrays(timestamps, states, history.tariff)
+        if result is None:
+            return None
+        return time_to_slot(datetime.strptime(result[0], "%I:%M %p").strftime("%H:%M"))
+
+
+class ForecastStrategy(object):
+    """
+    Picks the best hour from a forecast of the day's half-hour usage made from earlier days only.
+    """
+
+    def __init__(self, forecast, name="forecast"):
+        """
+        :param forecast: Function (history, day) returning 48 predicted half-hour kWh, or None.
+                         Defined at module level, so it can be sent to the worker processes.
+        """
+        self.forecast = forecast
+        self.name = name
+
+    def __call__(self, history, day):
+        kwh = self.forecast(history, day)
+        return None if kwh is None else best_slot(history, day, kwh)
+
+
+def weekday_profile(history, day, weeks=4):
+    """
+    Forecasts each half-hour as its average over the same weekday in the previous weeks.
+    """
+    days = np.arange(day - 7, max(day - 7 * weeks, 0) - 1, -7)
+    days = days[days >= 0]
+    if len(days) == 0:
+        return None
+    return history.half_hour_kwh[days].mean(axis=0)
+
+
+def recent_days(history, day, days=7):
+    """
+    Forecasts each half-hour as its average over the previous days of the same day type.
+    """
+    same_type = np.flatnonzero(history.day_types[:day] == history.day_types[day])[-days:]
+    if len(same_type) == 0:
+        return None
+    return history.half_hour_kwh[same_type].mean(axis=0)
+
+
+class WeekdayProfile(ForecastStrategy):
+    """
+    Forecasts with weekday_profile.
+    """
+
+    def __init__(self, weeks=4):
+        super().__init__(partial(weekday_profile, weeks=weeks), "weekday_profile")
+
+
+class RecentDays(ForecastStrategy):
+    """
+    Forecasts with recent_days.
+    """
+
+    def __init__(self, days=7):
+        super().__init__(partial(recent_days, days=days), "recent_days")
+
+
+DEFAULT_STRATEGIES = (TodaysPeak(), WeekdayProfile(), RecentDays())
+
+_worker = {}
+
+
+def _init_worker(history, strategies):
+    # Each worker process receives the history once rather than with every chunk of days
+    _worker["history"] = history
+    _worker["strategies"] = strategies
+
+
+def _choose(days):
+    history, strategies = _worker["history"], _worker["strategies"]
+    return [[-1 if slot is None else slot for slot in (strategy(history, day) for day in days)]
+            for strategy in strategies]
+
+
+def _picklable(strategies):
+    try:
+        pickle.dumps(strategies)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def backtest(history, strategies=DEFAULT_STRATEGIES, warmup_days=28, max_workers=None):
+    """
+    Replays every complete day after the warm-up through each strategy.
+
+    :param history: History to replay
+    :param strategies: Callables (history, day index) returning a start slot or None, with a name
+    :param warmup_days: Days at the start only used as history for the forecasts
+    :param max_workers: Processes to spread the days over (default is one per CPU, 1 runs in this
+                        process, as do strategies that cannot be pickled such as lambdas)
+    :return: Dict of strategy name to {"days", "savings", "oracle", "capture", "hits", "slots"}
+    """
+    # The first and last days are usually partial
+    days = np.arange(max(warmup_days, 1), len(history.days) - 1)
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers > 1 and not _picklable(strategies):
+        logging.warning("Backtest strategies cannot be sent to worker processes, running them in this one")
+        max_workers = 1
+
+    if max_workers == 1 or len(days) < 2:
+        _init_worker(history, strategies)
+        chosen = [_choose(days)]
+    else:
+        chunks = np.array_split(days, max_workers * 4)
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                 initargs=(history, strategies)) as executor:
+            chosen = list(executor.map(_choose, [chunk for chunk in chunks if len(chunk)]))
+
+    costs = np.nan_to_num(history.costs()[days], nan=-np.inf)
+    oracle_slots = costs.argmax(axis=1)
+    oracle = np.maximum(costs[np.arange(len(days)), oracle_slots], 0)
+
+    results = {}
+    for i, strategy in enumerate(strategies):
+        slots = np.concatenate([np.array(chunk[i], dtype=np.int64) for chunk in chosen])
+        savings = np.where(slots >= 0, costs[np.arange(len(days)), slots], 0)
+        savings = np.maximum(savings, 0)  # an ineligible hour saves nothing
+        results[strategy.name] = {
+            "days": len(days),
+            "savings": round(float(savings.sum()), 2),
+            "oracle": round(float(oracle.sum()), 2),
+            "capture": round(float(savings.sum() / oracle.sum() * 100), 2) if oracle.sum() else None,
+            "hits": int(np.count_nonzero(savings >= oracle)),
+            "slots": slots,
+        }
+    return results
+
+
+def format_results(results):
+    lines = []
+    for name, result in sorted(results.items(), key=lambda x: -x[1]["savings"]):
+        lines.append(f"{name}: ${result['savings']:.2f} of ${result['oracle']:.2f} "
+                     f"({result['capture']}%), best hour on {result['hits']}/{result['days']} days")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    from libs.archive import MeterArchive
+    from libs.history_cache import SQLiteHistoryStore
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('store', help='SQLite history cache file (see HISTORY_CACHE)')
+    parser.add_argument('entity_id')
+    parser.add_argument('--archive', action='store_true', help='store is a meter archive directory (see METER_ARCHIVE)')
+    parser.add_argument('--workers', type=int, help='Processes to use (default is one per CPU)')
+    parser.add_argument('--warmup-days', type=int, default=28)
+    args = parser.parse_args(argv)
+
+    if args.archive:
+        history = History.from_archive(MeterArchive(args.store), args.entity_id)
+    else:
+        history = History.from_readings(SQLiteHistoryStore(args.store).read(args.entity_id, 0))
+    print(format_results(backtest(history, warmup_days=args.warmup_days, max_workers=args.workers)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,121 +1,267 @@
+"""
+Compares what Electric Kiwi plans would have cost for your actual half-hourly consumption.
+
+Usage (from src/):
+    python -m libs.compare_plans [--months 12] [--no-discount] [--plans-file plans.json] [--hop]
+                                 [--archive METER_ARCHIVE_DIR ENTITY_ID]
+"""
+import argparse
+import itertools
+import json
+
 import arrow
-from electrickiwi import ElectricKiwi
-
-ek = ElectricKiwi()
-token = ek.at_token()
-
-loaded = False
-try:
-    with open('ek_creds.txt') as f:
-        email = f.readline().strip()
-        password = f.readline().strip()
-
-    loaded = True
-    print("Loaded Credentials: OK")
-except:
-    email = input('EK Email: ')
-    password = ek.password_hash(input('EK Password: '))
-
-customer = ek.login(email, password)
-print('Logged in: OK')
-
-if not loaded and input('Save credentials? Y/N : ').lower() in ('y', 'yes'):
-    with open('ek_creds.txt', 'w') as f:
-        f.write(email+'\n'+password)
-
-connection = ek.connection_details()
-
-include_discount = True
-plans = {
-    'loyal_kiwi': {
-        'kwh_incl': 0.2852,
-        'daily_incl': 0.83,
-    },
-    # 'loyal_kiwi_low': {
-    #     'kwh_incl': 0.3072,
-    #     'daily_incl': 0.3400,
-    # },
-    # 'kiwi': {
-    #     'kwh_incl': 0.2963,
-    #     'daily_incl': 0.8300,
-    # },
-    # 'kiwi_low': {
-    #     'kwh_incl': 0.3183,
-    #     'daily_incl': 0.3400,
-    # },
-    'stay_ahead': {
-        'kwh_incl': 0.2362,
-        'daily_incl': 1.35,
-        'discount_percent': 11.5,
-    },
-    # 'stay_ahead_low': {
-    #     'kwh_incl': 0.3204,
-    #     'daily_incl': 0.3700,
-    #     'discount_percent': 11.5,
-    # },
-    'move_master': {
-        'kwh_incl': [['0700','0900',0.3959],['0900','1700',0.2613],['1700','2100',0.3959],['2100','2300',0.2613],['2300','0700',0.1980]],
-        'daily_incl': 0.8300,
-    },
-    # 'move_master_low': {
-    #     'kwh_incl': [['0700','0900',0.4265],['0900','1700',0.2814],['1700','2100',0.4265],['2100','2300',0.2814],['2300','0700',0.2132]],
-    #     'daily_incl': 0.3400,
-    # },
-}
-
-consumption = ek.consumption(arrow.now().shift(days=-2).shift(months=-12), arrow.now())
-
-days = []
-for date in consumption:
-    data = consumption[date]
-    hours = {}
-
-    for interval in range(1, 24*2, 2):
-        interval_data = data['intervals'][str(interval)]
-        hour = int((((int(interval)-1)*30)/60)*100)
-        hours[hour] = float(interval_data['consumption']) + float(data['intervals'][str(interval+1)]['consumption'])
-
-    days.append(hours)
-
-def get_price(hour, data):
-    if type(data['kwh_incl']) is list:
-        for entry in data['kwh_incl']:
-            start = int(entry[0])
-            end = int(entry[1])
-            if end > start:
-                if hour >= start and hour < end:
-                    return entry[2]
-            else:
-                if (hour >= end and hour <= 2400) or (hour >= 0 and hour < end):
-                    return entry[2]
-
-        raise Exception('no price found!')
-    else:
-        return data['kwh_incl']
-
-totals = []
-total_kwh = 0.0
-for name in plans:
-    plan_total = 0.0
-    data = plans[name]
-    for day in days:
-        daily_total = 0.0
-        for hour in day:
-            kwh = day[hour]
-            total_kwh += kwh
-            price = get_price(hour, data)
-            daily_total += (kwh*price)
-
-        daily_total += data['daily_incl']
-        plan_total += daily_total
-    
+import numpy as np
+
+from libs.tariff import PLANS, SLOTS_PER_DAY, Tariff
+
+
+def consumption_matrix(consumption):
+    """
+    Converts ElectricKiwi.consumption output into a days x 48 matrix.
+
+    :param consumption: Dict of 'YYYY-MM-DD' to day data with 'intervals' '1'..'48'
+    :return: Tuple of (dates as datetime64[D], kWh matrix)
+    """
+    dates = np.array(list(consumption.keys()), dtype='datetime64[D]')
+    kwh = np.array([[float(consumption[date]['intervals'][str(interval)]['consumption'])
+                     for interval in range(1, SLOTS_PER_DAY + 1)] for date in consumption],
+                   dtype=float).reshape(len(dates), SLOTS_PER_DAY)
+    return dates, kwh
+
+
+def _calendars(dates, tariffs):
+    """
+    Day types only differ between plans with different holiday calendars.
+
+    :return: Tuple of (calendars x days array of day types, calendar index of each plan)
+    """
+    keys = {}
+    calendars = []
+    index = np.empty(len(tariffs), dtype=np.int64)
+    for i, tariff in enumerate(tariffs):
+        key = tariff.holidays.tobytes()
+        if key not in keys:
+            keys[key] = len(calendars)
+            calendars.append(tariff.day_types(dates))
+        index[i] = keys[key]
+    return np.stack(calendars), index
+
+
+def _discount(totals, tariffs):
+    discounts = np.array([tariff.discount_percent for tariff in tariffs])
+    return totals - discounts / 100 * totals
+
+
+def price_plans(dates, kwh, tariffs, include_discount=True):
+    """
+    Prices the same consumption under every tariff at once.
+
+    Consumption is summed per day type (weekday / weekend / holiday) and half-hour slot,
+    so each plan costs a single dot product with its rate table however many days there are.
+
+    :param dates: datetime64[D] array of days
+    :param kwh: days x 48 matrix of kWh used in each half-hour
+    :param tariffs: List of Tariff
+    :param include_discount: Apply each plan's percentage discount
+    :return: Array of total cost per tariff
+    """
+    rates = np.stack([tariff.rates for tariff in tariffs])  # plans x day types x slots
+    daily_charges = np.array([tariff.daily_charge for tariff in tariffs])
+
+    # kWh per day type and slot, once for each distinct holiday calendar
+    calendars, plan_calendar = _calendars(dates, tariffs)
+    usage = np.stack([np.eye(rates.shape[1])[day_types].T @ kwh  # day types x days @ days x slots
+                      for day_types in calendars])[plan_calendar]
+
+    totals = np.einsum('pts,pts->p', rates, usage) + daily_charges * len(dates)
+    return _discount(totals, tariffs) if include_discount else totals
+
+
+def simulate_hop(dates, kwh, tariffs, include_discount=True, chunk_size=64):
+    """
+    Prices consumption under every tariff with and without the best Hour of Power each day.
+
+    The free hour is the eligible pair of half-hours that would have cost the most that day,
+    found with a rolling two-slot sum over a plans x days x 48 cost array. An hour starting
+    at 23:30 runs into the next day, so it is only a candidate when that day is in dates.
+
+    :param dates: datetime64[D] array of days in order, there may be gaps
+    :param kwh: days x 48 matrix of kWh used in each half-hour
+    :param tariffs: List of Tariff, hop_eligible decides where the free hour may start
+    :param include_discount: Apply each plan's percentage discount
+    :param chunk_size: Plans priced together, bounds memory to chunk_size x days x 48 floats
+    :return: Dict of per-plan 'without_hop', 'with_hop' and 'hop_saving' totals, and
+             'hop_slots' (plans x days, -1 where no slot was eligible)
+    """
+    kwh = np.asarray(kwh, dtype=float)
+    days = len(dates)
+    next_day = np.zeros(days, dtype=bool)  # whether the following row is the next calendar day
+    next_day[:-1] = np.diff(dates.astype('datetime64[D]')) == np.timedelta64(1, 'D')
+    energy = np.empty(len(tariffs))
+    saving = np.empty(len(tariffs))
+    hop_slots = np.empty((len(tariffs), days), dtype=np.int64)
+
+    for offset in range(0, len(tariffs), chunk_size):
+        chunk = tariffs[offset:offset + chunk_size]
+        plans = np.arange(len(chunk))[:, None]
+        calendars, plan_calendar = _calendars(dates, chunk)
+        day_types = calendars[plan_calendar]
+        rates = np.stack([tariff.rates for tariff in chunk])[plans, day_types]
+        eligible = np.stack([tariff.hop_eligible for tariff in chunk])[plans, day_types]
+
+        cost = rates * kwh  # plans x days x slots
+        windows = cost.copy()
+        windows[:, :, :-1] += cost[:, :, 1:]
+        windows[:, :-1, -1] += cost[:, 1:, 0]
+        windows[:, ~next_day, -1] = -np.inf
+        windows = np.where(eligible, windows, -np.inf)
+
+        best = windows.argmax(axis=2)
+        best_saving = np.take_along_axis(windows, best[..., None], axis=2)[..., 0]
+        none_eligible = np.isneginf(best_saving)
+
+        energy[offset:offset + len(chunk)] = cost.sum(axis=(1, 2))
+        saving[offset:offset + len(chunk)] = np.where(none_eligible, 0, best_saving).sum(axis=1)
+        hop_slots[offset:offset + len(chunk)] = np.where(none_eligible, -1, best)
+
+    without_hop = energy + np.array([tariff.daily_charge for tariff in tariffs]) * days
+    with_hop = without_hop - saving
     if include_discount:
-        discount = (data.get('discount_percent',0)/100)*plan_total
-        plan_total -= discount
+        without_hop, with_hop = _discount(without_hop, tariffs), _discount(with_hop, tariffs)
+
+    return {
+        'without_hop': without_hop,
+        'with_hop': with_hop,
+        'hop_saving': without_hop - with_hop,
+        'hop_slots': hop_slots,
+    }
+
+
+def sweep(dates, kwh, build, include_discount=True, **parameters):
+    """
+    Grid search over tariff parameters, e.g.
+    sweep(dates, kwh, lambda rate, daily: Tariff('x', rate, daily_charge=daily), rate=[...], daily=[...])
+
+    :param build: Function taking one value of each parameter and returning a Tariff
+    :param parameters: Lists of values to try for each parameter
+    :return: List of (parameters, with_hop, without_hop) sorted by cost with the Hour of Power
+    """
+    names = list(parameters)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*parameters.values())]
+    results = simulate_hop(dates, kwh, [build(**combination) for combination in combinations], include_discount)
+    return sorted(zip(combinations, results['with_hop'].tolist(), results['without_hop'].tolist()),
+                  key=lambda x: x[1])
+
+
+def compare_plans(consumption, plans=PLANS, include_discount=True):
+    """
+    :param consumption: ElectricKiwi.consumption style dict
+    :param plans: Dict of name to Tariff
+    :return: List of [name, total] sorted cheapest first, and the total kWh
+    """
+    return rank_plans(*consumption_matrix(consumption), plans, include_discount)
+
+
+def rank_plans(dates, kwh, plans=PLANS, include_discount=True):
+    """
+    :param dates: datetime64[D] array of the days in kwh
+    :param kwh: days x 48 matrix, e.g. from consumption_matrix or archive_matrix
+    :return: As compare_plans
+    """
+    totals = price_plans(dates, kwh, list(plans.values()), include_discount)
+    return sorted(([name, float(total)] for name, total in zip(plans, totals)),
+                  key=lambda x: x[1]), float(kwh.sum())
+
+
+def archive_matrix(archive, series, start=None, end=None):
+    """
+    Builds the days x 48 matrix from meter readings in a libs.archive.MeterArchive instead of
+    Electric Kiwi, reading only the partitions between start and end (epoch ns).
+
+    :return: Tuple of (dates as datetime64[D], kWh matrix), slots without readings are 0
+    """
+    from libs.backtest import History
+
+    history = History.from_archive(archive, series, start, end)
+    return history.days, np.where(history.valid, history.half_hour_kwh, 0.0)
+
+
+def load_plans(path):
+    """
+    Loads plans from a JSON list of Tariff arguments, e.g.
+    [{"name": "kiwi", "weekday": 0.2963, "daily_charge": 0.83}]
+    """
+    with open(path, encoding='utf-8') as f:
+        return {plan['name']: Tariff(**plan) for plan in json.load(f)}
+
+
+def login_from_prompt(ek):
+    """
+    Logs in with ek_creds.txt, or asks for credentials and offers to save them.
+    """
+    ek.at_token()
+
+    loaded = False
+    try:
+        with open('ek_creds.txt') as f:
+            email = f.readline().strip()
+            password = f.readline().strip()
+
+        loaded = True
+        print("Loaded Credentials: OK")
+    except:
+        email = input('EK Email: ')
+        password = ek.password_hash(input('EK Password: '))
+
+    customer = ek.login(email, password)
+    print('Logged in: OK')
+
+    if not loaded and input('Save credentials? Y/N : ').lower() in ('y', 'yes'):
+        with open('ek_creds.txt', 'w') as f:
+            f.write(email+'\n'+password)
+
+    return customer
+
+
+def main(argv=None):
+    from libs.archive import MeterArchive
+    from libs.consumption import ConsumptionRepository
+    from libs.electrickiwi import ElectricKiwi
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--months', type=int, default=12, help='Months of consumption to compare')
+    parser.add_argument('--no-discount', action='store_true', help='Ignore percentage discounts')
+    parser.add_argument('--plans-file', help='JSON file of plans to compare instead of the built-in ones')
+    parser.add_argument('--hop', action='store_true', help='Also price each plan with the best Hour of Power every day')
+    parser.add_argument('--archive', nargs=2, metavar=('DIRECTORY', 'ENTITY_ID'),
+                        help='Use meter readings from a METER_ARCHIVE instead of Electric Kiwi')
+    args = parser.parse_args(argv)
+
+    plans = load_plans(args.plans_file) if args.plans_file else PLANS
+
+    start = arrow.now().shift(days=-2).shift(months=-args.months)
+    if args.archive:
+        dates, kwh = archive_matrix(MeterArchive(args.archive[0]), args.archive[1], start=start.int_timestamp * 10**9)
+    else:
+        ek = ElectricKiwi()
+        login_from_prompt(ek)
+        dates, kwh = consumption_matrix(ConsumptionRepository(ek).get(start, arrow.now()))
+
+    if args.hop:
+        results = simulate_hop(dates, kwh, list(plans.values()), include_discount=not args.no_discount)
+
+        print(kwh.sum())
+        for i in np.argsort(results['with_hop']):
+            print('{}: {} ({} without Hour of Power)'.format(
+                list(plans)[i], results['with_hop'][i], results['without_hop'][i]))
+        return
+
+    totals, total_kwh = rank_plans(dates, kwh, plans, include_discount=not args.no_discount)
+
+    print(total_kwh)
+    for row in totals:
+        print('{}: {}'.format(row[0], row[1]))
 
-    totals.append([name, plan_total])
 
-print(total_kwh)
-totals = sorted(totals, key=lambda x: x[1])
-for row in totals:
-    print('{}: {}'.format(row[0], row[1]))
+if __name__ == '__main__':
+    main()
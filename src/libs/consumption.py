@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import arrow
+
+DEFAULT_CACHE_PATH = 'consumption_cache.db'
+
+
+class ConsumptionRepository(object):
+    """
+    Daily Electric Kiwi consumption backed by an on-disk cache of finalised days.
+
+    Past days never change once Electric Kiwi has settled them, so they are fetched once and
+    kept in SQLite. Ranges that are not cached are split into chunks fetched in parallel.
+    """
+
+    def __init__(self, ek, path=None, chunk_days=31, max_workers=4, settle_days=3):
+        """
+        :param ek: Logged in ElectricKiwi client, shared by the fetch threads (it serialises
+                   re-logins when the session expires mid-backfill)
+        :param path: SQLite file for the cache (default is CONSUMPTION_CACHE or consumption_cache.db)
+        :param chunk_days: Maximum number of days requested in one call
+        :param max_workers: Maximum number of concurrent requests
+        :param settle_days: Days before today that are always refetched as they may still change
+        """
+        self.ek = ek
+        self.path = path or os.getenv('CONSUMPTION_CACHE', DEFAULT_CACHE_PATH)
+        self.chunk_days = chunk_days
+        self.max_workers = max_workers
+        self.settle_days = settle_days
+        self._lock = threading.Lock()
+
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS consumption_days (
+                              customer_id TEXT NOT NULL,
+                              connection_id TEXT NOT NULL,
+                              date TEXT NOT NULL,
+                              data TEXT NOT NULL,
+                              PRIMARY KEY (customer_id, connection_id, date))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self):
+        customer = self.ek._customer
+        return str(customer['id']), str(customer['connection']['id'])
+
+    def _cached(self, start, end):
+        with self._lock, self._connect() as db:
+            rows = db.execute("""SELECT date, data FROM consumption_days
+                                 WHERE customer_id = ? AND connection_id = ? AND date BETWEEN ? AND ?""",
+                              self._key() + (start.isoformat(), end.isoformat())).fetchall()
+        return {day: json.loads(data) for day, data in rows}
+
+    def _store(self, days):
+        rows = [self._key() + (day, json.dumps(data)) for day, data in days.items()]
+        with self._lock, self._connect() as db:
+            db.executemany("INSERT OR REPLACE INTO consumption_days VALUES (?, ?, ?, ?)", rows)
+
+    def _chunks(self, missing):
+        """
+        Groups missing dates into contiguous runs of at most chunk_days.
+        """
+        chunks = []
+        for day in missing:
+            if chunks and day == chunks[-1][1] + timedelta(days=1) and \
+                    (day - chunks[-1][0]).days < self.chunk_days:
+                chunks[-1][1] = day
+            else:
+                chunks.append([day, day])
+        return chunks
+
+    def _fetch(self, chunk):
+        start, end = chunk
+        return self.ek.consumption(arrow.get(start), arrow.get(end)) or {}  # no usage comes back as []
+
+    def get(self, start_date, end_date=None):
+        """
+        Returns consumption per day in the same format as ElectricKiwi.consumption.
+
+        :param start_date: First day (date, datetime or arrow)
+        :param end_date: Last day, inclusive (default is today)
+        """
+        start = _to_date(start_date)
+        end = _to_date(end_date) if end_date else date.today()
+        settled_before = date.today() - timedelta(days=self.settle_days)
+
+        days = self._cached(start, end)
+        missing = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        missing = [day for day in missing if day.isoformat() not in days or day >= settled_before]
+
+        chunks = self._chunks(missing)
+        if chunks:
+            logging.info(f"Fetching {len(missing)} days of consumption in {len(chunks)} requests")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for fetched in executor.map(self._fetch, chunks):
+                    fetched = {day: data for day, data in fetched.items()
+                               if start.isoformat() <= day <= end.isoformat()}
+                    days.update(fetched)
+                    self._store({day: data for day, data in fetched.items()
+                                 if day < settled_before.isoformat()})
+
+        return {day: days[day] for day in sorted(days)}
+
+
+def _to_date(value):
+    # arrow and datetime values have .date(), plain dates do not
+    return value.date() if hasattr(value, 'date') else value
@@ -1,9 +1,84 @@
-from os import urandom
+from os import urandom, getenv
 from hashlib import md5
 from base64 import b64encode, b64decode
 
 import pyaes
 
+# AES-256-CBC with PKCS#7 padding, provided by the fastest library that is installed.
+# The native backends are interchangeable with pyaes, which is always available as a fallback.
+
+class CryptographyBackend(object):
+    name = 'cryptography'
+
+    def __init__(self):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.primitives import padding
+
+        self._cipher    = lambda key, iv: Cipher(algorithms.AES(key), modes.CBC(iv))
+        self._padding   = padding.PKCS7(128)
+
+    def encrypt(self, key, iv, data):
+        padder    = self._padding.padder()
+        encryptor = self._cipher(key, iv).encryptor()
+        return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+    def decrypt(self, key, iv, data):
+        decryptor = self._cipher(key, iv).decryptor()
+        unpadder  = self._padding.unpadder()
+        return unpadder.update(decryptor.update(data) + decryptor.finalize()) + unpadder.finalize()
+
+class PyCryptodomeBackend(object):
+    name = 'pycryptodome'
+
+    def __init__(self):
+        from Crypto.Cipher import AES
+        from Crypto.Util.Padding import pad, unpad
+
+        self._aes   = AES
+        self._pad   = pad
+        self._unpad = unpad
+
+    def encrypt(self, key, iv, data):
+        return self._aes.new(key, self._aes.MODE_CBC, iv).encrypt(self._pad(data, 16))
+
+    def decrypt(self, key, iv, data):
+        return self._unpad(self._aes.new(key, self._aes.MODE_CBC, iv).decrypt(data), 16)
+
+class PyAESBackend(object):
+    name = 'pyaes'
+
+    def encrypt(self, key, iv, data):
+        encrypter   = pyaes.Encrypter(pyaes.AESModeOfOperationCBC(key, iv))
+        ciphertext  = encrypter.feed(data)
+        ciphertext += encrypter.feed()
+        return ciphertext
+
+    def decrypt(self, key, iv, data):
+        decrypter  = pyaes.Decrypter(pyaes.AESModeOfOperationCBC(key, iv))
+        decrypted  = decrypter.feed(data)
+        decrypted += decrypter.feed()
+        return decrypted
+
+BACKENDS = [CryptographyBackend, PyCryptodomeBackend, PyAESBackend]
+
+def get_backend(name=None):
+    """
+    Returns the named backend, or the first one whose library is installed.
+    CRYPTOJS_BACKEND can be set to force a backend.
+    """
+    name = name or getenv('CRYPTOJS_BACKEND')
+    for backend in BACKENDS:
+        if name and backend.name != name:
+            continue
+        try:
+            return backend()
+        except ImportError:
+            if name:
+                raise
+    raise ValueError('Unknown backend: {}'.format(name))
+
+default_backend = get_backend()
+
 def bytes_to_key(data, salt, output=48):
     assert len(salt) == 8, len(salt)
     data += salt
@@ -14,20 +89,18 @@ def bytes_to_key(data, salt, output=48):
         final_key += key
     return final_key[:output]
 
-def encrypt(message, passphrase):
+def encrypt(message, passphrase, backend=None):
     salt = urandom(8)
 
     key_iv = bytes_to_key(passphrase, salt, 32+16)
     key = key_iv[:32]
     iv = key_iv[32:]
 
-    encrypter   = pyaes.Encrypter(pyaes.AESModeOfOperationCBC(key, iv))
-    ciphertext  = encrypter.feed(message)
-    ciphertext += encrypter.feed()
+    ciphertext = (backend or default_backend).encrypt(key, iv, message)
 
     return b64encode(b"Salted__" + salt + ciphertext)
 
-def decrypt(encrypted, passphrase):
+def decrypt(encrypted, passphrase, backend=None):
     encrypted = b64decode(encrypted)
     assert encrypted[0:8] == b"Salted__"
 
@@ -36,8 +109,4 @@ def decrypt(encrypted, passphrase):
     key = key_iv[:32]
     iv = key_iv[32:]
 
-    decrypter  = pyaes.Decrypter(pyaes.AESModeOfOperationCBC(key, iv))
-    decrypted  = decrypter.feed(encrypted[16:])
-    decrypted += decrypter.feed()
-
-    return decrypted
\ No newline at end of file
+    return (backend or default_backend).decrypt(key, iv, encrypted[16:])
@@ -1,14 +1,238 @@
-import matplotlib.pyplot as plt
-import matplotlib
 import logging
-import pandas as pd
-import logging
-from datetime import timedelta
-import pytz
-matplotlib.use('Agg')  # Set the backend to 'Agg'
+import os
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from libs.tariff import DEFAULT_TARIFF
+
+# pandas and matplotlib are only needed by the reference implementation and plotting,
+# so they are imported lazily to keep them off the Azure Functions cold start path
+
+NZDT = ZoneInfo('Pacific/Auckland')
+
+HOUR_NS = 3600 * 10**9
+HALF_HOUR_NS = HOUR_NS // 2
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def parse_timestamps(values):
+    """
+    Parses ISO 8601 timestamps into UTC epoch-ns. Home Assistant reports UTC ('+00:00'),
+    which numpy can parse in bulk; anything else falls back to datetime.fromisoformat.
+    """
+    if all(value.endswith('+00:00') for value in values):
+        return np.array([value[:-6] for value in values], dtype='datetime64[ns]').astype(np.int64)
+
+    return np.array([(datetime.fromisoformat(value) - EPOCH) // timedelta(microseconds=1)
+                     for value in values], dtype=np.int64) * 1000
+
+
+def _readings_to_arrays(data):
+    """
+    Converts Home Assistant state objects into sorted UTC epoch-ns and kWh arrays.
+    """
+    timestamps = parse_timestamps([obj['last_changed'] for obj in data])
+    states = np.array([obj['state'] for obj in data], dtype=float)
+
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], states[order]
+
+
+def _utc_offsets(timestamps, tz=NZDT):
+    """
+    Returns the UTC offset (ns) of tz at each UTC epoch-ns timestamp.
+    """
+    return np.array([datetime.fromtimestamp(ts // 10**9, tz).utcoffset() // timedelta(microseconds=1)
+                     for ts in timestamps.tolist()], dtype=np.int64) * 1000
+
+
+def to_local(timestamps, tz=NZDT):
+    """
+    Converts UTC epoch-ns timestamps to naive local wall-clock datetime64[ns].
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    return (timestamps + _utc_offsets(timestamps, tz)).astype('datetime64[ns]')
+
+
+def _to_datetime(timestamp, tz=NZDT):
+    return datetime.fromtimestamp(timestamp // 10**9, tz)
+
+
+def sliding_window_usage(timestamps, states, starts, length=HOUR_NS):
+    """
+    Calculates the kWh used in every window [start, start + length).
+
+    Readings must be sorted by timestamp. All window boundaries are found with a single
+    searchsorted pass and the per-window max/min are taken with reduceat, so the cost is
+    O(readings + windows) rather than a full scan of the readings per window.
+
+    :param timestamps: Sorted int64 array of reading times (epoch ns)
+    :param states: Cumulative kWh readings aligned with timestamps
+    :param starts: int64 array of window start times (epoch ns)
+    :param length: Window length in ns (default is one hour)
+    :return: Tuple of (kwh, non_empty) arrays, one entry per window
+    """
+    bounds = np.searchsorted(timestamps, np.stack([starts, starts + length], axis=1).ravel())
+    lo, hi = bounds[0::2], bounds[1::2]
+    non_empty = hi > lo
+
+    # reduceat reduces states[bounds[i]:bounds[i + 1]], so every even segment is a window and
+    # the odd segments in between are discarded. Pad so the final index is always valid.
+    padded = np.append(states, np.nan)
+    kwh = np.maximum.reduceat(padded, bounds)[0::2] - np.minimum.reduceat(padded, bounds)[0::2]
+
+    return np.where(non_empty, kwh, 0.0), non_empty
+
+
+def candidate_starts(first, last, tz=NZDT):
+    """
+    Generates 60-minute interval starts on 30-minute marks between two readings (epoch ns),
+    from half past the hour of the first reading up to the hour after the last.
+    """
+    first_offset, last_offset = _utc_offsets(np.array([first, last]), tz).tolist()
+    start_time = (first + first_offset) // HOUR_NS * HOUR_NS - first_offset + HALF_HOUR_NS
+    end_time = -(-(last + last_offset) // HOUR_NS) * HOUR_NS - last_offset
+    return np.arange(start_time, end_time - HOUR_NS + 1, HALF_HOUR_NS, dtype=np.int64)
+
+
+def interpolated_window_usage(timestamps, cumulative, starts, length=HOUR_NS):
+    """
+    Calculates the kWh used in every window [start, start + length) from cumulative totals
+    known at period boundaries (e.g. Home Assistant statistics), interpolating linearly
+    when a window edge falls inside a period.
+
+    :return: Tuple of (kwh, covered) arrays; covered is False for windows outside the data
+    """
+    kwh = np.interp(starts + length, timestamps, cumulative) - np.interp(starts, timestamps, cumulative)
+    covered = (starts >= timestamps[0]) & (starts + length <= timestamps[-1])
+    return np.where(covered, kwh, 0.0), covered
+
+
+def optimal_hop_from_arrays(timestamps, states, tariff=DEFAULT_TARIFF, usage=sliding_window_usage):
+    """
+    Finds the off-peak 60-minute interval with the highest cost from sorted reading arrays.
+
+    :param timestamps: Sorted int64 array of reading times (epoch ns)
+    :param states: Cumulative kWh aligned with timestamps
+    :param tariff: Tariff used to price each interval and decide which starts are eligible
+    :param usage: Function calculating (kwh, valid) per window, see sliding_window_usage
+    :return: Tuple of (start_time, end_time, cost, kWh, intervals) or None if no interval is valid
+    """
+    if len(timestamps) == 0:
+        logging.info("No valid intervals found.")
+        return None
+
+    starts = candidate_starts(timestamps[0], timestamps[-1])
+    kwh, non_empty = usage(timestamps, states, starts)
+    index = tariff.index(to_local(starts))
+
+    # Only keep intervals that fall entirely within off-peak shoulder or off-peak night times
+    rates = tariff.rates[index]
+    valid = non_empty & tariff.hop_eligible[index]
+    valid_idx = np.flatnonzero(valid)
+    if len(valid_idx) == 0:
+        logging.info("No valid intervals found.")
+        return None
+
+    costs = kwh * rates
+    intervals = [
+        (_to_datetime(starts[i]), _to_datetime(starts[i] + HOUR_NS), float(costs[i]), float(kwh[i]))
+        for i in valid_idx
+    ]
+
+    # Find the interval with the maximum cost (first one wins on ties)
+    best = intervals[np.argmax(costs[valid_idx])]
+    return _summarise(*best, intervals)
+
+
+def calculate_optimal_hop(data, tariff=DEFAULT_TARIFF):
+    """
+    Finds the off-peak 60-minute interval (starting on a 30-minute mark) with the highest cost.
 
+    Only uses numpy and the standard library, so it is safe for the production cold start path.
+
+    :param data: List of Home Assistant state objects with 'last_changed' and 'state' keys
+    :param tariff: Tariff used to price each interval and decide which starts are eligible
+    :return: Tuple of (start_time, end_time, cost, kWh, intervals) or None if no interval is valid
+    """
+    timestamps, states = _readings_to_arrays(data)
+    return optimal_hop_from_arrays(timestamps, states, tariff)
+
+
+def calculate_optimal_hop_from_statistics(statistics, tariff=DEFAULT_TARIFF):
+    """
+    Same as calculate_optimal_hop, but from Home Assistant long-term statistics
+    (see home_assistant.get_statistics) instead of raw state history.
+    """
+    if not statistics:
+        logging.info("No valid intervals found.")
+        return None
+
+    # Cumulative total at every period boundary: each period's end, plus the start of the
+    # first period when Home Assistant reported its change
+    timestamps = [row["end"] for row in statistics]
+    cumulative = [row["sum"] for row in statistics]
+    first = statistics[0]
+    if first.get("change") is not None:
+        timestamps.insert(0, first["start"])
+        cumulative.insert(0, first["sum"] - first["change"])
+
+    timestamps = np.array(timestamps, dtype=float) * 10**6
+    cumulative = np.array(cumulative, dtype=float)
+
+    return optimal_hop_from_arrays(timestamps.astype(np.int64), cumulative, tariff,
+                                   usage=interpolated_window_usage)
+
+
+def select_optimiser():
+    """
+    Returns the optimiser chosen by HOP_OPTIMISER: 'numpy' (default) or 'pandas' for the
+    original DataFrame implementation.
+    """
+    if os.getenv("HOP_OPTIMISER", "numpy") == "pandas":
+        return calculate_optimal_hop_reference
+    return calculate_optimal_hop
+
+
+def best_interval(intervals):
+    """
+    :return: The (start, end, cost, kWh) interval with the highest cost, the first one on ties,
+             which is the one every optimiser reports as the HOP
+    """
+    return max(intervals, key=lambda interval: interval[2])
+
+
+def _summarise(max_usage_start, max_usage_end, max_usage_cost, max_usage_kwh, intervals):
+    # Format the start and end times for the Power Company API
+    simple_start_time = max_usage_start.strftime("%I:%M %p")
+    simple_end_time = max_usage_end.strftime("%I:%M %p")
+
+    # Round cost and kWh to two decimal places
+    max_usage_cost = round(max_usage_cost, 2)
+    max_usage_kwh = round(max_usage_kwh, 2)
+
+    # Output the result
+    logging.info(
+        f"The 60-minute interval with the highest cost is from {max_usage_start} to {max_usage_end} NZDT")
+    logging.info(
+        f"Cost during this interval: {max_usage_cost} currency units")
+    logging.info(f"Power used during this interval: {max_usage_kwh} kWh")
+    logging.info(f"Formatted start time for API: {simple_start_time}")
+    logging.info(f"Formatted end time for API: {simple_end_time}")
+
+    # Return the formatted start time, end time, cost, and kWh for further use if needed
+    return simple_start_time, simple_end_time, max_usage_cost, max_usage_kwh, intervals
+
+
+def calculate_optimal_hop_reference(data):
+    """
+    Original loop-based implementation, kept as the reference for equivalence tests.
+    It rescans the whole DataFrame for every candidate interval, so do not use it on large inputs.
+    """
+    import pandas as pd
+    import pytz
 
-def calculate_optimal_hop(data):
     # Define the UTC and NZDT timezones
     utc = pytz.utc
     nzdt = pytz.timezone('Pacific/Auckland')
@@ -57,9 +281,9 @@ def calculate_optimal_hop(data):
     def calculate_60min_intervals(df):
         intervals = []
         # Generate 60-minute intervals starting at 30-minute marks
-        start_time = df['last_changed'].min().floor('H') + \
+        start_time = df['last_changed'].min().floor('h') + \
             timedelta(minutes=30)
-        end_time = df['last_changed'].max().ceil('H')
+        end_time = df['last_changed'].max().ceil('h')
 
         current_time = start_time
         while current_time <= end_time - timedelta(hours=1):
@@ -87,32 +311,93 @@ def calculate_optimal_hop(data):
     # Find the interval with the maximum cost
     if intervals:
         max_interval = max(intervals, key=lambda x: x[2])
-        max_usage_start, max_usage_end, max_usage_cost, max_usage_kwh = max_interval
-
-        # Format the start and end times for the Power Company API
-        simple_start_time = max_usage_start.strftime("%I:%M %p")
-        simple_end_time = max_usage_end.strftime("%I:%M %p")
-
-        # Round cost and kWh to two decimal places
-        max_usage_cost = round(max_usage_cost, 2)
-        max_usage_kwh = round(max_usage_kwh, 2)
-
-        # Output the result
-        logging.info(
-            f"The 60-minute interval with the highest cost is from {max_usage_start} to {max_usage_end} NZDT")
-        logging.info(
-            f"Cost during this interval: {max_usage_cost} currency units")
-        logging.info(f"Power used during this interval: {max_usage_kwh} kWh")
-        logging.info(f"Formatted start time for API: {simple_start_time}")
-        logging.info(f"Formatted end time for API: {simple_end_time}")
-
-        # Return the formatted start time, end time, cost, and kWh for further use if needed
-        return simple_start_time, simple_end_time, max_usage_cost, max_usage_kwh, intervals
+        return _summarise(*max_interval, intervals)
     else:
         logging.info("No valid intervals found.")
         return None
 
 
+def render_intervals(intervals, dpi=72):
+    """
+    Draws the cost of every candidate interval as a horizontal bar chart, with the chosen
+    hour highlighted, and returns it as PNG bytes.
+
+    Uses the object-oriented Figure API rather than pyplot, so no global figure is kept
+    alive in a warm worker and it is safe to call from a background thread.
+
+    :param intervals: List of (start_time, end_time, cost, kWh) tuples
+    :param dpi: Resolution; the default keeps the PNG small enough for a notification
+    :return: PNG bytes, or None if there are no intervals
+    """
+    if not intervals:
+        return None
+
+    from io import BytesIO
+    from matplotlib.figure import Figure
+
+    costs = [interval[2] for interval in intervals]
+    best = max(range(len(costs)), key=costs.__getitem__)
+    colors = ['orange' if i == best else 'skyblue' for i in range(len(costs))]
+
+    fig = Figure(figsize=(8, max(4, len(intervals) * 0.22)), dpi=dpi)
+    ax = fig.add_subplot()
+    bars = ax.barh(range(len(intervals)), costs, color=colors, edgecolor='black', linewidth=0.5)
+    ax.set_xlabel('Cost (currency units)')
+    ax.set_yticks(range(len(intervals)))
+    ax.set_yticklabels([f'{start.strftime("%I:%M %p")} - {end.strftime("%I:%M %p")}'
+                        for start, end, _, _ in intervals], fontsize=7)
+    ax.invert_yaxis()
+    ax.set_title('Cost of 60-minute Intervals')
+    ax.bar_label(bars, fmt='%.2f', padding=2, fontsize=7)
+    fig.tight_layout()
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', pil_kwargs={"optimize": True})
+    return buffer.getvalue()
+
+
+_chart_executor = None
+
+
+def render_intervals_in_background(intervals, timings=None):
+    """
+    Starts render_intervals on a background thread, so callers can set the HOP first and
+    collect the chart only when they are ready to send the notification.
+
+    :param timings: Optional Timings to record a 'chart' span on
+    :return: Future of the PNG bytes
+    """
+    global _chart_executor
+    if _chart_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        # One thread: matplotlib's font and text caches are not built for concurrent use
+        _chart_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart")
+
+    def render():
+        if timings is None:
+            return render_intervals(intervals)
+        with timings.span("chart", rows=len(intervals)) as span:
+            png = render_intervals(intervals)
+            span["bytes"] = len(png or b"")
+            return png
+
+    return _chart_executor.submit(render)
+
+
+def chart_or_none(future, timeout=10):
+    """
+    Waits up to timeout seconds for a background chart. A slow or failed chart is logged and
+    dropped, so it never holds up or breaks the notification.
+    """
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=timeout)
+    except Exception as e:
+        logging.warning(f"Chart not attached: {type(e).__name__}: {e}")
+        return None
+
+
 def plot_intervals(intervals, filename='intervals_plot.png'):
     """
     Plots the intervals and their associated costs, and saves the plot to a PNG file.
@@ -121,36 +406,11 @@ def plot_intervals(intervals, filename='intervals_plot.png'):
                       Example: [(start_time, end_time, cost, kWh), ...]
     :param filename: Name of the file to save the plot to. Default is 'intervals_plot.png'.
     """
-    if not intervals:
+    png = render_intervals(intervals)
+    if png is None:
         print("No intervals to plot.")
         return
 
-    # Extract data for plotting
-    start_times = [interval[0] for interval in intervals]
-    end_times = [interval[1] for interval in intervals]
-    costs = [interval[2] for interval in intervals]
-    kwhs = [interval[3] for interval in intervals]
-
-    # Create a figure and axis
-    fig, ax1 = plt.subplots(figsize=(12, 8))
-
-    # Bar chart for costs
-    bars = ax1.barh(range(len(intervals)), costs,
-                    color='skyblue', edgecolor='black')
-    ax1.set_xlabel('Cost (currency units)')
-    ax1.set_ylabel('Intervals')
-    ax1.set_yticks(range(len(intervals)))
-    ax1.set_yticklabels(
-        [f'{start.strftime("%I:%M %p")} - {end.strftime("%I:%M %p")}' for start, end in zip(start_times, end_times)])
-    ax1.set_title('Cost of 60-minute Intervals')
-
-    # Adding value labels on the bars
-    for bar in bars:
-        width = bar.get_width()
-        ax1.text(width + 0.01, bar.get_y() + bar.get_height() / 2,
-                 f'{width:.2f}', va='center', ha='left')
-
-    # Save the plot to a PNG file
-    plt.tight_layout()
-    plt.savefig(filename, format='png')
+    with open(filename, 'wb') as f:
+        f.write(png)
     print(f"Plot saved to {filename}")
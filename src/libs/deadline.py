@@ -0,0 +1,58 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from libs.data import NZDT
+
+# Seconds before local midnight the HOP must be set by
+DEFAULT_MARGIN_SECONDS = 30
+
+# Seconds kept back from the analysis for Electric Kiwi to set the HOP
+DEFAULT_SET_RESERVE_SECONDS = 30
+
+
+class Deadline(object):
+    """
+    A point in time a run has to finish by, used to derive the timeout of every call on the way.
+    """
+
+    def __init__(self, at):
+        """
+        :param at: Aware datetime
+        """
+        self.at = at
+
+    @classmethod
+    def before_midnight(cls, margin=None, now=None):
+        """
+        :param margin: Seconds before the next local midnight (default is HOP_DEADLINE_MARGIN_SECONDS or 30)
+        """
+        if margin is None:
+            margin = float(os.getenv("HOP_DEADLINE_MARGIN_SECONDS", DEFAULT_MARGIN_SECONDS))
+        local = (now or datetime.now(timezone.utc)).astimezone(NZDT)
+        midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time(), NZDT)
+        return cls(midnight - timedelta(seconds=margin))
+
+    def before(self, seconds):
+        """
+        :return: A Deadline the given number of seconds earlier, e.g. to keep time for later stages
+        """
+        return Deadline(self.at - timedelta(seconds=seconds))
+
+    def remaining(self):
+        return max(0.0, (self.at - datetime.now(timezone.utc)).total_seconds())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, limit=None, minimum=1.0):
+        """
+        Seconds to give one call: what is left, capped at limit. Never below minimum, because
+        requests and websockets treat 0 as no timeout or fail outright.
+        """
+        remaining = self.remaining()
+        if limit is not None:
+            remaining = min(remaining, limit)
+        return max(remaining, minimum)
+
+    def __repr__(self):
+        return f"Deadline({self.at.isoformat()}, {self.remaining():.1f}s left)"
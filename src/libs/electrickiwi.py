@@ -2,9 +2,18 @@ import requests
 import random
 import time
 import arrow
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from functools import lru_cache
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from hashlib import md5
-from decimal import Decimal
 
 from libs.cryptoJS import encrypt
 
@@ -33,43 +42,157 @@ class Hour(object):
 class ElectricException(Exception):
     pass
 
-class ElectricKiwi(object):
-    _secret          = None
-    _secret_position = None
-    _sid             = None
-    _customer        = None
-
-    def __init__(self, at_token=None):
-        if at_token:
-            self.at_token(at_token)
-
-    def login(self, email, password_hash, customer_index=0):
-        payload = {
-            'email'   : email,
-            'password': password_hash,
-        }
-
-        data = self.request('/login/', payload, type='POST')
-
-        self._sid      = data['sid']
-        self._customer = data['customer'][customer_index]
+class ElectricAuthException(ElectricException):
+    pass
 
-        return self._customer
+SESSION_TTL     = 6 * 60 * 60  # seconds a saved at token + sid is reused for
+REQUEST_TIMEOUT = 30
+
+_shared_session      = None
+_shared_session_lock = threading.Lock()
+
+def shared_session():
+    """
+    Keep-alive session shared by all clients in the process, so warm invocations and
+    concurrent households reuse TCP+TLS connections. Failed requests are retried with backoff,
+    but a POST (/login/, setting the HOP) only when the connection failed before it was sent.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=Retry.DEFAULT_ALLOWED_METHODS)
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_maxsize=32, max_retries=retry))
+            _shared_session = session
+        return _shared_session
+
+class SessionCache(object):
+    """
+    Remembers the at token and login (sid + customer) per account so they can be reused
+    until they expire. Kept in memory and, when a path is given, in a JSON file.
+    """
+    def __init__(self, path=None, ttl=SESSION_TTL):
+        self.path  = path
+        self.ttl   = ttl
+        self._lock = threading.Lock()
+        self._data = {}
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError('expected an object')
+                self._data = data
+            except (OSError, ValueError) as e:
+                # Treated as an empty cache, the next login overwrites the file
+                logging.warning('Ignoring unreadable Electric Kiwi session file {}: {}: {}'.format(path, type(e).__name__, e))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+        if entry and time.time() - entry['saved_at'] < self.ttl:
+            return entry
+        return None
+
+    def set(self, key, at_token, sid, customer):
+        with self._lock:
+            self._data[key] = {'at_token': at_token, 'sid': sid, 'customer': customer, 'saved_at': time.time()}
+            self._save()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._save()
+
+    def _save(self):
+        # Saving only spares the next process a login, so a failure must not fail this one
+        if self.path:
+            try:
+                save_json(self.path, self._data)
+            except (OSError, TypeError, ValueError) as e:
+                logging.warning('Electric Kiwi session not saved to {}: {}: {}'.format(self.path, type(e).__name__, e))
+
+def save_json(path, data):
+    """
+    Writes JSON through a temporary file in the same directory and renames it into place, so
+    the file is never left half written.
+    """
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+@lru_cache(maxsize=1)
+def default_session_cache():
+    """
+    Process-wide SessionCache, persisted to ELECTRIC_KIWI_SESSION_FILE when it is set.
+    """
+    return SessionCache(os.getenv('ELECTRIC_KIWI_SESSION_FILE'))
+
+API_URL = 'https://api.electrickiwi.co.nz'
+
+class ElectricKiwiBase(object):
+    """
+    State and request building shared by the sync and async clients. All state is kept per
+    instance, so separate clients can be used concurrently.
+    """
+    def __init__(self, session_cache=None):
+        self._secret          = None
+        self._secret_position = None
+        self._sid             = None
+        self._customer        = None
+        self._at_token        = None
+        self._credentials     = None
+        self._session_cache   = session_cache
 
     def password_hash(self, password):
         return md5(password.encode('utf-8')).hexdigest()
 
-    def at_token(self, at_token=None):
-        if not at_token:
-            data = self.request('/at/')
-            at_token = data['token']
-            
+    def _set_at_token(self, at_token):
+        self._at_token        = at_token
         self._secret          = at_token[2:-2]
         self._secret_position = int(at_token[:2])
 
         return at_token
 
-    def request(self, endpoint, params=None, type='GET'):
+    def _set_login(self, data, email, password_hash, customer_index):
+        self._sid         = data['sid']
+        self._customer    = data['customer'][customer_index]
+        self._credentials = (email, password_hash, customer_index)
+
+        if self._session_cache:
+            self._session_cache.set(self._cache_key(), self._at_token, self._sid, self._customer)
+
+        return self._customer
+
+    def _load_saved_login(self, email, password_hash, customer_index):
+        self._credentials = (email, password_hash, customer_index)
+
+        saved = self._session_cache.get(self._cache_key()) if self._session_cache else None
+        if saved:
+            self._set_at_token(saved['at_token'])
+            self._sid      = saved['sid']
+            self._customer = saved['customer']
+            return self._customer
+
+        return None
+
+    def _forget_login(self):
+        if self._session_cache:
+            self._session_cache.delete(self._cache_key())
+        self._secret = self._sid = None
+
+    def _cache_key(self):
+        email, _, customer_index = self._credentials
+        return '{}#{}'.format(email.lower(), customer_index)
+
+    def _headers(self, endpoint):
         headers = {
             'x-client': 'ek-app', 
             'x-apiversion': '2_2',
@@ -86,11 +209,14 @@ class ElectricKiwi(object):
         if self._sid:
             headers['x-sid'] = self._sid
 
-        data = requests.request(type, 'https://api.electrickiwi.co.nz{}'.format(endpoint), headers=headers, json=params).json()
-        if 'error' in data:
-            raise ElectricException(data['error']['detail'])
+        return headers
 
-        return data['data']
+    def _can_relogin(self, endpoint):
+        return self._credentials is not None and endpoint not in ('/at/', '/login/')
+
+    @staticmethod
+    def _is_auth_error(status_code, data):
+        return status_code in (401, 403) or str(data['error'].get('code')) in ('401', '403')
 
     def _get_token(self, endpoint):
         length = random.randint(10, len(self._secret) - 2)
@@ -101,9 +227,8 @@ class ElectricKiwi(object):
 
         return encrypted[:self._secret_position] + str(length) + encrypted[self._secret_position:]
 
-    def get_hours(self, hop_only=False):
-        data = self.request('/hop/')
-
+    @staticmethod
+    def _parse_hours(data, hop_only=False):
         hours = {}
         for interval in sorted(data['intervals'].keys(), key=lambda x: int(x)):
             row = data['intervals'][interval]
@@ -116,100 +241,160 @@ class ElectricKiwi(object):
 
         return hours
 
+    @staticmethod
+    def _parse_hop_hour(data):
+        return Hour(data['start']['interval'], data['start']['start_time'], data['end']['end_time'], 1)
+
     def _require_login(self):
         if not self._sid:
             raise ElectricException('You need to login first')
 
-    def consumption(self, start_date=None, end_date=None):
-        self._require_login()
-
+    def _consumption_endpoint(self, start_date=None, end_date=None):
         start_date = start_date or arrow.now().shift(days=-9)
         end_date   = end_date   or start_date.shift(days=7)
 
-        data = self.request('/consumption/averages/{customer_id}/{connection_id}/?start_date={start_date}&end_date={end_date}&group_by=day'
+        return ('/consumption/averages/{customer_id}/{connection_id}/?start_date={start_date}&end_date={end_date}&group_by=day'
                 .format(customer_id=self._customer['id'], connection_id=self._customer['connection']['id'], start_date=start_date.format('YYYY-MM-DD'), end_date=end_date.format('YYYY-MM-DD')))
 
+    def _running_balance_endpoint(self):
+        return '/account/running_balance/{customer_id}/'.format(customer_id=self._customer['id'])
+
+    def _connection_details_endpoint(self):
+        return '/connection/details/{customer_id}/{connection_id}/'.format(customer_id=self._customer['id'], connection_id=self._customer['connection']['id'])
+
+    def _hop_endpoint(self):
+        return '/hop/{customer_id}/{connection_id}/'.format(customer_id=self._customer['id'], connection_id=self._customer['connection']['id'])
+
+class ElectricKiwi(ElectricKiwiBase):
+    def __init__(self, at_token=None, session=None, session_cache=None):
+        super().__init__(session_cache)
+        self._session = session or shared_session()
+        self.timeout  = REQUEST_TIMEOUT  # seconds per request, lowered as a deadline nears
+
+        # Threads may share a client (e.g. ConsumptionRepository), so a re-login replaces the
+        # token and sid under this lock, and requests read a consistent pair
+        self._relogin_lock = threading.RLock()
+
+        if at_token:
+            self.at_token(at_token)
+
+    def login(self, email, password_hash, customer_index=0):
+        payload = {
+            'email'   : email,
+            'password': password_hash,
+        }
+
+        data = self.request('/login/', payload, type='POST')
+        return self._set_login(data, email, password_hash, customer_index)
+
+    def ensure_login(self, email, password_hash, customer_index=0):
+        """
+        Logs in, reusing a saved at token and sid when the session cache has a fresh one.
+        Expired sessions are detected on use and transparently replaced (see request).
+        """
+        return self._load_saved_login(email, password_hash, customer_index) or self._relogin()
+
+    def _relogin(self, stale_sid=None):
+        with self._relogin_lock:
+            if stale_sid is not None and self._sid != stale_sid:
+                return self._customer  # another thread already logged in again
+
+            email, password_hash, customer_index = self._credentials
+            self._forget_login()
+            self.at_token()
+            return self.login(email, password_hash, customer_index)
+
+    def at_token(self, at_token=None):
+        if not at_token:
+            data = self.request('/at/')
+            at_token = data['token']
+
+        return self._set_at_token(at_token)
+
+    def request(self, endpoint, params=None, type='GET', retry_auth=True):
+        with self._relogin_lock:
+            headers, sid = self._headers(endpoint), self._sid
+
+        response = self._session.request(type, API_URL + endpoint, headers=headers, json=params, timeout=self.timeout)
+        data = response.json()
+        if 'error' in data:
+            if self._is_auth_error(response.status_code, data):
+                # The saved at token or sid has expired, log in again once and retry
+                if retry_auth and self._can_relogin(endpoint):
+                    self._relogin(stale_sid=sid)
+                    return self.request(endpoint, params, type, retry_auth=False)
+                raise ElectricAuthException(data['error']['detail'])
+            raise ElectricException(data['error']['detail'])
+
+        return data['data']
+
+    def get_hours(self, hop_only=False):
+        return self._parse_hours(self.request('/hop/'), hop_only)
+
+    def hop_catalogue(self, cache=None):
+        """
+        The HOP interval table for mapping times to interval ids, fetched from /hop/ at most
+        once a day (see libs.hop_catalogue).
+        """
+        from libs.hop_catalogue import HopCatalogue, default_hop_catalogue_cache
+
+        cache = cache or default_hop_catalogue_cache()
+        return cache.get(lambda: HopCatalogue.from_response(self.request('/hop/')))
+
+    def consumption(self, start_date=None, end_date=None):
+        self._require_login()
+
+        data = self.request(self._consumption_endpoint(start_date, end_date))
         return data['usage']
 
     def running_balance(self):
         self._require_login()
 
-        data = self.request('/account/running_balance/{customer_id}/'.format(customer_id=self._customer['id']))
+        data = self.request(self._running_balance_endpoint())
         return data
 
     def connection_details(self):
         self._require_login()
 
-        data = self.request('/connection/details/{customer_id}/{connection_id}/'.format(customer_id=self._customer['id'], connection_id=self._customer['connection']['id']))
+        data = self.request(self._connection_details_endpoint())
         return data
     
     def get_hop_hour(self):
         self._require_login()
 
-        data = self.request('/hop/{customer_id}/{connection_id}/'.format(customer_id=self._customer['id'], connection_id=self._customer['connection']['id']))
-        return Hour(data['start']['interval'], data['start']['start_time'], data['end']['end_time'], 1)
+        data = self.request(self._hop_endpoint())
+        return self._parse_hop_hour(data)
 
     def set_hop_hour(self, hour):
         self._require_login()
         interval = hour.interval if type(hour) == Hour else int(hour)
-        data = self.request('/hop/{customer_id}/{connection_id}/'.format(customer_id=self._customer['id'], connection_id=self._customer['connection']['id']), params={'start': interval}, type='POST')
-        return Hour(data['start']['interval'], data['start']['start_time'], data['end']['end_time'], 1)
+        data = self.request(self._hop_endpoint(), params={'start': interval}, type='POST')
+        return self._parse_hop_hour(data)
 
-def hop_score():
-    ek       = ElectricKiwi()
-    token    = ek.at_token()
-
-    loaded = False
-    try:
-        with open('ek_creds.txt') as f:
-            email    = f.readline().strip()
-            password = f.readline().strip()
-
-        loaded = True
-        print("Loaded Credentials: OK")
-    except:
-        email    = input('EK Email: ')
-        password = ek.password_hash(input('EK Password: '))
-    
-    customer = ek.login(email, password)
-    print('Logged in: OK')
+def hop_score(months=1):
+    """
+    Prints how well the Hour of Power was chosen each day, see libs.hop_score for the API.
+    """
+    from libs.compare_plans import login_from_prompt
+    from libs.hop_score import MISSED_THRESHOLD_WH, HopScoreRepository, format_summary, summarise_scores
 
-    if not loaded and input('Save credentials? Y/N : ').lower() in ('y', 'yes'):
-        with open('ek_creds.txt', 'w') as f:
-            f.write(email+'\n'+password)
+    ek = ElectricKiwi()
+    login_from_prompt(ek)
 
-    connection  = ek.connection_details()
-
-    kwh_cost    = Decimal(connection['pricing_plan']['usage_rate_inc_gst'])
-    wrong_kwh   = Decimal('0.0')
-    hop_savings = Decimal('0.0')
+    rate   = ek.connection_details()['pricing_plan']['usage_rate_inc_gst']
+    scores = HopScoreRepository(ek)
 
     print("")
-    consumption = ek.consumption(arrow.now().shift(days=-2).shift(months=-1), arrow.now())
-    for date in consumption:
-        data = consumption[date]
-
-        hop_usage = Decimal(data['consumption_adjustment'])
-        hop_savings += hop_usage
-
-        for interval in range(1, 24*2):
-            interval_data = data['intervals'][str(interval)]
-            if interval_data['hop_best']:
-                hop_best = Decimal(interval_data['consumption']) + Decimal(data['intervals'][str(interval+1)]['consumption'])
-                break
-
-        date = arrow.get(date, 'YYYY-MM-DD').format('DD/MM/YYYY')
-
-        diff = hop_best - hop_usage
-        if diff > 0.01:
-            wrong_kwh += diff
-            print('{} - Wrong HOP: {}kWh vs {}kWh ({}kWh)'.format(date, hop_best, hop_usage, diff))
+    dates, hop_wh, best_wh = scores.days(arrow.now().shift(days=-2).shift(months=-months), arrow.now())
+    for date, hop, best in zip(dates, hop_wh, best_wh):
+        date = arrow.get(str(date), 'YYYY-MM-DD').format('DD/MM/YYYY')
+        if best - hop > MISSED_THRESHOLD_WH:
+            print('{} - Wrong HOP: {}kWh vs {}kWh ({}kWh)'.format(date, best / 1000, hop / 1000, (best - hop) / 1000))
         else:
-            print('{} - Correct HOP: {}kWh'.format(date, hop_usage))
+            print('{} - Correct HOP: {}kWh'.format(date, hop / 1000))
 
-    print('\nHOP Savings: {}kWh (${:.2f})'.format(hop_savings, hop_savings * kwh_cost))
-    print('Missed HOP: {}kWh (${:.2f})'.format(wrong_kwh, wrong_kwh * kwh_cost))
-    print('HOP Score: {:.2f}%'.format(Decimal(100.0) - ((wrong_kwh / hop_savings) * 100)))
+    print('')
+    print(format_summary(summarise_scores(hop_wh, best_wh, rate)))
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,134 @@
+import asyncio
+
+import aiohttp
+
+from libs.electrickiwi import (API_URL, REQUEST_TIMEOUT, ElectricAuthException, ElectricException,
+                               ElectricKiwiBase, Hour)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncElectricKiwi(ElectricKiwiBase):
+    """
+    asyncio version of ElectricKiwi with the same methods. Independent calls can be awaited
+    together, e.g. asyncio.gather(ek.connection_details(), ek.get_hop_hour()).
+
+    Use as an async context manager, or pass an existing aiohttp.ClientSession (which is
+    then left open). aiohttp is not a production dependency, install it to use this client.
+    """
+
+    def __init__(self, session=None, session_cache=None, retries=3, backoff=0.5, api_url=API_URL):
+        super().__init__(session_cache)
+        self._api_url       = api_url
+        self._session       = session
+        self._owns_session  = session is None
+        self._retries       = retries
+        self._backoff       = backoff
+        self._relogin_lock  = asyncio.Lock()
+
+    async def __aenter__(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def login(self, email, password_hash, customer_index=0):
+        payload = {
+            'email'   : email,
+            'password': password_hash,
+        }
+
+        data = await self.request('/login/', payload, type='POST')
+        return self._set_login(data, email, password_hash, customer_index)
+
+    async def ensure_login(self, email, password_hash, customer_index=0):
+        return self._load_saved_login(email, password_hash, customer_index) or await self._relogin()
+
+    async def _relogin(self, stale_sid=None):
+        async with self._relogin_lock:
+            if stale_sid is not None and self._sid != stale_sid:
+                return self._customer  # another call already logged in again
+
+            email, password_hash, customer_index = self._credentials
+            self._forget_login()
+            await self.at_token()
+            return await self.login(email, password_hash, customer_index)
+
+    async def at_token(self, at_token=None):
+        if not at_token:
+            data = await self.request('/at/')
+            at_token = data['token']
+
+        return self._set_at_token(at_token)
+
+    async def _send(self, type, endpoint, params):
+        # A POST (/login/, setting the HOP) may have reached the server, so it is only retried
+        # when the connection could not be made
+        if self._session is None:
+            raise ElectricException('No open session, use AsyncElectricKiwi as an async context manager or pass a session')
+
+        idempotent = type != 'POST'
+        for attempt in range(self._retries + 1):
+            try:
+                async with self._session.request(type, self._api_url + endpoint, headers=self._headers(endpoint), json=params) as response:
+                    if response.status not in RETRY_STATUSES or not idempotent or attempt == self._retries:
+                        return response.status, await response.json(content_type=None)
+            except aiohttp.ClientConnectorError:
+                if attempt == self._retries:
+                    raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not idempotent or attempt == self._retries:
+                    raise
+            await asyncio.sleep(self._backoff * 2 ** attempt)
+
+    async def request(self, endpoint, params=None, type='GET', retry_auth=True):
+        sid = self._sid
+        status, data = await self._send(type, endpoint, params)
+        if 'error' in data:
+            if self._is_auth_error(status, data):
+                # The saved at token or sid has expired, log in again once and retry
+                if retry_auth and self._can_relogin(endpoint):
+                    await self._relogin(stale_sid=sid)
+                    return await self.request(endpoint, params, type, retry_auth=False)
+                raise ElectricAuthException(data['error']['detail'])
+            raise ElectricException(data['error']['detail'])
+
+        return data['data']
+
+    async def get_hours(self, hop_only=False):
+        return self._parse_hours(await self.request('/hop/'), hop_only)
+
+    async def consumption(self, start_date=None, end_date=None):
+        self._require_login()
+
+        data = await self.request(self._consumption_endpoint(start_date, end_date))
+        return data['usage']
+
+    async def running_balance(self):
+        self._require_login()
+
+        return await self.request(self._running_balance_endpoint())
+
+    async def connection_details(self):
+        self._require_login()
+
+        return await self.request(self._connection_details_endpoint())
+
+    async def get_hop_hour(self):
+        self._require_login()
+
+        data = await self.request(self._hop_endpoint())
+        return self._parse_hop_hour(data)
+
+    async def set_hop_hour(self, hour):
+        self._require_login()
+        interval = hour.interval if type(hour) == Hour else int(hour)
+        data = await self.request(self._hop_endpoint(), params={'start': interval}, type='POST')
+        return self._parse_hop_hour(data)
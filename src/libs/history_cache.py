@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from libs.home_assistant import clean_usage_data, get_usage_data
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _epoch_us(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _to_epoch_us(last_changed):
+    return _epoch_us(datetime.fromisoformat(last_changed))
+
+
+def _from_epoch_us(timestamp):
+    return EPOCH + timedelta(microseconds=timestamp)
+
+
+class SQLiteHistoryStore(object):
+    """
+    Stores readings in a local SQLite database, one row per (entity, timestamp).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS readings (
+                              entity_id TEXT NOT NULL,
+                              timestamp INTEGER NOT NULL,
+                              last_changed TEXT NOT NULL,
+                              state TEXT NOT NULL,
+                              PRIMARY KEY (entity_id, timestamp))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def watermark(self, entity_id):
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT MAX(timestamp) FROM readings WHERE entity_id = ?",
+                             (entity_id,)).fetchone()
+        return row[0]
+
+    def append(self, entity_id, readings):
+        rows = [(entity_id, _to_epoch_us(obj["last_changed"]), obj["last_changed"], obj["state"])
+                for obj in readings]
+        with self._lock, self._connect() as db:
+            db.executemany("INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?)", rows)
+
+    def read(self, entity_id, since):
+        with self._lock, self._connect() as db:
+            rows = db.execute("""SELECT last_changed, state FROM readings
+                                 WHERE entity_id = ? AND timestamp >= ? ORDER BY timestamp""",
+                              (entity_id, since)).fetchall()
+        return [{"state": state, "last_changed": last_changed} for last_changed, state in rows]
+
+    def prune(self, entity_id, before):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM readings WHERE entity_id = ? AND timestamp < ?",
+                       (entity_id, before))
+
+
+class BlobHistoryStore(object):
+    """
+    Stores each entity's readings as a JSON blob in Azure Storage (Azurite when running locally).
+    """
+
+    def __init__(self, connection_string, container="history-cache"):
+        from azure.storage.blob import BlobServiceClient  # Only needed when deployed
+
+        self._container = BlobServiceClient.from_connection_string(
+            connection_string).get_container_client(container)
+        if not self._container.exists():
+            self._container.create_container()
+        self._readings = {}
+
+    def _blob_name(self, entity_id):
+        return f"{entity_id}.json"
+
+    def _load(self, entity_id):
+        if entity_id not in self._readings:
+            blob = self._container.get_blob_client(self._blob_name(entity_id))
+            rows = json.loads(blob.download_blob().readall()) if blob.exists() else []
+            self._readings[entity_id] = {row[0]: row for row in rows}
+        return self._readings[entity_id]
+
+    def _save(self, entity_id):
+        rows = sorted(self._readings[entity_id].values())
+        self._container.upload_blob(self._blob_name(entity_id), json.dumps(rows), overwrite=True)
+
+    def watermark(self, entity_id):
+        readings = self._load(entity_id)
+        return max(readings) if readings else None
+
+    def append(self, entity_id, readings):
+        rows = self._load(entity_id)
+        for obj in readings:
+            timestamp = _to_epoch_us(obj["last_changed"])
+            rows[timestamp] = [timestamp, obj["last_changed"], obj["state"]]
+        self._save(entity_id)
+
+    def read(self, entity_id, since):
+        rows = sorted(row for row in self._load(entity_id).values() if row[0] >= since)
+        return [{"state": state, "last_changed": last_changed} for _, last_changed, state in rows]
+
+    def prune(self, entity_id, before):
+        rows = self._load(entity_id)
+        for timestamp in [t for t in rows if t < before]:
+            del rows[timestamp]
+        self._save(entity_id)
+
+
+class HistoryCache(object):
+    """
+    Keeps already fetched Home Assistant readings so each run only requests new ones.
+    """
+
+    def __init__(self, store, retention=timedelta(days=31)):
+        """
+        :param store: SQLiteHistoryStore, BlobHistoryStore or any object with the same methods
+        :param retention: How long readings are kept in the store
+        """
+        self.store = store
+        self.retention = retention
+
+    def get_usage_data(self, url, token, entity_id, lookback=timedelta(days=1), timeout=None):
+        """
+        Returns cleaned readings for the last `lookback`, fetching only the readings newer than
+        the last cached one (the watermark) from Home Assistant.
+
+        :param timeout: Optional seconds to wait for Home Assistant, as for get_usage_data
+        """
+        now = datetime.now(timezone.utc)
+        since = now - lookback
+
+        start_time = since
+        watermark = self.store.watermark(entity_id)
+        if watermark is not None:
+            start_time = max(since, _from_epoch_us(watermark))
+
+        usage_data = get_usage_data(url, token, entity_id, start_time=start_time, end_time=now, timeout=timeout)
+        readings = clean_usage_data(usage_data)
+        logging.info(
+            f"Fetched {len(readings)} new readings for {entity_id} since {start_time.isoformat()}")
+
+        self.store.append(entity_id, readings)
+        self.store.prune(entity_id, _epoch_us(now - self.retention))
+        return self.store.read(entity_id, _epoch_us(since))
+
+
+def get_history_cache():
+    """
+    Builds the history cache configured by HISTORY_CACHE: a SQLite file path, or 'blob' to use
+    the function's AzureWebJobsStorage account. Returns None when caching is disabled.
+    """
+    config = os.getenv("HISTORY_CACHE")
+    if not config:
+        return None
+
+    return _build_history_cache(config, os.getenv("HISTORY_CACHE_CONTAINER", "history-cache"),
+                                int(os.getenv("HISTORY_CACHE_DAYS", 31)))
+
+
+@lru_cache(maxsize=4)
+def _build_history_cache(config, container, retention_days):
+    # Reused across households and warm invocations
+    if config == "blob":
+        store = BlobHistoryStore(os.environ["AzureWebJobsStorage"], container)
+    else:
+        store = SQLiteHistoryStore(config)
+
+    return HistoryCache(store, retention=timedelta(days=retention_days))
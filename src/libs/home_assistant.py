@@ -2,11 +2,27 @@ import requests
 import logging
 import json
 import os
+import re
+import codecs
+import numpy as np
+from datetime import datetime
+from urllib.parse import quote
+from libs.data import parse_timestamps
 
+STREAM_CHUNK_SIZE = 64 * 1024
 
-def get_usage_data(url, token, entity_id):
+_SEPARATORS = ' \t\r\n,'
+_HEADER = re.compile(r'\s*\[\s*(?:(\])|\[\s*)')
+
+
+def get_usage_data(url, token, entity_id, start_time=None, end_time=None, metrics=None, timeout=None):
     """
     This function gets the kWh usage from Home Assistant
+
+    :param start_time: Optional aware datetime to fetch history from (default is 1 day ago)
+    :param end_time: Optional aware datetime to fetch history until
+    :param metrics: Optional dict that receives the response size in 'bytes'
+    :param timeout: Optional seconds to wait for the connection and each read
     """
     headers = {
         "Authorization": "Bearer " + token,
@@ -17,10 +33,15 @@ def get_usage_data(url, token, entity_id):
         "minimal_response": ""
     }
 
+    if end_time:
+        parameters["end_time"] = end_time.isoformat()
+
     # The <timestamp> (YYYY-MM-DDThh:mm:ssTZD) is optional and defaults to 1 day before the time of the request.
     # It determines the beginning of the period.
     api_url = url + "/api/history/period"
-    response = requests.get(api_url, params=parameters, headers=headers)
+    if start_time:
+        api_url += "/" + quote(start_time.isoformat())
+    response = requests.get(api_url, params=parameters, headers=headers, timeout=timeout)
     response.raise_for_status()
 
     if response.status_code != 200:
@@ -32,10 +53,199 @@ def get_usage_data(url, token, entity_id):
 
     usage_data_entries = len(usage_data)
     logging.info(
-        f"Retrieved {usage_data_entries} usage entries from Home Assistant")
+        f"Retrieved {usage_data_entries} usage entries ({len(response.content)} bytes) from Home Assistant")
+    if metrics is not None:
+        metrics["bytes"] = len(response.content)
 
     if os.getenv("AZURE_FUNCTIONS_ENVIRONMENT") == 'Development':
         with open('usage_data.json', 'w', encoding='utf-8') as f:
             json.dump(usage_data, f, indent=4)
 
     return usage_data
+
+
+def clean_usage_data(usage_data):
+    """
+    Removes the leading metadata element and any unavailable states from get_usage_data output.
+    """
+    usage_data = usage_data[1:]  # remove the first element as its just metadata
+    return [obj for obj in usage_data if obj["state"]
+            != "unavailable"]  # remove any unavailable states
+
+
+def get_usage_arrays(url, token, entity_id, start_time=None, end_time=None, metrics=None, timeout=None):
+    """
+    This function gets the kWh usage from Home Assistant as compact arrays
+
+    Same request as get_usage_data, but the response is decoded incrementally while it downloads
+    (see parse_history_stream), so the body is never held as one string or list of dicts.
+
+    :param metrics: Optional dict that receives the response size in 'bytes'
+    :param timeout: Optional seconds to wait for the connection and each read
+    :return: Tuple of sorted (timestamps, states) arrays, timestamps as UTC epoch-ns
+    """
+    headers = {
+        "Authorization": "Bearer " + token,
+        "content-type": "application/json",
+    }
+    parameters = {
+        "filter_entity_id": entity_id,
+        "minimal_response": ""
+    }
+
+    if end_time:
+        parameters["end_time"] = end_time.isoformat()
+
+    api_url = url + "/api/history/period"
+    if start_time:
+        api_url += "/" + quote(start_time.isoformat())
+
+    received = 0
+
+    def counted(chunks):
+        nonlocal received
+        for chunk in chunks:
+            received += len(chunk)
+            yield chunk
+
+    with requests.get(api_url, params=parameters, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        timestamps, states = parse_history_stream(counted(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)))
+
+    logging.info(
+        f"Retrieved {len(timestamps)} usage entries ({received} bytes) from Home Assistant")
+    if metrics is not None:
+        metrics["bytes"] = received
+    return timestamps, states
+
+
+def parse_history_stream(chunks):
+    """
+    Incrementally parses a /api/history/period response for a single entity.
+
+    The leading metadata element is decoded on its own. After that, minimal_response objects
+    are flat, so each chunk is decoded up to its last complete object in one json.loads call,
+    unavailable states are dropped and the rest converted to arrays straight away.
+
+    :param chunks: Iterable of bytes (or str) making up the response body
+    :return: Tuple of sorted (timestamps, states) arrays, timestamps as UTC epoch-ns
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    texts = (text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk for chunk in chunks)
+
+    # Opening brackets and the metadata element, which may span several chunks
+    buffer = ''
+    for text in texts:
+        buffer += text
+        header = _HEADER.match(buffer)
+        if header is None:
+            continue  # opening brackets continue in the next chunk
+        if header.group(1) is not None:  # no history at all
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+        try:
+            _, position = decoder.raw_decode(buffer, header.end())
+        except json.JSONDecodeError:
+            continue  # metadata element continues in the next chunk
+        buffer = buffer[position:]
+        break
+    else:
+        if buffer.strip():
+            raise ValueError("Incomplete Home Assistant history response")
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+
+    timestamp_batches, state_batches = [], []
+
+    def parse(segment):
+        segment = segment.strip(_SEPARATORS)
+        if not segment:
+            return True
+        try:
+            readings = json.loads('[' + segment + ']')
+        except json.JSONDecodeError:
+            return False
+        readings = [obj for obj in readings if obj["state"]
+                    != "unavailable"]  # remove any unavailable states
+        if readings:
+            timestamp_batches.append(parse_timestamps([obj["last_changed"] for obj in readings]))
+            state_batches.append(np.array([obj["state"] for obj in readings], dtype=float))
+        return True
+
+    for text in texts:
+        buffer += text
+        end = buffer.rfind('}') + 1
+        # A '}' inside a string value can cut an object in half; just wait for more data then
+        if end and parse(buffer[:end]):
+            buffer = buffer[end:]
+
+    if not buffer.rstrip().endswith(']]') or not parse(buffer.rstrip()[:-2]):
+        raise ValueError("Incomplete Home Assistant history response")
+
+    if not timestamp_batches:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+
+    timestamps = np.concatenate(timestamp_batches)
+    states = np.concatenate(state_batches)
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], states[order]
+
+
+def get_statistics(url, token, statistic_id, start_time, end_time=None, period="5minute", timeout=60):
+    """
+    This function gets pre-aggregated long-term energy statistics from Home Assistant
+
+    Statistics are only available over the websocket API (recorder/statistics_during_period).
+    Each row covers one period and holds the meter's cumulative 'sum' at the end of it,
+    which is orders of magnitude smaller than the raw state history.
+
+    :param statistic_id: Statistic to read, normally the energy sensor's entity id
+    :param start_time: Aware datetime to fetch statistics from
+    :param end_time: Optional aware datetime to fetch statistics until
+    :param period: '5minute', 'hour', 'day', 'week' or 'month'
+    :param timeout: Seconds to wait for the connection and each message
+    :return: List of {"start", "end", "sum", "change"} dicts with start/end as epoch milliseconds
+    """
+    import websocket  # websocket-client, only needed for the statistics source
+
+    ws_url = url.replace("https://", "wss://").replace("http://", "ws://") + "/api/websocket"
+    connection = websocket.create_connection(ws_url, timeout=timeout)
+    try:
+        json.loads(connection.recv())  # auth_required
+        connection.send(json.dumps({"type": "auth", "access_token": token}))
+        message = json.loads(connection.recv())
+        if message["type"] != "auth_ok":
+            raise Exception(f"Home Assistant authentication failed: {message.get('message')}")
+
+        request = {
+            "id": 1,
+            "type": "recorder/statistics_during_period",
+            "start_time": start_time.isoformat(),
+            "statistic_ids": [statistic_id],
+            "period": period,
+            "types": ["sum", "change"],
+        }
+        if end_time:
+            request["end_time"] = end_time.isoformat()
+        connection.send(json.dumps(request))
+
+        message = json.loads(connection.recv())
+        if not message.get("success"):
+            raise Exception(f"Error getting statistics: {message.get('error')}")
+    finally:
+        connection.close()
+
+    statistics = [
+        {"start": _to_epoch_ms(row["start"]), "end": _to_epoch_ms(row["end"]),
+         "sum": row["sum"], "change": row.get("change")}
+        for row in message["result"].get(statistic_id, []) if row.get("sum") is not None
+    ]
+    logging.info(
+        f"Retrieved {len(statistics)} {period} statistics from Home Assistant")
+    return statistics
+
+
+def _to_epoch_ms(value):
+    # Home Assistant 2023.3+ sends epoch milliseconds, older versions ISO 8601 strings
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp() * 1000
+    return float(value)
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from libs.data import NZDT
+from libs.electrickiwi import save_json
+
+CATALOGUE_TTL = 24 * 60 * 60  # seconds the /hop/ interval table is reused for
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minutes(value):
+    """
+    Parses Electric Kiwi's 'h:mm AM' times into minutes after midnight.
+    """
+    clock, meridiem = value.strip().split()
+    hours, minutes = (int(part) for part in clock.split(':'))
+    return (hours % 12 + (12 if meridiem.upper() == 'PM' else 0)) * 60 + minutes
+
+
+def _format(minutes):
+    hours, minutes = divmod(minutes % MINUTES_PER_DAY, 60)
+    return '{:02d}:{:02d} {}'.format(hours % 12 or 12, minutes, 'AM' if hours < 12 else 'PM')
+
+
+class HopCatalogue(object):
+    """
+    Electric Kiwi's HOP interval table (/hop/), compiled so a local time maps to its interval
+    id with one lookup instead of formatting and searching strings.
+    """
+
+    def __init__(self, starts, active):
+        """
+        :param starts: Dict of interval id to start time in minutes after midnight
+        :param active: Set of interval ids the Hour of Power may start in
+        """
+        self.starts = dict(sorted(starts.items()))
+        self.active = set(active)
+
+        # by_minute[m] is the id of the interval starting at minute m of the day, 0 for none
+        self._by_minute = [0] * MINUTES_PER_DAY
+        for interval, start in self.starts.items():
+            self._by_minute[start] = interval
+
+    @classmethod
+    def from_response(cls, data):
+        """
+        :param data: The data of a /hop/ response, with 'intervals' '1'..'48'
+        """
+        intervals = data['intervals']
+        return cls({int(i): _minutes(row['start_time']) for i, row in intervals.items()},
+                   {int(i) for i, row in intervals.items() if int(row['active'])})
+
+    @classmethod
+    def default(cls):
+        """
+        The table Electric Kiwi has always used: 48 half-hours, interval id = slot + 1.
+        """
+        return cls({slot + 1: slot * 30 for slot in range(48)}, range(1, 49))
+
+    def interval_id(self, start):
+        """
+        :param start: datetime an interval starts at, converted to New Zealand time when aware
+        :return: Electric Kiwi interval id
+        """
+        local = start.astimezone(NZDT) if start.tzinfo else start
+        interval = self._by_minute[local.hour * 60 + local.minute]
+        if not interval:
+            raise ValueError('No Electric Kiwi interval starts at {:%H:%M}'.format(local))
+        return interval
+
+    def is_eligible(self, interval):
+        return interval in self.active
+
+    def start_time(self, interval):
+        """
+        :return: Start of an interval formatted like the optimiser results, e.g. '09:00 PM'
+        """
+        return _format(self.starts[interval])
+
+    def choose(self, intervals):
+        """
+        Picks the costliest candidate that starts an interval the Hour of Power may use.
+
+        :param intervals: (start, end, cost, kWh) tuples as returned by the optimisers
+        :return: Tuple of (interval tuple, interval id), or None if no candidate is allowed
+        """
+        for candidate in sorted(intervals, key=lambda x: -x[2]):  # stable, so the first maximum wins
+            try:
+                interval = self.interval_id(candidate[0])
+            except ValueError:
+                continue
+            if self.is_eligible(interval):
+                return candidate, interval
+        return None
+
+    def to_json(self):
+        return {'starts': self.starts, 'active': sorted(self.active)}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls({int(i): start for i, start in data['starts'].items()}, data['active'])
+
+
+class HopCatalogueCache(object):
+    """
+    Keeps the HOP catalogue for a day, in memory and, when a path is given, in a JSON file, so
+    /hop/ is fetched at most once a day rather than on every run.
+    """
+
+    def __init__(self, path=None, ttl=CATALOGUE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._catalogue = None
+        self._saved_at = 0
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+                self._catalogue = HopCatalogue.from_json(data['catalogue'])
+                self._saved_at = data['saved_at']
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                # Treated as no cache, the next fetch overwrites the file
+                logging.warning(f"Ignoring unreadable HOP catalogue {path}: {type(e).__name__}: {e}")
+                self._catalogue, self._saved_at = None, 0
+
+    def get(self, fetch):
+        """
+        :param fetch: Function returning a fresh HopCatalogue, called when the cached one expired
+        :return: The cached or fetched catalogue. When fetching fails the stale one is used,
+                 or the default table if there is none.
+        """
+        with self._lock:
+            if self._catalogue and time.time() - self._saved_at < self.ttl:
+                return self._catalogue
+
+            try:
+                self._catalogue, self._saved_at = fetch(), time.time()
+            except Exception as e:
+                logging.warning(f"Electric Kiwi HOP catalogue not fetched: {type(e).__name__}: {e}")
+                return self._catalogue or HopCatalogue.default()
+            self._save()
+            return self._catalogue
+
+    def _save(self):
+        # The catalogue is still used for this run, so a file that cannot be written is only logged
+        if self.path:
+            try:
+                save_json(self.path, {'catalogue': self._catalogue.to_json(), 'saved_at': self._saved_at})
+            except (OSError, TypeError, ValueError) as e:
+                logging.warning(f"HOP catalogue not saved to {self.path}: {type(e).__name__}: {e}")
+
+
+@lru_cache(maxsize=1)
+def default_hop_catalogue_cache():
+    """
+    Process-wide HopCatalogueCache, persisted to ELECTRIC_KIWI_HOP_FILE when it is set.
+    """
+    return HopCatalogueCache(os.getenv('ELECTRIC_KIWI_HOP_FILE'))
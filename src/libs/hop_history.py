@@ -0,0 +1,232 @@
+"""
+Keeps a compact record of every Hour of Power decision, indexed by household and day, so
+reports such as the savings this month or the most common HOP slot never need Home Assistant
+or Electric Kiwi.
+
+Usage (from src/):
+    python -m libs.hop_history <HOP_HISTORY path or 'blob'> <household> [--month 2024-05]
+"""
+import argparse
+import calendar
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+from libs.data import NZDT, best_interval
+
+
+def _local(start):
+    return start.astimezone(NZDT) if start.tzinfo else start
+
+
+def _slot(start):
+    local = _local(start)
+    return local.hour * 2 + local.minute // 30
+
+
+def decision_record(household, result):
+    """
+    Builds the record stored for one run.
+
+    :param household: Household name
+    :param result: Dict as returned by set_household_hop
+    :return: Dict with the day, chosen slot (0-47, local time), kWh, saving, source and the
+             candidate intervals as compact [slot, kWh, cost] lists
+    """
+    intervals = result["intervals"]
+    # The interval that was set, which is not the best one when Electric Kiwi does not allow it
+    start = result.get("hop_start") or best_interval(intervals)[0]
+    return {
+        "household": household,
+        "day": _local(start).date().isoformat(),
+        "slot": _slot(start),
+        "start_time": result["start_time"],
+        "end_time": result["end_time"],
+        "kwh": float(result["usage_kwh"]),
+        "saving": float(result["usage_cost"]),
+        "source": result["source"],
+        "intervals": [[_slot(start), round(float(kwh), 3), round(float(cost), 4)]
+                      for start, _, cost, kwh in intervals],
+        "recorded": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+class SQLiteDecisionStore(object):
+    """
+    Stores one row per (household, day) in a local SQLite database. The primary key is the
+    index, so a date range of one household is a single index range scan.
+    """
+
+    COLUMNS = ("household", "day", "slot", "start_time", "end_time", "kwh", "saving", "source",
+               "intervals", "recorded")
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS hop_decisions (
+                              household TEXT NOT NULL,
+                              day TEXT NOT NULL,
+                              slot INTEGER NOT NULL,
+                              start_time TEXT NOT NULL,
+                              end_time TEXT NOT NULL,
+                              kwh REAL NOT NULL,
+                              saving REAL NOT NULL,
+                              source TEXT NOT NULL,
+                              intervals TEXT NOT NULL,
+                              recorded TEXT NOT NULL,
+                              PRIMARY KEY (household, day)) WITHOUT ROWID""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, record):
+        """
+        Stores a record. A later run for the same day (the 23:55 run after a provisional one)
+        replaces the earlier record.
+        """
+        row = [json.dumps(record[c]) if c == "intervals" else record[c] for c in self.COLUMNS]
+        with self._lock, self._connect() as db:
+            db.execute(f"INSERT OR REPLACE INTO hop_decisions VALUES ({', '.join('?' * len(row))})", row)
+
+    def query(self, household, start, end):
+        """
+        :return: Records of household for start <= day <= end, in day order
+        """
+        with self._lock, self._connect() as db:
+            rows = db.execute(f"""SELECT {', '.join(self.COLUMNS)} FROM hop_decisions
+                                  WHERE household = ? AND day BETWEEN ? AND ? ORDER BY day""",
+                              (household, start.isoformat(), end.isoformat())).fetchall()
+        records = [dict(zip(self.COLUMNS, row)) for row in rows]
+        for record in records:
+            record["intervals"] = json.loads(record["intervals"])
+        return records
+
+
+class BlobDecisionStore(object):
+    """
+    Stores records in Azure Storage (Azurite when running locally) as one JSON blob per
+    household and month, so a range query only downloads the months it covers.
+    """
+
+    def __init__(self, connection_string, container="hop-history"):
+        from azure.storage.blob import BlobServiceClient  # Only needed when deployed
+
+        self._container = BlobServiceClient.from_connection_string(
+            connection_string).get_container_client(container)
+        if not self._container.exists():
+            self._container.create_container()
+
+    def _blob_name(self, household, month):
+        return f"{household}/{month}.json"
+
+    def _load(self, household, month):
+        blob = self._container.get_blob_client(self._blob_name(household, month))
+        return json.loads(blob.download_blob().readall()) if blob.exists() else {}
+
+    def append(self, record):
+        month = record["day"][:7]
+        records = self._load(record["household"], month)
+        records[record["day"]] = record
+        self._container.upload_blob(self._blob_name(record["household"], month),
+                                    json.dumps(records), overwrite=True)
+
+    def query(self, household, start, end):
+        records = []
+        for month in _months(start, end):
+            records.extend(self._load(household, month).values())
+        return sorted((r for r in records if start.isoformat() <= r["day"] <= end.isoformat()),
+                      key=lambda r: r["day"])
+
+
+def _months(start, end):
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield f"{year:04d}-{month:02d}"
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def summarise_decisions(records):
+    """
+    :return: Dict of days, total saving and kWh, the most common slot with its count, and the
+             number of days by source
+    """
+    slots = Counter(record["slot"] for record in records)
+    most_common = slots.most_common(1)
+    return {
+        "days": len(records),
+        "saving": round(sum(record["saving"] for record in records), 2),
+        "kwh": round(sum(record["kwh"] for record in records), 2),
+        "most_common_slot": most_common[0][0] if most_common else None,
+        "most_common_count": most_common[0][1] if most_common else 0,
+        "sources": dict(Counter(record["source"] for record in records)),
+    }
+
+
+def format_decisions(summary):
+    if not summary["days"]:
+        return "No Hour of Power decisions recorded"
+    slot = summary["most_common_slot"]
+    return (f"Days: {summary['days']}\n"
+            f"Estimated savings: ${summary['saving']:.2f} ({summary['kwh']:.2f} kWh)\n"
+            f"Most common HOP: {slot // 2:02d}:{slot % 2 * 30:02d} "
+            f"({summary['most_common_count']} of {summary['days']} days)")
+
+
+def record_decision(household, result, store=None):
+    """
+    Appends a run's result to the configured store. The HOP is already set by then, so a
+    failure (including connecting to the store) is logged rather than raised.
+    """
+    try:
+        store = store or get_decision_store()
+        if store is None:
+            return None
+        record = decision_record(household, result)
+        store.append(record)
+        return record
+    except Exception as e:
+        logging.warning(f"{household}: HOP decision not recorded: {type(e).__name__}: {e}")
+        return None
+
+
+def get_decision_store():
+    """
+    Builds the store configured by HOP_HISTORY: a SQLite file path, or 'blob' to use the
+    function's AzureWebJobsStorage account. Returns None when the history is disabled.
+    """
+    config = os.getenv("HOP_HISTORY")
+    if not config:
+        return None
+    return _build_decision_store(config, os.getenv("HOP_HISTORY_CONTAINER", "hop-history"))
+
+
+@lru_cache(maxsize=4)
+def _build_decision_store(config, container):
+    if config == "blob":
+        return BlobDecisionStore(os.environ["AzureWebJobsStorage"], container)
+    return SQLiteDecisionStore(config)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise recorded Hour of Power decisions")
+    parser.add_argument("store", help="SQLite file, or 'blob' to use AzureWebJobsStorage")
+    parser.add_argument("household")
+    parser.add_argument("--month", help="YYYY-MM (default is the current month)")
+    args = parser.parse_args(argv)
+
+    month = args.month or datetime.now(NZDT).strftime("%Y-%m")
+    start = date.fromisoformat(f"{month}-01")
+    end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+    store = _build_decision_store(args.store, os.getenv("HOP_HISTORY_CONTAINER", "hop-history"))
+    print(format_decisions(summarise_decisions(store.query(args.household, start, end))))
+
+
+if __name__ == '__main__':
+    main()
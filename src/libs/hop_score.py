@@ -0,0 +1,160 @@
+import logging
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+from libs.consumption import ConsumptionRepository, _to_date
+
+INTERVALS = 48
+
+# A day only counts as a missed HOP when the best hour used more than this many Wh extra
+MISSED_THRESHOLD_WH = 10
+
+
+def to_wh(values):
+    """
+    Converts kWh values (numbers or strings) to integer Wh.
+    """
+    return np.rint(np.asarray(values, dtype=float) * 1000).astype(np.int64)
+
+
+def score_consumption(consumption):
+    """
+    Scores each day's Hour of Power against the best hour Electric Kiwi reports for it.
+
+    :param consumption: ElectricKiwi.consumption style dict of 'YYYY-MM-DD' to day data
+    :return: Tuple of (dates as datetime64[D], Wh free from the chosen HOP, Wh the best HOP would have been free)
+    """
+    days = list(consumption.values())
+    dates = np.array(list(consumption), dtype='datetime64[D]')
+    hop_wh = to_wh([day['consumption_adjustment'] for day in days])
+    wh = to_wh([[day['intervals'][str(interval)]['consumption'] for interval in range(1, INTERVALS + 1)]
+                for day in days]).reshape(len(days), INTERVALS)
+    flags = np.array([[bool(day['intervals'][str(interval)]['hop_best']) for interval in range(1, INTERVALS)]
+                      for day in days], dtype=bool).reshape(len(days), INTERVALS - 1)
+
+    # hop_best marks the first half-hour of the best hour
+    hours = wh[:, :-1] + wh[:, 1:]
+    best = flags.argmax(axis=1)
+    best_wh = np.where(flags.any(axis=1), hours[np.arange(len(days)), best], hop_wh)
+    return dates, hop_wh, best_wh
+
+
+def summarise_scores(hop_wh, best_wh, rate=None):
+    """
+    :param hop_wh: Wh free from the chosen HOP per day
+    :param best_wh: Wh the best HOP would have been free per day
+    :param rate: Price per kWh to value the savings with (optional)
+    :return: Dict with days, hop_kwh, missed_kwh, missed_days, score and, with a rate, hop_savings and missed_cost
+    """
+    missed = best_wh - hop_wh
+    missed = np.where(missed > MISSED_THRESHOLD_WH, missed, 0)
+    hop_total, missed_total = int(hop_wh.sum()), int(missed.sum())
+
+    summary = {
+        "days": len(hop_wh),
+        "hop_kwh": hop_total / 1000,
+        "missed_kwh": missed_total / 1000,
+        "missed_days": int(np.count_nonzero(missed)),
+        "score": round(100 - missed_total / hop_total * 100, 2) if hop_total else None,
+    }
+    if rate is not None:
+        summary["hop_savings"] = round(hop_total * float(rate) / 1000, 2)
+        summary["missed_cost"] = round(missed_total * float(rate) / 1000, 2)
+    return summary
+
+
+def format_summary(summary):
+    """
+    Builds a short notification message from summarise_scores output.
+    """
+    lines = [f"HOP Savings: {summary['hop_kwh']:.3f} kWh" +
+             (f" (${summary['hop_savings']:.2f})" if "hop_savings" in summary else ""),
+             f"Missed HOP: {summary['missed_kwh']:.3f} kWh on {summary['missed_days']}/{summary['days']} days" +
+             (f" (${summary['missed_cost']:.2f})" if "missed_cost" in summary else "")]
+    if summary["score"] is not None:
+        lines.append(f"HOP Score: {summary['score']:.2f}%")
+    return "\n".join(lines)
+
+
+class HopScoreRepository(object):
+    """
+    Per-day Hour of Power scores, stored next to the consumption cache.
+
+    Settled days are scored once and kept, so extending the range only scores the new days.
+    """
+
+    def __init__(self, ek, path=None, consumption=None, settle_days=3):
+        """
+        :param ek: Logged in ElectricKiwi client
+        :param path: SQLite file (default is the consumption cache)
+        :param consumption: ConsumptionRepository to read consumption through
+        :param settle_days: Days before today that are always rescored as they may still change
+        """
+        self.ek = ek
+        self.consumption = consumption or ConsumptionRepository(ek, path, settle_days=settle_days)
+        self.path = path or self.consumption.path
+        self.settle_days = settle_days
+        self._lock = threading.Lock()
+
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS hop_scores (
+                              customer_id TEXT NOT NULL,
+                              connection_id TEXT NOT NULL,
+                              date TEXT NOT NULL,
+                              hop_wh INTEGER NOT NULL,
+                              best_wh INTEGER NOT NULL,
+                              PRIMARY KEY (customer_id, connection_id, date))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self):
+        customer = self.ek._customer
+        return str(customer['id']), str(customer['connection']['id'])
+
+    def days(self, start_date, end_date=None):
+        """
+        :param start_date: First day (date, datetime or arrow)
+        :param end_date: Last day, inclusive (default is today)
+        :return: Tuple of (dates, hop_wh, best_wh) arrays sorted by date, for days with consumption
+        """
+        start = _to_date(start_date)
+        end = _to_date(end_date) if end_date else date.today()
+        settled_before = date.today() - timedelta(days=self.settle_days)
+
+        with self._lock, self._connect() as db:
+            rows = db.execute("""SELECT date, hop_wh, best_wh FROM hop_scores
+                                 WHERE customer_id = ? AND connection_id = ? AND date BETWEEN ? AND ?""",
+                              self._key() + (start.isoformat(), end.isoformat())).fetchall()
+        scores = {day: (hop, best) for day, hop, best in rows}
+
+        missing = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        missing = [day for day in missing if day.isoformat() not in scores or day >= settled_before]
+        if missing:
+            logging.info(f"Scoring {len(missing)} days of HOP")
+            wanted = {day.isoformat() for day in missing}
+            consumption = self.consumption.get(missing[0], missing[-1])
+            consumption = {day: data for day, data in consumption.items() if day in wanted}
+            dates, hop_wh, best_wh = score_consumption(consumption)
+            scored = {str(day): (int(hop), int(best)) for day, hop, best in zip(dates, hop_wh, best_wh)}
+            scores.update(scored)
+
+            rows = [self._key() + (day,) + values for day, values in scored.items()
+                    if day < settled_before.isoformat()]
+            with self._lock, self._connect() as db:
+                db.executemany("INSERT OR REPLACE INTO hop_scores VALUES (?, ?, ?, ?, ?)", rows)
+
+        ordered = sorted(scores)
+        return (np.array(ordered, dtype='datetime64[D]'),
+                np.array([scores[day][0] for day in ordered], dtype=np.int64),
+                np.array([scores[day][1] for day in ordered], dtype=np.int64))
+
+    def summary(self, start_date, end_date=None, rate=None):
+        """
+        Summarises the HOP score over a range, see summarise_scores.
+        """
+        _, hop_wh, best_wh = self.days(start_date, end_date)
+        return summarise_scores(hop_wh, best_wh, rate)
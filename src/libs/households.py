@@ -0,0 +1,436 @@
+import json
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+from datetime import date, datetime, timedelta, timezone
+
+from libs.home_assistant import clean_usage_data, get_statistics, get_usage_arrays, get_usage_data
+from libs.history_cache import get_history_cache
+from libs.archive import get_meter_archive
+from libs.data import (NZDT, _readings_to_arrays, best_interval, calculate_optimal_hop,
+                       calculate_optimal_hop_from_statistics, optimal_hop_from_arrays, select_optimiser)
+from libs.deadline import DEFAULT_SET_RESERVE_SECONDS, Deadline
+from libs.electrickiwi import REQUEST_TIMEOUT, ElectricKiwi, default_session_cache
+from libs.hop_history import record_decision
+from libs.hop_score import HopScoreRepository
+from libs.streaming import get_streaming_optimiser
+from libs.timing import Timings
+from libs.usage_index import get_usage_index_store
+
+DEFAULT_MAX_WORKERS = 32
+
+# Seconds the live analysis may take before the predicted HOP is used instead
+DEFAULT_TIME_BUDGET_SECONDS = 240
+
+
+def load_households():
+    """
+    Loads the households to optimise.
+
+    HOUSEHOLDS may hold a JSON list (or a path to a JSON file) of objects with the keys
+    name, home_assistant_url, home_assistant_access_token, home_assistant_entity_id,
+    electric_kiwi_email, electric_kiwi_password and optionally customer_index and
+    home_assistant_source ('history' for raw state history, 'statistics', or 'push' for
+    readings pushed by Home Assistant, see libs.streaming).
+    Without it a single household is built from the original environment variables.
+    Names must be unique, as results and stored state are keyed by them.
+    """
+    config = os.getenv("HOUSEHOLDS")
+    if not config:
+        return [{
+            "name": "default",
+            "home_assistant_url": os.environ["HOME_ASSISTANT_URL"],
+            "home_assistant_access_token": os.environ["HOME_ASSISTANT_ACCESS_TOKEN"],
+            "home_assistant_entity_id": os.environ["HOME_ASSISTANT_ENTITY_ID"],
+            "electric_kiwi_email": os.environ["ELECTRIC_KIWI_EMAIL"],
+            "electric_kiwi_password": os.environ["ELECTRIC_KIWI_PASSWORD"],
+            "home_assistant_source": os.getenv("HOME_ASSISTANT_SOURCE", "history"),
+        }]
+
+    if not config.lstrip().startswith('['):
+        with open(config, encoding='utf-8') as f:
+            config = f.read()
+
+    households = json.loads(config)
+    for index, household in enumerate(households):
+        household.setdefault("name", f"household-{index}")
+
+    names = Counter(household["name"] for household in households)
+    duplicates = sorted(name for name, count in names.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate household names in HOUSEHOLDS: {', '.join(duplicates)}")
+    return households
+
+
+def fetch_usage_data(household, timings=None, deadline=None):
+    """
+    Gets a household's cleaned usage, through the history cache when HISTORY_CACHE is set.
+
+    :param deadline: Optional Deadline that bounds the Home Assistant request
+    """
+    timings = timings or Timings(household=household["name"])
+    timeout = deadline.timeout() if deadline else None
+    cache = get_history_cache()
+    if cache:
+        with timings.span("fetch", cached=True) as span:
+            readings = cache.get_usage_data(
+                url=household["home_assistant_url"],
+                token=household["home_assistant_access_token"],
+                entity_id=household["home_assistant_entity_id"],
+                timeout=timeout
+            )
+            span["rows"] = len(readings)
+        return readings
+
+    with timings.span("fetch") as span:
+        usage_data = get_usage_data(
+            url=household["home_assistant_url"],
+            token=household["home_assistant_access_token"],
+            entity_id=household["home_assistant_entity_id"],
+            metrics=span,
+            timeout=timeout
+        )
+        span["rows"] = len(usage_data)
+
+    with timings.span("clean") as span:
+        readings = clean_usage_data(usage_data)
+        span["rows"] = len(readings)
+    return readings
+
+
+def analyse_household(household, timings=None, deadline=None):
+    """
+    Fetches a household's usage from its configured source and finds the optimal HOP.
+
+    :param timings: Timings that receive the fetch, clean and optimise stages
+    :param deadline: Optional Deadline that bounds every Home Assistant call
+    :return: Tuple of (start_time, end_time, cost, kWh, intervals) as from calculate_optimal_hop
+    """
+    timings = timings or Timings(household=household["name"])
+
+    if household.get("home_assistant_source") == "push":
+        optimiser = get_streaming_optimiser()
+        if optimiser is None:
+            raise Exception("STREAMING_STORE must be set for the push source")
+        with timings.span("optimise", profile=True):
+            return optimiser.decide(household["name"])
+
+    if household.get("home_assistant_source") == "statistics":
+        with timings.span("fetch") as span:
+            statistics = get_statistics(
+                url=household["home_assistant_url"],
+                token=household["home_assistant_access_token"],
+                statistic_id=household["home_assistant_entity_id"],
+                start_time=datetime.now(timezone.utc) - timedelta(days=1),
+                timeout=deadline.timeout(60) if deadline else 60
+            )
+            span["rows"] = len(statistics)
+        with timings.span("optimise", profile=True):
+            return calculate_optimal_hop_from_statistics(statistics)
+
+    optimiser = select_optimiser()
+    if get_history_cache() or optimiser is not calculate_optimal_hop:
+        usage_data = fetch_usage_data(household, timings, deadline)
+        with timings.span("optimise", profile=True, rows=len(usage_data)):
+            result = optimiser(usage_data)
+        if get_meter_archive():
+            archive_readings_in_background(household, *_readings_to_arrays(usage_data), timings=timings)
+        return result
+
+    # Stream the history straight into arrays for the optimiser, parsing happens while it downloads
+    with timings.span("fetch") as span:
+        timestamps, states = get_usage_arrays(
+            url=household["home_assistant_url"],
+            token=household["home_assistant_access_token"],
+            entity_id=household["home_assistant_entity_id"],
+            metrics=span,
+            timeout=deadline.timeout() if deadline else None
+        )
+        span["rows"] = len(timestamps)
+    with timings.span("optimise", profile=True, rows=len(timestamps)):
+        result = optimal_hop_from_arrays(timestamps, states)
+    if get_meter_archive():
+        archive_readings_in_background(household, timestamps, states, timings=timings)
+    return result
+
+
+def archive_readings(household, timestamps, states, archive=None, timings=None):
+    """
+    Appends a run's readings to the METER_ARCHIVE. A failure is logged rather than raised.
+
+    :return: Number of readings added
+    """
+    archive = archive or get_meter_archive()
+    if archive is None or len(timestamps) == 0:
+        return 0
+    timings = timings or Timings(household=household["name"])
+    try:
+        with timings.span("archive") as span:
+            span["rows"] = archive.append(household["home_assistant_entity_id"], timestamps, states)
+        return span["rows"]
+    except Exception as e:
+        logging.warning(f"{household['name']}: readings not archived: {type(e).__name__}: {e}")
+        return 0
+
+
+def archive_readings_in_background(household, timestamps, states, archive=None, timings=None):
+    """
+    Runs archive_readings on its own thread, so the disk writes never delay the HOP or eat
+    into the deadline.
+
+    :return: Future of the number of readings added
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+    future = executor.submit(archive_readings, household, timestamps, states, archive, timings)
+    executor.shutdown(wait=False)
+    return future
+
+
+def login_household(household, timeout=None):
+    """
+    :param timeout: Optional seconds per Electric Kiwi request (default is REQUEST_TIMEOUT)
+    :return: ElectricKiwi client logged in to the household's account
+    """
+    ek = ElectricKiwi(session_cache=default_session_cache())
+    if timeout is not None:
+        ek.timeout = timeout
+    ek.ensure_login(
+        email=household["electric_kiwi_email"],
+        password_hash=ek.password_hash(household["electric_kiwi_password"]),
+        customer_index=household.get("customer_index", 0)
+    )
+    return ek
+
+
+def predict_household(household, store=None):
+    """
+    Predicts today's HOP from the household's usage index, without any network I/O.
+
+    :return: Tuple as from calculate_optimal_hop, or None without enough history
+    """
+    store = store or get_usage_index_store()
+    return store.load(household["name"]).predict(datetime.now(NZDT).date())
+
+
+def _analyse_and_index(household, store, timings, deadline):
+    result = analyse_household(household, timings, deadline)
+    if result and store is not None:
+        store.update(household["name"], result[4])
+    return result
+
+
+def analyse_household_within_budget(household, budget=None, timings=None, deadline=None):
+    """
+    Runs analyse_household, but falls back to the predicted HOP when it takes longer than the
+    time budget. Live results keep the usage index up to date, even when they arrive too late.
+
+    :param budget: Seconds to wait for the live result (default is HOP_TIME_BUDGET_SECONDS or 240)
+    :param deadline: Optional Deadline after which the live result is no longer waited for
+    :return: Tuple of (result, source) where source is 'live' or 'predicted', or (None, 'timeout')
+             when the deadline passed with neither
+    """
+    timings = timings or Timings(household=household["name"])
+    store = get_usage_index_store()
+    if store is None and deadline is None:
+        return analyse_household(household, timings), "live"
+
+    if budget is None:
+        budget = float(os.getenv("HOP_TIME_BUDGET_SECONDS", DEFAULT_TIME_BUDGET_SECONDS))
+    if deadline is not None:
+        budget = min(budget, deadline.remaining())
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="live")
+    future = executor.submit(_analyse_and_index, household, store, timings, deadline)
+    executor.shutdown(wait=False)
+
+    try:
+        return future.result(timeout=budget), "live"
+    except TimeoutError:
+        pass
+
+    predicted = None
+    if store is not None:
+        with timings.span("predict"):
+            predicted = predict_household(household, store)
+    if predicted is not None:
+        logging.warning(f"{household['name']}: no live result within {budget:g}s, using the predicted HOP")
+        return predicted, "predicted"
+
+    logging.warning(f"{household['name']}: no live result within {budget:g}s and nothing to predict from")
+    try:
+        return future.result(timeout=deadline.remaining() if deadline else None), "live"
+    except TimeoutError:
+        logging.error(f"{household['name']}: no live result before the deadline")
+        return None, "timeout"
+
+
+def set_household_hop(household, result, source, timings=None, ek=None):
+    """
+    Sets the HOP from an optimiser result with Electric Kiwi, and records the decision when
+    HOP_HISTORY is set.
+
+    :param ek: ElectricKiwi client already logged in (default is to log in now)
+    :return: Dict with the chosen start/end time, usage cost and kWh, where it came from, and
+             hop_start, the datetime of the interval that was set
+    """
+    timings = timings or Timings(household=household["name"])
+    start_time, end_time, usage_cost, usage_kwh, intervals = result
+
+    if ek is None:
+        with timings.span("ek_auth"):
+            ek = login_household(household)
+    with timings.span("set_hop"):
+        catalogue = ek.hop_catalogue()
+        choice = catalogue.choose(intervals)
+        if choice is None:
+            raise Exception("None of the candidate hours starts an Electric Kiwi HOP interval")
+        chosen, interval = choice
+        if chosen is not best_interval(intervals):
+            logging.warning(f"{household['name']}: Electric Kiwi does not allow a HOP at {start_time}, "
+                            f"using {catalogue.start_time(interval)}")
+            start_time, end_time = catalogue.start_time(interval), chosen[1].strftime("%I:%M %p")
+            usage_cost, usage_kwh = round(chosen[2], 2), round(chosen[3], 2)
+        ek.set_hop_hour(interval)
+
+    decision = {
+        "start_time": start_time,
+        "end_time": end_time,
+        "usage_cost": usage_cost,
+        "usage_kwh": usage_kwh,
+        "intervals": intervals,
+        "source": source,
+        "hop_start": chosen[0],
+    }
+    if os.getenv("HOP_HISTORY"):
+        with timings.span("record"):
+            record_decision(household["name"], decision)
+    return decision
+
+
+def keep_previous_hop(household, ek, timings=None):
+    """
+    Leaves the HOP that is already set in place, for when no new one could be chosen in time.
+
+    :return: Dict as from set_household_hop, with source 'previous' and no usage figures
+    """
+    timings = timings or Timings(household=household["name"])
+    with timings.span("get_hop"):
+        hour = ek.get_hop_hour()
+    return {
+        "start_time": hour.start.format('hh:mm A'),
+        "end_time": hour.end.format('hh:mm A'),
+        "usage_cost": None,
+        "usage_kwh": None,
+        "intervals": [],
+        "source": "previous",
+    }
+
+
+def _login_household(household, timings, deadline):
+    with timings.span("ek_auth"):
+        return login_household(household, timeout=deadline.timeout(REQUEST_TIMEOUT))
+
+
+def optimise_household(household, timings=None, deadline=None):
+    """
+    Fetches a household's usage, finds the optimal HOP and sets it with Electric Kiwi.
+
+    The Electric Kiwi login runs while Home Assistant is fetched and analysed, and every call
+    is bounded by the time left before the deadline. HOP_SET_RESERVE_SECONDS of it are kept for
+    setting the HOP. If the analysis cannot finish in time the predicted HOP is set, and
+    failing that the HOP already set is kept.
+
+    :param timings: Timings that receive every stage (default is a new one, which is only logged)
+    :param deadline: Deadline to set the HOP by (default is shortly before local midnight)
+    :return: Dict as from set_household_hop or keep_previous_hop
+    """
+    timings = timings or Timings(household=household["name"])
+    deadline = deadline or Deadline.before_midnight()
+    reserve = float(os.getenv("HOP_SET_RESERVE_SECONDS", DEFAULT_SET_RESERVE_SECONDS))
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ek")
+    login = executor.submit(_login_household, household, timings, deadline)
+    executor.shutdown(wait=False)
+
+    result, source = analyse_household_within_budget(household, timings=timings, deadline=deadline.before(reserve))
+    try:
+        ek = login.result(timeout=deadline.remaining())
+    except TimeoutError:
+        raise TimeoutError(f"Electric Kiwi login did not finish before {deadline.at.isoformat()}")
+
+    ek.timeout = deadline.timeout(REQUEST_TIMEOUT)
+    if result is None:
+        return keep_previous_hop(household, ek, timings)
+    return set_household_hop(household, result, source, timings, ek)
+
+
+def provisional_household(household):
+    """
+    Sets a provisional HOP predicted from the usage index, replaced by the 23:55 run.
+
+    :return: Dict as from set_household_hop
+    """
+    result = predict_household(household)
+    if result is None:
+        raise Exception("not enough usage history to predict from")
+    return set_household_hop(household, result, "provisional")
+
+
+def score_household(household, days=7):
+    """
+    Scores a household's Hour of Power choices over the last few days.
+
+    :return: Dict as from libs.hop_score.summarise_scores, valued at the plan's usage rate
+    """
+    ek = login_household(household)
+    rate = ek.connection_details()['pricing_plan']['usage_rate_inc_gst']
+    end_date = date.today() - timedelta(days=1)
+    return HopScoreRepository(ek).summary(end_date - timedelta(days=days - 1), end_date, rate)
+
+
+def run_households(households, max_workers=DEFAULT_MAX_WORKERS, timeout=None, function=None):
+    """
+    Optimises all households concurrently on a bounded thread pool.
+
+    A failure in one household never affects the others; every household gets a result
+    entry with either its HOP or the error that stopped it.
+
+    :param households: Household configs as returned by load_households
+    :param max_workers: Maximum number of households processed at once
+    :param timeout: Seconds to wait before giving up on unfinished households (default is no limit)
+    :param function: What to run for each household (default is optimise_household)
+    :return: Dict of household name to {"ok": bool, "result" or "error": ...}
+    """
+    function = function or optimise_household
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="household")
+    futures = {executor.submit(function, household): household["name"]
+               for household in households}
+    done, not_done = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = {}
+    for future, name in futures.items():
+        if future in not_done:
+            results[name] = {"ok": False, "error": "timed out"}
+        elif future.exception():
+            logging.error(f"{name}: {future.exception()}")
+            results[name] = {"ok": False, "error": str(future.exception())}
+        else:
+            results[name] = {"ok": True, "result": future.result()}
+
+    logging.info(
+        f"Processed {len(households)} households in {time.monotonic() - started:.1f}s")
+    return results
+
+
+def summarise_results(results):
+    """
+    Builds a short notification message from run_households results.
+    """
+    failed = {name: r["error"] for name, r in results.items() if not r["ok"]}
+    lines = [f"Succeeded: {len(results) - len(failed)}/{len(results)}"]
+    lines += [f"{name}: {error}" for name, error in sorted(failed.items())]
+    return "\n".join(lines)
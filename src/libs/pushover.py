@@ -1,7 +1,7 @@
 import requests
 
 
-def send_pushover_notification(user_key, api_token, message, title="Notification", image_path=None):
+def send_pushover_notification(user_key, api_token, message, title="Notification", image_path=None, image=None):
     """
     Send a notification using Pushover with an optional image.
 
@@ -10,6 +10,7 @@ def send_pushover_notification(user_key, api_token, message, title="Notification
     :param message: Message to send
     :param title: Title of the notification (default is "Notification")
     :param image_path: Path to the image file to send (default is None)
+    :param image: PNG bytes to send instead of a file, e.g. from render_intervals (default is None)
     :return: Response status
     """
     url = "https://api.pushover.net/1/messages.json"
@@ -23,6 +24,8 @@ def send_pushover_notification(user_key, api_token, message, title="Notification
     files = None
     if image_path:
         files = {'attachment': open(image_path, 'rb')}
+    elif image:
+        files = {'attachment': ('hop.png', image, 'image/png')}
 
     try:
         response = requests.post(url, data=payload, files=files)
@@ -33,5 +36,5 @@ def send_pushover_notification(user_key, api_token, message, title="Notification
         return None
     finally:
         # Close the file if it was opened
-        if files:
+        if image_path:
             files['attachment'].close()
@@ -0,0 +1,296 @@
+"""
+Push-based ingestion: Home Assistant sends meter updates as they happen (to the MeterWebhook
+function, or to a worker subscribed over the websocket API) and they are folded into per-household
+half-hour accumulators, so the 23:55 decision only reads 48 slots.
+
+Usage (from src/), to subscribe to every household with home_assistant_source 'push':
+    python -m libs.streaming
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from libs.data import NZDT, _summarise, parse_timestamps, to_local
+from libs.tariff import DEFAULT_TARIFF, SLOTS_PER_DAY
+
+
+def readings_from_payload(payload):
+    """
+    Extracts state objects from a pushed payload: a state object, a list of them, or a
+    Home Assistant state_changed event / trigger (anything with a 'new_state' or 'to_state').
+    """
+    if isinstance(payload, list):
+        return [reading for item in payload for reading in readings_from_payload(item)]
+
+    for key in ("event", "data", "variables", "trigger"):
+        if isinstance(payload.get(key), dict):
+            return readings_from_payload(payload[key])
+    for key in ("new_state", "to_state"):
+        if key in payload:
+            return readings_from_payload(payload[key]) if payload[key] else []
+    return [payload] if "state" in payload and "last_changed" in payload else []
+
+
+def aggregate_readings(readings, tz=NZDT):
+    """
+    Reduces readings to the lowest and highest meter state seen in each local half-hour.
+
+    Min and max do not depend on order and ignore repeats, so out-of-order and duplicate
+    readings give the same accumulators.
+
+    :param readings: Home Assistant state objects, unavailable and non-numeric states are skipped
+    :return: List of (day 'YYYY-MM-DD', slot, min_state, max_state)
+    """
+    values, last_changed = [], []
+    for obj in readings:
+        try:
+            state = float(obj["state"])
+        except (TypeError, ValueError):
+            continue  # 'unavailable', 'unknown'
+        if np.isfinite(state):
+            values.append(state)
+            last_changed.append(obj["last_changed"])
+    if not values:
+        return []
+
+    local = to_local(parse_timestamps(last_changed), tz)
+    days = local.astype('datetime64[D]')
+    keys = days.astype(np.int64) * SLOTS_PER_DAY + (local - days).astype('timedelta64[m]').astype(np.int64) // 30
+
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], np.array(values)[order]
+    starts = np.flatnonzero(np.diff(keys, prepend=-1))
+    minimums = np.minimum.reduceat(values, starts)
+    maximums = np.maximum.reduceat(values, starts)
+
+    return [(str(np.datetime64(int(key // SLOTS_PER_DAY), 'D')), int(key % SLOTS_PER_DAY), low, high)
+            for key, low, high in zip(keys[starts].tolist(), minimums.tolist(), maximums.tolist())]
+
+
+class MemorySlotStore(object):
+    """
+    Keeps the accumulators in memory, for a single long-running worker and tests.
+    """
+
+    def __init__(self):
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def merge(self, household, rows):
+        with self._lock:
+            slots = self._slots.setdefault(household, {})
+            for day, slot, low, high in rows:
+                current = slots.get((day, slot))
+                slots[(day, slot)] = (low, high) if current is None else \
+                    (min(current[0], low), max(current[1], high))
+
+    def read(self, household, first_day, last_day):
+        with self._lock:
+            return [(day, slot, low, high) for (day, slot), (low, high) in self._slots.get(household, {}).items()
+                    if first_day <= day <= last_day]
+
+    def prune(self, household, before_day):
+        with self._lock:
+            slots = self._slots.get(household, {})
+            for key in [key for key in slots if key[0] < before_day]:
+                del slots[key]
+
+
+class SQLiteSlotStore(object):
+    """
+    Keeps the accumulators in SQLite. Merges are single upserts, so concurrent webhook
+    invocations sharing the file never lose a reading.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS slot_usage (
+                              household TEXT NOT NULL,
+                              day TEXT NOT NULL,
+                              slot INTEGER NOT NULL,
+                              min_state REAL NOT NULL,
+                              max_state REAL NOT NULL,
+                              PRIMARY KEY (household, day, slot))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def merge(self, household, rows):
+        with self._connect() as db:
+            db.executemany("""INSERT INTO slot_usage VALUES (?, ?, ?, ?, ?)
+                              ON CONFLICT (household, day, slot) DO UPDATE SET
+                                  min_state = MIN(min_state, excluded.min_state),
+                                  max_state = MAX(max_state, excluded.max_state)""",
+                           [(household,) + tuple(row) for row in rows])
+
+    def read(self, household, first_day, last_day):
+        with self._connect() as db:
+            return db.execute("""SELECT day, slot, min_state, max_state FROM slot_usage
+                                 WHERE household = ? AND day BETWEEN ? AND ?""",
+                              (household, first_day, last_day)).fetchall()
+
+    def prune(self, household, before_day):
+        with self._connect() as db:
+            db.execute("DELETE FROM slot_usage WHERE household = ? AND day < ?", (household, before_day))
+
+
+class StreamingOptimiser(object):
+    """
+    Folds pushed readings into half-hour accumulators and picks the HOP from them.
+    """
+
+    def __init__(self, store, tariff=DEFAULT_TARIFF, tz=NZDT, retention_days=2):
+        """
+        :param store: MemorySlotStore, SQLiteSlotStore or any object with the same methods
+        :param retention_days: Days of accumulators kept before today's decision
+        """
+        self.store = store
+        self.tariff = tariff
+        self.tz = tz
+        self.retention_days = retention_days
+
+    def ingest(self, household, readings):
+        """
+        :param readings: Home Assistant state objects, in any order and possibly repeated
+        :return: Number of half-hour slots touched
+        """
+        rows = aggregate_readings(readings, self.tz)
+        if rows:
+            self.store.merge(household, rows)
+        return len(rows)
+
+    def decide(self, household, day=None):
+        """
+        Finds the off-peak hour with the highest cost on a day, like optimal_hop_from_arrays
+        on that day's readings.
+
+        :param day: Local date (default is today)
+        :return: Tuple of (start_time, end_time, cost, kWh, intervals) or None if no interval is valid
+        """
+        day = day or datetime.now(self.tz).date()
+        next_day = day + timedelta(days=1)
+
+        # The 23:30 hour runs into the first slot of the next day
+        minimums = np.full(SLOTS_PER_DAY + 1, np.nan)
+        maximums = np.full(SLOTS_PER_DAY + 1, np.nan)
+        for row_day, slot, low, high in self.store.read(household, day.isoformat(), next_day.isoformat()):
+            index = slot if row_day == day.isoformat() else SLOTS_PER_DAY + slot
+            if index <= SLOTS_PER_DAY:
+                minimums[index], maximums[index] = low, high
+        self.store.prune(household, (day - timedelta(days=self.retention_days)).isoformat())
+
+        kwh = np.fmax(maximums[:-1], maximums[1:]) - np.fmin(minimums[:-1], minimums[1:])
+        day_type = self.tariff.day_types(np.array([day], dtype='datetime64[D]'))[0]
+        valid = ~np.isnan(kwh) & self.tariff.hop_eligible[day_type]
+        if not valid.any():
+            logging.info("No valid intervals found.")
+            return None
+
+        costs = kwh * self.tariff.rates[day_type]
+        midnight = datetime.combine(day, time(), self.tz)
+        intervals = []
+        for slot in np.flatnonzero(valid):
+            start = midnight + timedelta(minutes=30 * int(slot))
+            intervals.append((start, start + timedelta(hours=1), float(costs[slot]), float(kwh[slot])))
+
+        best = intervals[int(np.argmax(costs[valid]))]
+        return _summarise(*best, intervals)
+
+
+def get_streaming_optimiser():
+    """
+    Returns the optimiser for the store configured by STREAMING_STORE (a SQLite file path),
+    or None when push ingestion is disabled.
+    """
+    path = os.getenv("STREAMING_STORE")
+    return _build_streaming_optimiser(path) if path else None
+
+
+@lru_cache(maxsize=4)
+def _build_streaming_optimiser(path):
+    return StreamingOptimiser(SQLiteSlotStore(path))
+
+
+def listen(household, optimiser, stop=None, reconnect_delay=5, backfill=True):
+    """
+    Subscribes to a household's meter over the Home Assistant websocket API and ingests every
+    change until stop is set, reconnecting when the connection drops.
+
+    :param stop: threading.Event ending the loop
+    :param backfill: Ingest the last day of history on every (re)connect to cover any gap;
+                     repeats are harmless
+    """
+    import websocket  # websocket-client
+
+    from libs.home_assistant import clean_usage_data, get_usage_data
+
+    stop = stop or threading.Event()
+    url, token = household["home_assistant_url"], household["home_assistant_access_token"]
+    entity_id = household["home_assistant_entity_id"]
+    ws_url = url.replace("https://", "wss://").replace("http://", "ws://") + "/api/websocket"
+
+    while not stop.is_set():
+        try:
+            connection = websocket.create_connection(ws_url, timeout=60)
+            try:
+                json.loads(connection.recv())  # auth_required
+                connection.send(json.dumps({"type": "auth", "access_token": token}))
+                message = json.loads(connection.recv())
+                if message["type"] != "auth_ok":
+                    raise Exception(f"Home Assistant authentication failed: {message.get('message')}")
+
+                connection.send(json.dumps({"id": 1, "type": "subscribe_trigger",
+                                            "trigger": {"platform": "state", "entity_id": entity_id}}))
+                message = json.loads(connection.recv())
+                if not message.get("success"):
+                    raise Exception(f"Error subscribing to {entity_id}: {message.get('error')}")
+
+                if backfill:
+                    optimiser.ingest(household["name"], clean_usage_data(get_usage_data(url, token, entity_id)))
+
+                connection.settimeout(1)
+                while not stop.is_set():
+                    try:
+                        raw = connection.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if not raw:
+                        raise ConnectionError("Home Assistant closed the connection")
+                    message = json.loads(raw)
+                    if message.get("type") == "event":
+                        optimiser.ingest(household["name"], readings_from_payload(message["event"]))
+            finally:
+                connection.close()
+        except Exception as e:
+            if stop.is_set():
+                break
+            logging.error(f"{household['name']}: {e}, reconnecting in {reconnect_delay}s")
+            stop.wait(reconnect_delay)
+
+
+def main():
+    from libs.households import load_households
+
+    logging.basicConfig(level=logging.INFO)
+    optimiser = get_streaming_optimiser()
+    if optimiser is None:
+        raise SystemExit("Set STREAMING_STORE to the SQLite file shared with the function")
+
+    households = [h for h in load_households() if h.get("home_assistant_source") == "push"]
+    threads = [threading.Thread(target=listen, args=(household, optimiser), name=household["name"], daemon=True)
+               for household in households]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
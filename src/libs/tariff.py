@@ -0,0 +1,182 @@
+import numpy as np
+
+# Day types used as the first index of Tariff.rates and Tariff.hop_eligible
+WEEKDAY = 0
+WEEKEND = 1
+HOLIDAY = 2
+
+SLOTS_PER_DAY = 48
+
+
+def time_to_slot(value):
+    """
+    Converts a 'HHMM' or 'HH:MM' time of day into its half-hour slot (0-47).
+    '2400' is accepted as the end of the day and maps to slot 48.
+    """
+    value = str(value).replace(':', '')
+    hours, minutes = int(value[:-2]), int(value[-2:])
+    if minutes % 30:
+        raise ValueError(f"Time {value} is not on a half-hour boundary")
+    return hours * 2 + minutes // 30
+
+
+def _compile_bands(bands):
+    """
+    Expands a flat rate or a list of [start, end, rate] bands into 48 per-slot rates.
+    Bands may wrap past midnight (e.g. ['2300', '0700', 0.198]). A numpy array of 48 rates is used as is.
+    """
+    if isinstance(bands, np.ndarray):
+        if bands.shape != (SLOTS_PER_DAY,):
+            raise ValueError(f"Expected {SLOTS_PER_DAY} slot rates, got shape {bands.shape}")
+        return bands.astype(float)
+    if not isinstance(bands, (list, tuple)):
+        return np.full(SLOTS_PER_DAY, float(bands))
+
+    rates = np.full(SLOTS_PER_DAY, np.nan)
+    for start, end, rate in bands:
+        start, end = time_to_slot(start), time_to_slot(end)
+        if end > start:
+            rates[start:end] = rate
+        else:
+            rates[start:] = rate
+            rates[:end] = rate
+
+    if np.isnan(rates).any():
+        missing = np.flatnonzero(np.isnan(rates))
+        raise ValueError(f"Tariff bands do not cover slots {missing.tolist()}")
+    return rates
+
+
+class Tariff(object):
+    """
+    Declarative time-of-use tariff compiled into per-slot lookup tables.
+
+    rates[day_type, slot] is the price per kWh and hop_eligible[day_type, slot] says whether an
+    Hour of Power may start in that slot, so pricing a whole series is a single fancy-index.
+    """
+
+    def __init__(self, name, weekday, weekend=None, holidays=(), daily_charge=0.0,
+                 discount_percent=0.0, hop_excluded_starts=()):
+        """
+        :param name: Name of the plan
+        :param weekday: Flat rate per kWh, a list of [start, end, rate] bands ('HHMM' times) or an array of 48 rates
+        :param weekend: Rates for Saturday and Sunday in the same format (default is the weekday rates)
+        :param holidays: Public holiday dates ('YYYY-MM-DD' or date) charged at the weekend rates
+        :param daily_charge: Fixed charge per day
+        :param discount_percent: Percentage discount applied to the total bill
+        :param hop_excluded_starts: Times ('HH:MM') at which the Hour of Power may never start
+        """
+        self.name = name
+        self.daily_charge = float(daily_charge)
+        self.discount_percent = float(discount_percent)
+        self.holidays = np.array(sorted(holidays), dtype='datetime64[D]')
+
+        weekend_rates = _compile_bands(weekend if weekend is not None else weekday)
+        self.rates = np.stack([_compile_bands(weekday), weekend_rates, weekend_rates])
+
+        # An hour starting in slot s covers slots s and s + 1, and neither may be peak
+        distinct = np.unique(self.rates)
+        self.peak_rate = float(distinct[-1]) if len(distinct) > 1 else None
+        self.off_peak = self.rates != self.peak_rate
+        self.excluded_starts = np.zeros(SLOTS_PER_DAY, dtype=bool)
+        for start in hop_excluded_starts:
+            self.excluded_starts[time_to_slot(start)] = True
+        self.hop_eligible = self.window_eligible(2)
+
+    def __repr__(self):
+        return 'Tariff({})'.format(self.name)
+
+    def window_eligible(self, slots):
+        """
+        Generalises hop_eligible to free windows of any number of half-hour slots.
+
+        :return: 3 x 48 bool table, True where a window of that many slots may start: every
+                 slot it covers is off-peak and the start is not excluded
+        """
+        eligible = self.off_peak.copy()
+        for offset in range(1, slots):
+            eligible &= np.roll(self.off_peak, -offset, axis=1)
+        return eligible & ~self.excluded_starts
+
+    def day_types(self, days):
+        """
+        :param days: datetime64[D] array of local dates
+        :return: Array of WEEKDAY / WEEKEND / HOLIDAY codes
+        """
+        days = np.asarray(days, dtype='datetime64[D]')
+        weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+        day_types = np.where(weekday < 5, WEEKDAY, WEEKEND)
+        if len(self.holidays):
+            day_types[np.isin(days, self.holidays)] = HOLIDAY
+        return day_types
+
+    def index(self, local_times):
+        """
+        :param local_times: Naive datetime64 array of local wall-clock times
+        :return: Tuple of (day_types, slots) arrays for indexing rates / hop_eligible
+        """
+        local_times = np.asarray(local_times, dtype='datetime64[m]')
+        days = local_times.astype('datetime64[D]')
+        slots = (local_times - days).astype(np.int64) // 30
+        return self.day_types(days), slots
+
+    def rate_at(self, local_times):
+        return self.rates[self.index(local_times)]
+
+    def hop_eligible_at(self, local_times):
+        return self.hop_eligible[self.index(local_times)]
+
+    def daily_costs(self, days, kwh):
+        """
+        Prices half-hourly consumption, including the daily charge but before any discount.
+
+        :param days: datetime64[D] array of local dates
+        :param kwh: days x 48 matrix of kWh used in each half-hour
+        :return: Array of costs per day
+        """
+        rates = self.rates[self.day_types(days)]
+        return np.einsum('ij,ij->i', rates, np.asarray(kwh, dtype=float)) + self.daily_charge
+
+    def apply_discount(self, total):
+        return total - (self.discount_percent / 100) * total
+
+
+# Electric Kiwi does not allow the Hour of Power to start at these times
+EK_HOP_EXCLUDED_STARTS = ['06:30', '07:00', '07:30', '08:00', '08:30',
+                          '16:30', '17:00', '17:30', '18:00', '18:30',
+                          '19:00', '19:30', '20:00', '20:30', '23:30']
+
+# Tariff the optimiser uses to estimate the value of each candidate Hour of Power
+# Peak: weekdays 7am-9am and 5pm-9pm, off-peak shoulder: weekdays 9am-5pm, 9pm-11pm and
+# weekends 7am-11pm, off-peak night: 11pm-7am daily
+DEFAULT_TARIFF = Tariff(
+    'kiwi',
+    weekday=[['0700', '0900', 0.2208], ['0900', '1700', 0.1546], ['1700', '2100', 0.2208],
+             ['2100', '2300', 0.1546], ['2300', '0700', 0.1104]],
+    weekend=[['0700', '2300', 0.1546], ['2300', '0700', 0.1104]],
+    hop_excluded_starts=EK_HOP_EXCLUDED_STARTS,
+)
+
+# Plans offered by Electric Kiwi, prices include GST. All of them come with the Hour of Power.
+PLANS = {
+    'loyal_kiwi': Tariff('loyal_kiwi', weekday=0.2852, daily_charge=0.83, hop_excluded_starts=EK_HOP_EXCLUDED_STARTS),
+    # 'loyal_kiwi_low': Tariff('loyal_kiwi_low', weekday=0.3072, daily_charge=0.34),
+    # 'kiwi': Tariff('kiwi', weekday=0.2963, daily_charge=0.83),
+    # 'kiwi_low': Tariff('kiwi_low', weekday=0.3183, daily_charge=0.34),
+    'stay_ahead': Tariff('stay_ahead', weekday=0.2362, daily_charge=1.35, discount_percent=11.5,
+                         hop_excluded_starts=EK_HOP_EXCLUDED_STARTS),
+    # 'stay_ahead_low': Tariff('stay_ahead_low', weekday=0.3204, daily_charge=0.37, discount_percent=11.5),
+    'move_master': Tariff(
+        'move_master',
+        weekday=[['0700', '0900', 0.3959], ['0900', '1700', 0.2613], ['1700', '2100', 0.3959],
+                 ['2100', '2300', 0.2613], ['2300', '0700', 0.1980]],
+        daily_charge=0.83,
+        hop_excluded_starts=EK_HOP_EXCLUDED_STARTS,
+    ),
+    # 'move_master_low': Tariff(
+    #     'move_master_low',
+    #     weekday=[['0700', '0900', 0.4265], ['0900', '1700', 0.2814], ['1700', '2100', 0.4265],
+    #              ['2100', '2300', 0.2814], ['2300', '0700', 0.2132]],
+    #     daily_charge=0.34,
+    # ),
+}
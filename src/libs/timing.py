@@ -0,0 +1,81 @@
+import cProfile
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+class Timings(object):
+    """
+    Collects per-stage timing spans for one run (fetch, clean, optimise, ek_auth, set_hop, notify).
+
+    Every span is logged as one 'stage_timing' JSON line, which Application Insights keeps as
+    a searchable trace, and can carry counts such as rows and bytes.
+    """
+
+    def __init__(self, **fields):
+        """
+        :param fields: Added to every span, e.g. household="home"
+        """
+        self.fields = fields
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, profile=False, **fields):
+        """
+        Times the body of a with block. Yields a dict that the block can add counts to.
+
+        :param profile: Also write a cProfile dump of the block when HOP_PROFILE is set
+        """
+        record = dict(self.fields, stage=stage, **fields)
+        profile_dir = os.getenv("HOP_PROFILE") if profile else None
+        profiler = cProfile.Profile() if profile_dir else None
+
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+                record["profile"] = self._dump(profiler, profile_dir, record)
+            record["seconds"] = round(time.perf_counter() - started, 4)
+            with self._lock:
+                self.spans.append(record)
+            logging.info("stage_timing " + json.dumps(record, default=str))
+
+    @staticmethod
+    def _dump(profiler, directory, record):
+        os.makedirs(directory, exist_ok=True)
+        name = "-".join(str(record[key]) for key in ("stage", "household") if key in record)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(directory, re.sub(r'[^\w.-]', '_', f"{name}-{stamp}.prof"))
+        profiler.dump_stats(path)
+        return path
+
+    def total(self):
+        return sum(span["seconds"] for span in self.spans)
+
+    def summary(self):
+        """
+        :return: One line per stage, e.g. 'fetch: 1.23s (1440 rows, 90 KB)'
+        """
+        lines = []
+        for span in self.spans:
+            counts = []
+            if "rows" in span:
+                counts.append(f"{span['rows']} rows")
+            if "bytes" in span:
+                counts.append(f"{span['bytes'] / 1024:.0f} KB")
+            line = f"{span['stage']}: {span['seconds']:.2f}s"
+            lines.append(line + (f" ({', '.join(counts)})" if counts else ""))
+        return "\n".join(lines)
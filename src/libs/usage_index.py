@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from libs.data import NZDT, _summarise
+from libs.tariff import DEFAULT_TARIFF, SLOTS_PER_DAY
+
+
+class UsageIndex(object):
+    """
+    Rolling average of the kWh used in the hour starting at each half-hour, per weekday.
+
+    Every optimiser run reports its candidate hours (the intervals list), and each one updates
+    its (weekday, slot) average in O(1), so the index can predict the Hour of Power instantly
+    without fetching anything.
+    """
+
+    def __init__(self, alpha=0.25, mean=None, count=None, seen=None):
+        """
+        :param alpha: Weight of the newest day in the exponential moving average
+        """
+        self.alpha = alpha
+        self.mean = np.zeros((7, SLOTS_PER_DAY)) if mean is None else np.asarray(mean, dtype=float)
+        self.count = np.zeros((7, SLOTS_PER_DAY), dtype=np.int64) if count is None else np.asarray(count, dtype=np.int64)
+        # Latest interval start (epoch seconds) already counted, so rerunning a day is a no-op
+        self.seen = np.zeros((7, SLOTS_PER_DAY), dtype=np.int64) if seen is None else np.asarray(seen, dtype=np.int64)
+
+    def update(self, intervals):
+        """
+        :param intervals: (start, end, cost, kWh) tuples as returned by calculate_optimal_hop
+        :return: Number of slots updated
+        """
+        updated = 0
+        for start, _, _, kwh in intervals:
+            start = start.astimezone(NZDT)
+            weekday, slot = start.weekday(), start.hour * 2 + start.minute // 30
+            timestamp = int(start.timestamp())
+            if timestamp <= self.seen[weekday, slot]:
+                continue
+
+            if self.count[weekday, slot]:
+                self.mean[weekday, slot] += self.alpha * (kwh - self.mean[weekday, slot])
+            else:
+                self.mean[weekday, slot] = kwh
+            self.count[weekday, slot] += 1
+            self.seen[weekday, slot] = timestamp
+            updated += 1
+        return updated
+
+    def predict(self, day, tariff=DEFAULT_TARIFF):
+        """
+        Predicts the best Hour of Power for a day from the averages alone.
+
+        :param day: Local date to predict
+        :return: Tuple of (start_time, end_time, cost, kWh, intervals) like calculate_optimal_hop,
+                 or None if no eligible slot has been seen yet
+        """
+        day_type = tariff.day_types(np.array([day], dtype='datetime64[D]'))[0]
+        kwh = self.mean[day.weekday()]
+        valid = tariff.hop_eligible[day_type] & (self.count[day.weekday()] > 0)
+        if not valid.any():
+            logging.info("No usage history to predict from.")
+            return None
+
+        midnight = datetime.combine(day, time(), NZDT)
+        costs = kwh * tariff.rates[day_type]
+        intervals = []
+        for slot in np.flatnonzero(valid):
+            start = midnight + timedelta(minutes=30 * int(slot))
+            intervals.append((start, start + timedelta(hours=1), float(costs[slot]), float(kwh[slot])))
+
+        best = intervals[int(np.argmax(costs[valid]))]
+        return _summarise(*best, intervals)
+
+    def to_json(self):
+        return json.dumps({"alpha": self.alpha, "mean": self.mean.tolist(),
+                           "count": self.count.tolist(), "seen": self.seen.tolist()})
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(**json.loads(value))
+
+
+class UsageIndexStore(object):
+    """
+    Keeps each household's UsageIndex in a local SQLite database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS usage_index (
+                              household TEXT PRIMARY KEY,
+                              data TEXT NOT NULL)""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, household):
+        with self._lock, self._connect() as db:
+            row = db.execute("SELECT data FROM usage_index WHERE household = ?", (household,)).fetchone()
+        return UsageIndex.from_json(row[0]) if row else UsageIndex()
+
+    def save(self, household, index):
+        with self._lock, self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO usage_index VALUES (?, ?)", (household, index.to_json()))
+
+    def update(self, household, intervals):
+        """
+        Adds a run's intervals to the household's index.
+        """
+        index = self.load(household)
+        if index.update(intervals):
+            self.save(household, index)
+        return index
+
+
+def get_usage_index_store():
+    """
+    Returns the store configured by USAGE_INDEX (a SQLite file path), or None when disabled.
+    """
+    path = os.getenv("USAGE_INDEX")
+    return _build_usage_index_store(path) if path else None
+
+
+@lru_cache(maxsize=4)
+def _build_usage_index_store(path):
+    return UsageIndexStore(path)
@@ -0,0 +1,205 @@
+"""
+A general free-period optimiser: the best K non-overlapping windows of any length on a regular
+slot grid, e.g. two free hours, three free half-hours, or weekend-only windows.
+
+Window values come from prefix sums (slot matrices) or one searchsorted pass (meter readings),
+and the windows are chosen by dynamic programming in O(slots x K) per day, vectorised over
+all days at once. Windows on meter readings are priced at the rate of their start slot, as the
+Hour of Power is, so with one 60-minute window on the half-hour grid it gives exactly the
+answer of data.optimal_hop_from_arrays. Pass per_slot=True to price each half-hour at its own
+rate like best_day_windows, e.g. for longer windows that run into the night rate.
+"""
+import logging
+import math
+
+import numpy as np
+
+from libs.data import (HALF_HOUR_NS, HOUR_NS, NZDT, _summarise, _to_datetime, _utc_offsets,
+                       candidate_starts, sliding_window_usage, to_local)
+from libs.tariff import DEFAULT_TARIFF
+
+
+def window_sums(slot_values, length):
+    """
+    Sums every run of length consecutive slots with prefix sums.
+
+    :param slot_values: days x slots matrix (or a 1-D array) of per-slot values
+    :return: days x (slots - length + 1) matrix; entry s covers slots s .. s + length - 1
+    """
+    slot_values = np.atleast_2d(np.asarray(slot_values, dtype=float))
+    prefix = np.zeros((slot_values.shape[0], slot_values.shape[1] + 1))
+    np.cumsum(slot_values, axis=1, out=prefix[:, 1:])
+    return prefix[:, length:] - prefix[:, :-length]
+
+
+def best_windows(values, length, count=1):
+    """
+    Chooses up to count non-overlapping windows with the highest total value on each row.
+
+    Earlier windows win ties, so with count=1 the choice is np.argmax's. When fewer than count
+    windows fit on a row, the most that fit are chosen.
+
+    :param values: days x starts matrix of each window's value, -inf (or NaN) where a window
+                   may not start; a window at start s covers grid slots s .. s + length - 1
+    :param length: Window length in grid slots
+    :param count: Number of windows
+    :return: Tuple of (starts, totals): days x count int array in time order with -1 for
+             unused windows, and the total value per day (-inf when nothing is eligible)
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+    values = np.where(np.isnan(values), -np.inf, values)
+    days, positions = values.shape
+    rows = np.arange(days)
+
+    if count == 1:
+        best = np.argmax(values, axis=1) if positions else np.zeros(days, dtype=np.int64)
+        totals = values[rows, best] if positions else np.full(days, -np.inf)
+        return np.where(np.isfinite(totals), best, -1)[:, None], totals
+
+    # best[k, i]: highest total of exactly k windows within the first i grid slots
+    slots = positions + length - 1
+    best = np.full((count + 1, slots + 1, days), -np.inf)
+    best[0] = 0.0
+    take = np.zeros((count + 1, slots + 1, days), dtype=bool)
+    for i in range(length, slots + 1):
+        window = values[:, i - length]
+        for k in range(1, count + 1):
+            candidate = best[k - 1, i - length] + window
+            take[k, i] = candidate > best[k, i - 1]
+            best[k, i] = np.where(take[k, i], candidate, best[k, i - 1])
+
+    # Use as many windows as fit, then walk back through the decisions
+    finals = best[:, slots]
+    k = np.where(np.isfinite(finals), np.arange(count + 1)[:, None], 0).max(axis=0)
+    totals = np.where(k > 0, finals[k, rows], -np.inf)
+    position = np.full(days, slots)
+    starts = np.full((days, count), -1, dtype=np.int64)
+    while True:
+        active = (k > 0) & (position >= length)
+        if not active.any():
+            break
+        took = active & take[k, position, rows]
+        starts[rows[took], k[took] - 1] = position[took] - length
+        position = np.where(took, position - length, position - active)
+        k = k - took
+    return starts, totals
+
+
+def best_day_windows(days, kwh, tariff=DEFAULT_TARIFF, slots=2, count=1, day_types=None):
+    """
+    Batch evaluation over half-hourly matrices, e.g. consumption_matrix or History.half_hour_kwh.
+    Windows are priced slot by slot and stay within their day.
+
+    :param days: datetime64[D] array of local dates
+    :param kwh: days x 48 matrix of kWh per half-hour
+    :param slots: Window length in half-hours (2 is the Hour of Power)
+    :param count: Number of free windows per day
+    :param day_types: Optional day types (e.g. (WEEKEND, HOLIDAY)) that may have windows at all
+    :return: Tuple of (starts, totals) as from best_windows; totals are the value of the free
+             windows in currency units
+    """
+    types = tariff.day_types(days)
+    values = window_sums(np.asarray(kwh, dtype=float) * tariff.rates[types], slots)
+    eligible = tariff.window_eligible(slots)[types][:, :values.shape[1]]
+    if day_types is not None:
+        eligible &= np.isin(types, day_types)[:, None]
+    return best_windows(np.where(eligible, values, -np.inf), slots, count)
+
+
+def optimal_windows(timestamps, states, length=HOUR_NS, count=1, slot=HALF_HOUR_NS,
+                    tariff=DEFAULT_TARIFF, day_types=None, usage=sliding_window_usage, per_slot=False):
+    """
+    Finds the count most valuable non-overlapping windows of a given length in meter readings.
+
+    Candidate windows start on every slot mark; the default grid is the Hour of Power one.
+    A window may only start where every half-hour it covers is off-peak (see
+    Tariff.window_eligible).
+
+    :param timestamps: Sorted int64 array of reading times (epoch ns)
+    :param states: Cumulative kWh aligned with timestamps
+    :param length: Window length in ns, a multiple of slot
+    :param count: Number of windows
+    :param slot: Grid spacing in ns
+    :param day_types: Optional day types windows may start on
+    :param usage: Function calculating (kwh, valid) per window, see sliding_window_usage
+    :param per_slot: Price each half-hour at its own rate (see window_costs) instead of the
+                     whole window at its start rate
+    :return: Tuple of (windows, intervals): the chosen (start_time, end_time, cost, kWh) tuples
+             in time order, and every eligible candidate in the same format
+    """
+    if len(timestamps) == 0 or length % slot:
+        logging.info("No valid intervals found.")
+        return [], []
+
+    if (length, slot) == (HOUR_NS, HALF_HOUR_NS):
+        starts = candidate_starts(timestamps[0], timestamps[-1])
+    else:
+        starts = grid_starts(timestamps[0], timestamps[-1], length, slot)
+    kwh, non_empty = usage(timestamps, states, starts, length)
+
+    local = to_local(starts)
+    index = tariff.index(local)
+    valid = non_empty & tariff.window_eligible(-(-length // HALF_HOUR_NS))[index]
+    if day_types is not None:
+        valid &= np.isin(index[0], day_types)
+    if per_slot:
+        costs = window_costs(timestamps, states, starts, length, kwh, tariff.rates[index],
+                             math.gcd(slot, HALF_HOUR_NS), tariff)
+    else:
+        costs = kwh * tariff.rates[index]
+
+    chosen, _ = best_windows(np.where(valid, costs, -np.inf), length // slot, count)
+
+    def window(i):
+        return _to_datetime(starts[i]), _to_datetime(starts[i] + length), float(costs[i]), float(kwh[i])
+    return [window(i) for i in chosen[0] if i >= 0], [window(i) for i in np.flatnonzero(valid)]
+
+
+def window_costs(timestamps, states, starts, length, kwh, start_rates, piece=HALF_HOUR_NS,
+                 tariff=DEFAULT_TARIFF):
+    """
+    Prices windows that may cross rate changes. Rates only change on local half-hours, so each
+    window is split into pieces that each have one rate. The window's kWh is priced at its start
+    rate, and each piece's interpolated kWh adds the difference between its rate and that one.
+    A window with a single rate therefore costs exactly kwh x rate, as in optimal_hop_from_arrays.
+
+    :param kwh: kWh of each window, e.g. from sliding_window_usage
+    :param start_rates: Rate at the start of each window
+    :param piece: Piece length in ns, dividing both length and the half-hour
+    :return: Cost of each window
+    """
+    costs = kwh * start_rates
+    piece_starts = (starts[:, None] + np.arange(0, length, piece)).ravel()
+    differences = tariff.rate_at(to_local(piece_starts)).reshape(len(starts), -1) - start_rates[:, None]
+    if not differences.any():
+        return costs
+
+    # Clamped at the ends of the data, so a window running past the last reading still prices
+    # the part it has
+    piece_kwh = np.interp(piece_starts + piece, timestamps, states) - np.interp(piece_starts, timestamps, states)
+    return costs + (piece_kwh.reshape(differences.shape) * differences).sum(axis=1)
+
+
+def grid_starts(first, last, length, slot, tz=NZDT):
+    """
+    Window starts on local slot marks, from the first mark at or after the first reading until
+    the last window that ends by the slot mark after the last reading.
+    """
+    first_offset, last_offset = _utc_offsets(np.array([first, last]), tz).tolist()
+    start_time = -(-(first + first_offset) // slot) * slot - first_offset
+    end_time = -(-(last + last_offset) // slot) * slot - last_offset
+    return np.arange(start_time, end_time - length + 1, slot, dtype=np.int64)
+
+
+def optimal_hop(timestamps, states, tariff=DEFAULT_TARIFF):
+    """
+    The Hour of Power as a one-window case of optimal_windows.
+
+    :return: Tuple of (start_time, end_time, cost, kWh, intervals) like optimal_hop_from_arrays,
+             or None if no interval is valid
+    """
+    windows, intervals = optimal_windows(timestamps, states, tariff=tariff)
+    if not windows:
+        logging.info("No valid intervals found.")
+        return None
+    return _summarise(*windows[0], intervals)
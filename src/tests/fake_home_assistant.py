@@ -0,0 +1,115 @@
+"""
+Local stand-in for the parts of the Home Assistant API this project uses:
+REST /api/history/period, the websocket recorder/statistics_during_period command and
+subscribe_trigger state subscriptions, which push_state feeds like a live meter.
+"""
+import json
+import socket
+import threading
+import time
+
+from websockets.datastructures import Headers
+from websockets.exceptions import ConnectionClosed
+from websockets.http11 import Response
+from websockets.sync.server import serve
+
+
+class FakeHomeAssistant(object):
+    def __init__(self, token="token", history=None, statistics=None):
+        """
+        :param history: List of state objects returned by /api/history/period
+        :param statistics: Dict of statistic_id to rows returned by statistics_during_period
+        """
+        self.token = token
+        self.history = history or []
+        self.statistics = statistics or {}
+        self.requests = []
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._server = serve(self._handle_websocket, "127.0.0.1", 0,
+                             process_request=self._handle_http)
+        self.url = "http://127.0.0.1:{}".format(self._server.socket.getsockname()[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._thread.join()
+
+    def _handle_http(self, connection, request):
+        if request.path.startswith("/api/websocket"):
+            return None  # Continue with the websocket handshake
+
+        self.requests.append(request.path)
+        if request.headers.get("Authorization") != "Bearer " + self.token:
+            return connection.respond(401, "Unauthorized")
+        if not request.path.startswith("/api/history/period"):
+            return connection.respond(404, "Not Found")
+
+        body = json.dumps([self.history]).encode()
+        headers = Headers([("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return Response(200, "OK", headers, body)
+
+    def _handle_websocket(self, websocket):
+        websocket.send(json.dumps({"type": "auth_required"}))
+        message = json.loads(websocket.recv())
+        if message.get("access_token") != self.token:
+            websocket.send(json.dumps({"type": "auth_invalid", "message": "Invalid access token"}))
+            return
+        websocket.send(json.dumps({"type": "auth_ok"}))
+
+        try:
+            for raw in websocket:
+                message = json.loads(raw)
+                self.requests.append(message["type"])
+                if message["type"] == "recorder/statistics_during_period":
+                    result = {statistic_id: self.statistics.get(statistic_id, [])
+                              for statistic_id in message["statistic_ids"]}
+                    websocket.send(json.dumps({"id": message["id"], "type": "result",
+                                               "success": True, "result": result}))
+                elif message["type"] == "subscribe_trigger":
+                    websocket.send(json.dumps({"id": message["id"], "type": "result",
+                                               "success": True, "result": None}))
+                    with self._lock:
+                        self._subscribers.append((websocket, message["id"], message["trigger"]["entity_id"]))
+                else:
+                    websocket.send(json.dumps({"id": message["id"], "type": "result", "success": False,
+                                               "error": {"code": "unknown_command"}}))
+        except ConnectionClosed:
+            pass  # dropped by disconnect_subscribers
+
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] is not websocket]
+
+    def push_state(self, entity_id, state, last_changed):
+        """
+        Sends a state change to everyone subscribed to the entity.
+        """
+        to_state = {"entity_id": entity_id, "state": state, "attributes": {},
+                    "last_changed": last_changed, "last_updated": last_changed}
+        with self._lock:
+            subscribers = [s for s in self._subscribers if s[2] == entity_id]
+        for websocket, subscription, _ in subscribers:
+            websocket.send(json.dumps({"id": subscription, "type": "event", "event": {
+                "variables": {"trigger": {"platform": "state", "entity_id": entity_id, "to_state": to_state}}}}))
+
+    def disconnect_subscribers(self):
+        """
+        Drops every subscribed connection without a closing handshake, like a network failure.
+        """
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for websocket, _, _ in subscribers:
+            websocket.socket.shutdown(socket.SHUT_RDWR)
+
+    def wait_for_subscribers(self, count=1, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self._subscribers) >= count:
+                    return
+            time.sleep(0.01)
+        raise TimeoutError(f"{count} subscribers did not connect")
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+import numpy as np
+
+from libs.archive import MeterArchive
+from libs.backtest import History
+from libs.compare_plans import archive_matrix
+from libs.data import _readings_to_arrays, optimal_hop_from_arrays
+from libs.households import archive_readings, archive_readings_in_background
+from tests.test_data import make_usage_data
+
+
+def epoch_ns(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp()) * 10**9
+
+
+class TestMeterArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = MeterArchive(self.tmp.name)
+        data = make_usage_data(datetime(2024, 4, 20, tzinfo=timezone.utc), 24 * 40, 600)
+        self.timestamps, self.states = _readings_to_arrays(data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_is_idempotent(self):
+        half = len(self.timestamps) // 2
+        self.assertEqual(self.archive.append("sensor.kwh", self.timestamps[:half], self.states[:half]), half)
+
+        # The next run's fetch overlaps the last one and arrives unsorted
+        order = np.random.default_rng(0).permutation(np.arange(half - 100, len(self.timestamps)))
+        added = self.archive.append("sensor.kwh", self.timestamps[order], self.states[order])
+        self.assertEqual(added, len(self.timestamps) - half)
+        self.assertEqual(self.archive.append("sensor.kwh", self.timestamps, self.states), 0)
+
+        self.assertEqual(self.archive.months("sensor.kwh"), ["2024-04", "2024-05"])
+        timestamps, states = self.archive.read("sensor.kwh")
+        np.testing.assert_array_equal(timestamps, self.timestamps)
+        np.testing.assert_array_equal(states, self.states)
+        self.assertEqual(self.archive.watermark("sensor.kwh"), self.timestamps[-1])
+
+    def test_range_reads(self):
+        self.archive.append("sensor.kwh", self.timestamps, self.states)
+
+        start, end = epoch_ns(2024, 5, 3), epoch_ns(2024, 5, 4)
+        timestamps, states = self.archive.read("sensor.kwh", start, end)
+        self.assertIsInstance(timestamps, np.memmap)  # one partition, no copy
+        expected = (self.timestamps >= start) & (self.timestamps < end)
+        np.testing.assert_array_equal(timestamps, self.timestamps[expected])
+        self.assertEqual(optimal_hop_from_arrays(timestamps, states)[:4],
+                         optimal_hop_from_arrays(self.timestamps[expected], self.states[expected])[:4])
+
+        timestamps, _ = self.archive.read("sensor.kwh", epoch_ns(2024, 4, 29), epoch_ns(2024, 5, 2))
+        self.assertEqual(len(timestamps), 3 * 24 * 6)
+        self.assertEqual(len(self.archive.read("sensor.kwh", epoch_ns(2025, 1, 1))[0]), 0)
+        self.assertEqual(len(self.archive.read("sensor.other")[0]), 0)
+
+    def test_interrupted_append(self):
+        self.archive.append("sensor.kwh", self.timestamps[:10], self.states[:10])
+        with open(os.path.join(self.tmp.name, "sensor.kwh", "2024-04.kwh"), "ab") as f:
+            f.write(np.float64(99).tobytes())  # the timestamp never made it
+
+        self.assertEqual(len(self.archive.read("sensor.kwh")[0]), 10)
+        self.archive.append("sensor.kwh", self.timestamps[10:20], self.states[10:20])
+        np.testing.assert_array_equal(self.archive.read("sensor.kwh")[1], self.states[:20])
+
+    def test_history_and_plans(self):
+        self.assertEqual(archive_readings({"name": "home", "home_assistant_entity_id": "sensor.kwh"},
+                                          self.timestamps, self.states, archive=self.archive), len(self.timestamps))
+        history = History.from_archive(self.archive, "sensor.kwh", epoch_ns(2024, 5, 1))
+        expected = History(*[a[self.timestamps >= epoch_ns(2024, 5, 1)] for a in (self.timestamps, self.states)])
+        np.testing.assert_array_equal(history.hour_kwh, expected.hour_kwh)
+
+        dates, kwh = archive_matrix(self.archive, "sensor.kwh")
+        self.assertEqual(kwh.shape, (len(dates), 48))
+        self.assertAlmostEqual(kwh.sum(), self.states[-1] - self.states[0], delta=1)
+
+    def test_archiving_does_not_block_the_run(self):
+        release = threading.Event()
+        archive = mock.Mock()
+        archive.append.side_effect = lambda *args: release.wait(5) and len(self.timestamps)
+
+        future = archive_readings_in_background({"name": "home", "home_assistant_entity_id": "sensor.kwh"},
+                                                self.timestamps, self.states, archive=archive)
+        self.assertFalse(future.done())
+        release.set()
+        self.assertEqual(future.result(timeout=5), len(self.timestamps))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from libs.backtest import (ForecastStrategy, History, RecentDays, TodaysPeak, WeekdayProfile,
+                           backtest, format_results, recent_days)
+from libs.data import NZDT, calculate_optimal_hop
+from tests.test_data import make_usage_data
+
+
+def make_history(days, step_seconds=300, seed=0):
+    """
+    Cumulative meter readings with a nightly 21:30 load on most days.
+    """
+    rng = np.random.default_rng(seed)
+    start = int(datetime(2022, 1, 1, tzinfo=timezone.utc).timestamp()) * 10**9
+    timestamps = start + np.arange(days * 86400 // step_seconds, dtype=np.int64) * step_seconds * 10**9
+
+    hours = np.array([datetime.fromtimestamp(ts, NZDT).hour + datetime.fromtimestamp(ts, NZDT).minute / 60
+                      for ts in range(start // 10**9, timestamps[-1] // 10**9 + 1, 1800)])
+    half_hours = (timestamps - start) // (1800 * 10**9)
+    load = rng.uniform(0.1, 0.5, len(timestamps))
+    load[((hours[half_hours] >= 21.5) & (hours[half_hours] < 22.5)) & (rng.random(len(timestamps)) < 0.8)] += 3
+    states = 1000 + np.cumsum(load * step_seconds / 3600)
+    return History(timestamps, states)
+
+
+class TestBacktest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.history = make_history(70)
+
+    def test_todays_peak_matches_calculate_optimal_hop(self):
+        data = make_usage_data(datetime(2024, 5, 1, 11, 0, tzinfo=timezone.utc), 24 * 4, 120)
+        history = History.from_readings(data)
+        day = 2
+        decided = history.day_ends[day] - 5 * 60 * 10**9
+        window = [obj for obj in data
+                  if decided - 24 * 3600 * 10**9 <= datetime.fromisoformat(obj["last_changed"]).timestamp() * 10**9 < decided]
+
+        slot = TodaysPeak()(history, day)
+        start_time = calculate_optimal_hop(window)[0]
+        self.assertEqual(datetime.strptime(start_time, "%I:%M %p"), datetime(1900, 1, 1) + timedelta(minutes=30 * slot))
+
+    def test_oracle_bounds_every_strategy(self):
+        results = backtest(self.history, max_workers=1)
+
+        self.assertEqual(set(results), {"todays_peak", "weekday_profile", "recent_days"})
+        for result in results.values():
+            self.assertEqual(result["days"], len(self.history.days) - 28 - 1)
+            self.assertLessEqual(result["savings"], result["oracle"])
+            self.assertLessEqual(result["hits"], result["days"])
+        self.assertGreater(results["todays_peak"]["capture"], 95)
+        self.assertGreater(results["weekday_profile"]["capture"], 50)
+        self.assertIn("todays_peak", format_results(results))
+
+    def test_forecasts_only_use_earlier_days(self):
+        history = make_history(35)
+        expected = RecentDays()(history, 30)
+        history.half_hour_kwh[30:] = 0
+        self.assertEqual(RecentDays()(history, 30), expected)
+        self.assertIsNone(WeekdayProfile()(history, 0))
+
+    def test_process_pool_matches_serial(self):
+        serial = backtest(self.history, max_workers=1)
+        parallel = backtest(self.history, max_workers=2)
+        for name in serial:
+            np.testing.assert_array_equal(serial[name]["slots"], parallel[name]["slots"])
+            self.assertEqual(serial[name]["savings"], parallel[name]["savings"])
+
+    def test_strategies_that_cannot_be_pickled_run_in_process(self):
+        strategies = (RecentDays(), ForecastStrategy(lambda history, day: recent_days(history, day), "lambda"))
+        results = backtest(self.history, strategies, max_workers=2)
+        np.testing.assert_array_equal(results["lambda"]["slots"], results["recent_days"]["slots"])
+
+    def test_multi_year_history(self):
+        history = make_history(365 * 3, step_seconds=900, seed=1)
+        results = backtest(history, max_workers=4)
+        self.assertEqual(results["todays_peak"]["days"], len(history.days) - 28 - 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest import mock
+
+from benchmarks import suite
+from benchmarks.synthetic import DST_ENDS, generate_readings, history_response
+from libs.data import NZDT, calculate_optimal_hop
+from libs.home_assistant import parse_history_stream
+
+
+class TestSyntheticMeter(unittest.TestCase):
+    def test_resolution_gaps_and_unavailable(self):
+        readings = generate_readings(days=1, resolution=60, gaps=2, gap_hours=1, unavailable=0.1, seed=1)
+        self.assertLessEqual(len(readings), 1440 - 120)
+
+        states = [float(r["state"]) for r in readings if r["state"] != "unavailable"]
+        self.assertEqual(states, sorted(states))
+        self.assertAlmostEqual(sum(r["state"] == "unavailable" for r in readings) / len(readings), 0.1, delta=0.03)
+
+        times = [datetime.fromisoformat(r["last_changed"]).timestamp() for r in readings]
+        self.assertGreaterEqual(max(b - a for a, b in zip(times, times[1:])), 3600)
+
+    def test_dst_transition(self):
+        readings = generate_readings(days=1, resolution=600, start=DST_ENDS)
+        local = {datetime.fromisoformat(r["last_changed"]).astimezone(NZDT).utcoffset() for r in readings}
+        self.assertEqual(len(local), 2)
+        self.assertIsNotNone(calculate_optimal_hop(readings))
+
+    def test_history_response_parses(self):
+        readings = generate_readings(days=0.5, resolution=60, unavailable=0.05)
+        timestamps, states = parse_history_stream([history_response(readings)])
+        self.assertEqual(len(timestamps), sum(r["state"] != "unavailable" for r in readings[1:]))
+
+
+class TestSuite(unittest.TestCase):
+    def run_suite(self, *args, results):
+        with mock.patch.object(suite, "run", lambda cases, repeat: dict(results)), \
+                mock.patch.object(suite, "calibrate", lambda: 0.1), redirect_stdout(io.StringIO()) as output:
+            status = suite.main(["--baseline", self.baseline, *args])
+        return status, output.getvalue()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.baseline = os.path.join(self.tmp.name, "baseline.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_regressions_fail_the_run(self):
+        self.run_suite("--update-baseline", results={"optimise/1d@60s": 0.010, "token/100": 0.002})
+        with open(self.baseline) as f:
+            self.assertEqual(json.load(f)["cases"]["token/100"], 0.002)
+
+        status, _ = self.run_suite(results={"optimise/1d@60s": 0.012, "token/100": 0.002})
+        self.assertEqual(status, 0)
+
+        status, output = self.run_suite(results={"optimise/1d@60s": 0.020, "token/100": 0.002, "new": 1})
+        self.assertEqual(status, 1)
+        self.assertIn("optimise/1d@60s", [line.split()[0] for line in output.splitlines() if "REGRESSION" in line])
+
+    def test_partial_update_keeps_one_calibration(self):
+        with open(self.baseline, "w") as f:
+            json.dump({"calibration": 0.2, "cases": {"token/100": 0.004}}, f)
+
+        self.run_suite("--update-baseline", results={"optimise/1d@60s": 0.010})
+        with open(self.baseline) as f:
+            self.assertEqual(json.load(f), {"calibration": 0.2, "cases": {"token/100": 0.004, "optimise/1d@60s": 0.020}})
+
+        status, _ = self.run_suite(results={"optimise/1d@60s": 0.010, "token/100": 0.002})
+        self.assertEqual(status, 0)
+
+    def test_missing_baseline_fails_the_run(self):
+        status, output = self.run_suite(results={"token/100": 0.002})
+        self.assertEqual(status, 1)
+        self.assertIn("no baseline", output)
+
+    def test_committed_baseline_covers_every_case(self):
+        with open(suite.DEFAULT_BASELINE) as f:
+            self.assertEqual(set(json.load(f)["cases"]), set(suite.CASES))
+
+    def test_cases_run(self):
+        results = suite.run({name: case for name, case in suite.CASES.items() if name.endswith("@60s")}, repeat=1)
+        self.assertTrue(all(seconds > 0 for seconds in results.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+
+import numpy as np
+
+from libs.compare_plans import compare_plans, consumption_matrix, price_plans, simulate_hop, sweep
+from libs.tariff import EK_HOP_EXCLUDED_STARTS, PLANS, Tariff
+
+
+def make_consumption(days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = np.arange(np.datetime64('2023-01-01'), np.datetime64('2023-01-01') + days)
+    return {str(day): {"intervals": {str(interval): {"consumption": str(round(rng.uniform(0, 2), 3))}
+                                     for interval in range(1, 49)}} for day in dates}
+
+
+def price_each(dates, kwh, tariffs, include_discount=True):
+    # The original per-plan loop
+    totals = []
+    for tariff in tariffs:
+        total = tariff.daily_costs(dates, kwh).sum()
+        totals.append(tariff.apply_discount(total) if include_discount else total)
+    return np.array(totals)
+
+
+def best_hop_each(dates, kwh, tariff):
+    # Best free hour one day and slot at a time
+    saving, slots = 0.0, []
+    for day, day_type in enumerate(tariff.day_types(dates)):
+        best, best_slot = None, -1
+        for slot in range(48):
+            if not tariff.hop_eligible[day_type, slot]:
+                continue
+            value = tariff.rates[day_type, slot] * kwh[day, slot]
+            if slot < 47:
+                value += tariff.rates[day_type, slot + 1] * kwh[day, slot + 1]
+            elif day + 1 < len(dates) and dates[day + 1] == dates[day] + 1:
+                value += tariff.rates[tariff.day_types(dates[day + 1:day + 2])[0], 0] * kwh[day + 1, 0]
+            else:
+                continue
+            if best is None or value > best:
+                best, best_slot = value, slot
+        saving += best or 0.0
+        slots.append(best_slot)
+    return saving, slots
+
+
+class TestComparePlans(unittest.TestCase):
+    def setUp(self):
+        self.dates, self.kwh = consumption_matrix(make_consumption(60))
+
+    def test_consumption_matrix(self):
+        consumption = make_consumption(3)
+        dates, kwh = consumption_matrix(consumption)
+        self.assertEqual(kwh.shape, (3, 48))
+        self.assertEqual(str(dates[0]), '2023-01-01')
+        self.assertEqual(kwh[2, 47], float(consumption['2023-01-03']['intervals']['48']['consumption']))
+
+    def test_matches_per_plan_pricing(self):
+        tariffs = list(PLANS.values()) + [
+            Tariff('holidays', [['0700', '2100', 0.3], ['2100', '0700', 0.1]], weekend=0.15,
+                   holidays=['2023-01-02', '2023-01-26'], daily_charge=1.5, discount_percent=5)]
+        for include_discount in (True, False):
+            np.testing.assert_allclose(price_plans(self.dates, self.kwh, tariffs, include_discount),
+                                       price_each(self.dates, self.kwh, tariffs, include_discount))
+
+    def test_compare_plans_sorted(self):
+        totals, total_kwh = compare_plans(make_consumption(10))
+        self.assertEqual(sorted(name for name, _ in totals), sorted(PLANS))
+        self.assertEqual([total for _, total in totals], sorted(total for _, total in totals))
+        self.assertGreater(total_kwh, 0)
+
+    def test_many_plans(self):
+        dates, kwh = consumption_matrix(make_consumption(365 * 3))
+        rng = np.random.default_rng(1)
+        tariffs = [Tariff(str(i), rng.uniform(0.1, 0.4, 48), weekend=rng.uniform(0.1, 0.3, 48),
+                          daily_charge=rng.uniform(0.5, 3), discount_percent=rng.uniform(0, 15))
+                   for i in range(500)]
+
+        totals = price_plans(dates, kwh, tariffs)
+        np.testing.assert_allclose(totals[:5], price_each(dates, kwh, tariffs[:5]))
+
+
+class TestSimulateHop(unittest.TestCase):
+    def setUp(self):
+        self.dates, self.kwh = consumption_matrix(make_consumption(21, seed=2))
+
+    def test_matches_per_day_search(self):
+        tariffs = list(PLANS.values()) + [Tariff('no_hop', 0.3, hop_excluded_starts=[
+            '{:02d}:{:02d}'.format(slot // 2, slot % 2 * 30) for slot in range(48)])]
+        results = simulate_hop(self.dates, self.kwh, tariffs, include_discount=False, chunk_size=2)
+
+        for i, tariff in enumerate(tariffs):
+            saving, slots = best_hop_each(self.dates, self.kwh, tariff)
+            self.assertAlmostEqual(results['hop_saving'][i], saving)
+            self.assertEqual(results['hop_slots'][i].tolist(), slots)
+        np.testing.assert_allclose(results['without_hop'], price_plans(self.dates, self.kwh, tariffs, False))
+        self.assertEqual(results['hop_saving'][-1], 0)
+
+    def test_hop_does_not_run_into_a_missing_day(self):
+        # Only 23:30 is eligible, and the day after 2023-01-02 is missing
+        tariff = Tariff('late', 0.3, hop_excluded_starts=[
+            '{:02d}:{:02d}'.format(slot // 2, slot % 2 * 30) for slot in range(47)])
+        keep = np.array([0, 1, 3, 4])
+        dates, kwh = self.dates[keep], self.kwh[keep]
+
+        results = simulate_hop(dates, kwh, [tariff], include_discount=False)
+        self.assertEqual(results['hop_slots'][0].tolist(), [47, -1, 47, -1])
+        self.assertAlmostEqual(results['hop_saving'][0], best_hop_each(dates, kwh, tariff)[0])
+        self.assertAlmostEqual(results['hop_saving'][0],
+                               0.3 * (kwh[0, 47] + kwh[1, 0] + kwh[2, 47] + kwh[3, 0]))
+
+    def test_discount_applies_after_hop(self):
+        tariff = PLANS['stay_ahead']
+        with_discount = simulate_hop(self.dates, self.kwh, [tariff])
+        without_discount = simulate_hop(self.dates, self.kwh, [tariff], include_discount=False)
+        self.assertAlmostEqual(with_discount['with_hop'][0], tariff.apply_discount(without_discount['with_hop'][0]))
+
+    def test_hop_avoids_peak_and_excluded_starts(self):
+        results = simulate_hop(self.dates, self.kwh, [PLANS['move_master']])
+        slots = results['hop_slots'][0]
+        self.assertTrue(PLANS['move_master'].hop_eligible[0, slots].all())
+        self.assertFalse(np.isin(slots, [13, 14, 15, 16, 17, 33, 34, 35, 36, 37, 38, 39, 40, 41, 47]).any())
+
+    def test_grid_search(self):
+        dates, kwh = consumption_matrix(make_consumption(365))
+
+        def build(night, day, daily):
+            return Tariff('grid', [['0700', '2300', day], ['2300', '0700', night]],
+                          daily_charge=daily, hop_excluded_starts=EK_HOP_EXCLUDED_STARTS)
+
+        results = sweep(dates, kwh, build, night=np.linspace(0.1, 0.2, 6),
+                        day=np.linspace(0.2, 0.35, 6), daily=np.linspace(0.3, 1.5, 6))
+
+        self.assertEqual(len(results), 216)
+        cheapest = results[0][0]
+        self.assertEqual((cheapest['night'], cheapest['day'], cheapest['daily']), (0.1, 0.2, 0.3))
+        self.assertTrue(all(with_hop < without_hop for _, with_hop, without_hop in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, timedelta
+
+from libs.consumption import ConsumptionRepository
+
+
+class FakeElectricKiwi(object):
+    _customer = {"id": 1, "connection": {"id": 2}}
+
+    def __init__(self):
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def consumption(self, start_date, end_date):
+        with self._lock:
+            self.requests.append((start_date.date(), end_date.date()))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self._lock:
+            self.active -= 1
+
+        days = [start_date.date() + timedelta(days=i)
+                for i in range((end_date.date() - start_date.date()).days + 1)]
+        return {day.isoformat(): {"consumption": str(day.toordinal() % 10)} for day in days}
+
+
+class TestConsumptionRepository(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.ek = FakeElectricKiwi()
+        self.repository = ConsumptionRepository(self.ek, os.path.join(self.tmp.name, "c.db"),
+                                                chunk_days=30, max_workers=4, settle_days=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_year_is_fetched_in_parallel_chunks(self):
+        start = date.today() - timedelta(days=364)
+        days = self.repository.get(start)
+
+        self.assertEqual(len(days), 365)
+        self.assertEqual(list(days)[0], start.isoformat())
+        self.assertEqual(len(self.ek.requests), 13)
+        self.assertTrue(all((end - begin).days < 30 for begin, end in self.ek.requests))
+        self.assertGreater(self.ek.max_active, 1)
+        self.assertLessEqual(self.ek.max_active, 4)
+
+    def test_rerun_only_fetches_recent_days(self):
+        start = date.today() - timedelta(days=364)
+        first = self.repository.get(start)
+        self.ek.requests.clear()
+
+        second = self.repository.get(start)
+
+        self.assertEqual(second, first)
+        self.assertEqual(self.ek.requests, [(date.today() - timedelta(days=3), date.today())])
+
+    def test_gaps_are_fetched_separately(self):
+        start = date(2024, 1, 1)
+        self.repository.get(start, date(2024, 1, 10))
+        self.repository.get(date(2024, 1, 20), date(2024, 1, 25))
+        self.ek.requests.clear()
+
+        self.repository.get(start, date(2024, 1, 31))
+
+        self.assertEqual(self.ek.requests, [(date(2024, 1, 11), date(2024, 1, 19)),
+                                            (date(2024, 1, 26), date(2024, 1, 31))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from libs.cryptoJS import BACKENDS, PyAESBackend, decrypt, encrypt
+
+
+def available_backends():
+    backends = []
+    for backend in BACKENDS:
+        try:
+            backends.append(backend())
+        except ImportError:
+            pass
+    return backends
+
+
+class TestCryptoJS(unittest.TestCase):
+    def test_round_trip_with_pyaes(self):
+        reference = PyAESBackend()
+        messages = [b"", b"a", b"/hop/1/2/|1714521600|0123456789ABCDEF", b"x" * 16, b"y" * 100]
+        for backend in available_backends():
+            for message in messages:
+                with self.subTest(backend=backend.name, length=len(message)):
+                    encrypted = encrypt(message, b"secret", backend=backend)
+                    self.assertEqual(decrypt(encrypted, b"secret", backend=reference), message)
+                    encrypted = encrypt(message, b"secret", backend=reference)
+                    self.assertEqual(decrypt(encrypted, b"secret", backend=backend), message)
+
+    def test_default_backend(self):
+        encrypted = encrypt(b"message", b"passphrase")
+        self.assertTrue(encrypted.startswith(b"U2FsdGVkX1"))  # base64 of "Salted__"
+        self.assertEqual(decrypt(encrypted, b"passphrase"), b"message")
+
+
+if __name__ == '__main__':
+    unittest.main()
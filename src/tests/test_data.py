@@ -0,0 +1,103 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from concurrent.futures import Future
+
+from libs.data import (calculate_optimal_hop, calculate_optimal_hop_reference, chart_or_none, plot_intervals,
+                       render_intervals, render_intervals_in_background)
+from libs.timing import Timings
+
+
+def make_usage_data(start, hours, step_seconds, seed=0):
+    """
+    Builds Home Assistant style state objects for a cumulative kWh meter.
+    """
+    rng = random.Random(seed)
+    usage_data = []
+    state = 1000.0
+    for i in range(int(hours * 3600 / step_seconds)):
+        state += rng.random() * step_seconds / 3600 * 2
+        timestamp = start + timedelta(seconds=i * step_seconds)
+        usage_data.append({
+            "state": str(round(state, 3)),
+            "last_changed": timestamp.isoformat()
+        })
+    return usage_data
+
+
+def normalise(result):
+    """
+    Compares datetimes by instant; ambiguous DST wall times never compare equal across tzinfo types.
+    """
+    start_time, end_time, cost, kwh, intervals = result
+    return start_time, end_time, float(cost), float(kwh), [
+        (start.timestamp(), end.timestamp(), float(c), float(k)) for start, end, c, k in intervals]
+
+
+class TestCalculateOptimalHop(unittest.TestCase):
+    def test_matches_reference(self):
+        # Mix of weekday/weekend and an irregular reading interval
+        for start, hours, step in [
+            (datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc), 24, 60),
+            (datetime(2024, 5, 3, 11, 55, tzinfo=timezone.utc), 48, 97),
+            (datetime(2024, 4, 6, 10, 0, tzinfo=timezone.utc), 36, 300),  # NZ DST ends
+        ]:
+            data = make_usage_data(start, hours, step)
+            with self.subTest(start=start):
+                self.assertEqual(normalise(calculate_optimal_hop(data)),
+                                 normalise(calculate_optimal_hop_reference(data)))
+
+    def test_unsorted_input_with_gaps(self):
+        data = make_usage_data(datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc), 24, 120)
+        data = data[:200] + data[260:]  # two hour gap
+        shuffled = data[:]
+        random.Random(1).shuffle(shuffled)
+
+        self.assertEqual(normalise(calculate_optimal_hop(shuffled)),
+                         normalise(calculate_optimal_hop_reference(data)))
+
+    def test_no_valid_intervals(self):
+        # A single reading during weekday peak never produces a valid interval
+        data = [{"state": "1.0", "last_changed": "2024-05-01T06:00:00+00:00"}]
+        self.assertIsNone(calculate_optimal_hop(data))
+
+    def test_high_resolution_multi_day(self):
+        data = make_usage_data(datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc), 24 * 3, 1)
+
+        self.assertIsNotNone(calculate_optimal_hop(data))
+
+
+class TestCharts(unittest.TestCase):
+    def setUp(self):
+        data = make_usage_data(datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc), 24, 60)
+        self.intervals = calculate_optimal_hop(data)[4]
+
+    def test_render_in_background(self):
+        timings = Timings()
+        png = chart_or_none(render_intervals_in_background(self.intervals, timings), timeout=30)
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertLess(len(png), 200_000)
+        self.assertEqual(timings.spans[0]["stage"], "chart")
+        self.assertEqual(timings.spans[0]["bytes"], len(png))
+
+    def test_plot_intervals_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "plot.png")
+            plot_intervals(self.intervals, filename)
+            with open(filename, "rb") as f:
+                self.assertEqual(f.read(), render_intervals(self.intervals))
+
+    def test_failed_or_slow_chart_is_dropped(self):
+        self.assertIsNone(render_intervals([]))
+        self.assertIsNone(chart_or_none(None))
+        self.assertIsNone(chart_or_none(Future(), timeout=0.01))
+        failed = Future()
+        failed.set_exception(RuntimeError("no fonts"))
+        self.assertIsNone(chart_or_none(failed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.electrickiwi import ElectricAuthException, ElectricKiwi, SessionCache, shared_session
+
+CUSTOMER = {"id": 1, "connection": {"id": 2}}
+HOP = {"start": {"interval": 43, "start_time": "9:00 PM"}, "end": {"end_time": "10:00 PM"}}
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession(object):
+    """
+    Stands in for requests.Session, answering the Electric Kiwi endpoints used by the client.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.valid_sid = "sid-1"
+        self.logins = 0
+        self.delay = 0
+
+    def request(self, method, url, headers=None, json=None, timeout=None):
+        endpoint = url.replace("https://api.electrickiwi.co.nz", "")
+        self.calls.append(endpoint)
+        if endpoint == "/at/":
+            return FakeResponse(200, {"data": {"token": "10" + "A" * 32 + "ZZ"}})
+        if endpoint == "/login/":
+            self.logins += 1
+            self.valid_sid = "sid-{}".format(self.logins)
+            return FakeResponse(200, {"data": {"sid": self.valid_sid, "customer": [CUSTOMER]}})
+        time.sleep(self.delay)
+        if headers.get("x-sid") != self.valid_sid:
+            return FakeResponse(401, {"error": {"code": 401, "detail": "Session expired"}})
+        return FakeResponse(200, {"data": HOP})
+
+
+class TestElectricKiwiSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "ek_session.json")
+        self.session = FakeSession()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reuses_saved_login(self):
+        ek = ElectricKiwi(session=self.session, session_cache=SessionCache(self.path))
+        ek.ensure_login("me@example.com", "hash")
+        ek.get_hop_hour()
+
+        # A new process reads the same file and skips /at/ and /login/
+        ek = ElectricKiwi(session=self.session, session_cache=SessionCache(self.path))
+        ek.ensure_login("me@example.com", "hash")
+        ek.get_hop_hour()
+
+        self.assertEqual(self.session.calls.count("/at/"), 1)
+        self.assertEqual(self.session.calls.count("/login/"), 1)
+
+    def test_expired_session_logs_in_again(self):
+        cache = SessionCache(self.path)
+        ElectricKiwi(session=self.session, session_cache=cache).ensure_login("me@example.com", "hash")
+        self.session.valid_sid = "sid-from-another-device"
+
+        ek = ElectricKiwi(session=self.session, session_cache=cache)
+        ek.ensure_login("me@example.com", "hash")
+        self.assertEqual(ek.get_hop_hour().interval, 43)
+        self.assertEqual(self.session.logins, 2)
+        self.assertEqual(cache.get("me@example.com#0")["sid"], "sid-2")
+
+    def test_threads_sharing_a_client_log_in_again_once(self):
+        ek = ElectricKiwi(session=self.session)
+        ek.ensure_login("me@example.com", "hash")
+        self.session.valid_sid = "sid-from-another-device"
+        self.session.delay = 0.01
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            hops = list(executor.map(lambda _: ek.get_hop_hour().interval, range(16)))
+
+        self.assertEqual(hops, [43] * 16)
+        self.assertEqual(self.session.logins, 2)
+
+    def test_expired_cache_entry_is_ignored(self):
+        cache = SessionCache(self.path, ttl=0)
+        ek = ElectricKiwi(session=self.session, session_cache=cache)
+        ek.ensure_login("me@example.com", "hash")
+        ek.ensure_login("me@example.com", "hash")
+        self.assertEqual(self.session.logins, 2)
+
+    def test_unreadable_or_unwritable_file_is_no_cache(self):
+        for contents in ('{"me@example.com#0": {"at', '[]'):
+            with open(self.path, "w") as f:
+                f.write(contents)
+            cache = SessionCache(self.path)
+            self.assertIsNone(cache.get("me@example.com#0"))
+            ElectricKiwi(session=self.session, session_cache=cache).ensure_login("me@example.com", "hash")
+            self.assertEqual(SessionCache(self.path).get("me@example.com#0")["sid"], self.session.valid_sid)
+
+        cache = SessionCache(os.path.join(self.tmp.name, "missing", "ek_session.json"))
+        ek = ElectricKiwi(session=self.session, session_cache=cache)
+        self.assertEqual(ek.ensure_login("me@example.com", "hash"), CUSTOMER)
+        self.assertEqual(cache.get("me@example.com#0")["sid"], self.session.valid_sid)
+        self.assertEqual(os.listdir(self.tmp.name), ["ek_session.json"])
+
+    def test_auth_error_without_credentials(self):
+        ek = ElectricKiwi(session=self.session)
+        ek._sid, ek._customer = "stale", CUSTOMER
+        with self.assertRaises(ElectricAuthException):
+            ek.get_hop_hour()
+
+    def test_shared_session_only_retries_idempotent_requests(self):
+        retry = shared_session().get_adapter('https://api.electrickiwi.co.nz').max_retries
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import time
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from libs.electrickiwi import ElectricException
+from libs.electrickiwi_async import AsyncElectricKiwi
+
+CUSTOMER = {"id": 1, "connection": {"id": 2}}
+HOP = {"start": {"interval": 43, "start_time": "9:00 PM"}, "end": {"end_time": "10:00 PM"}}
+
+
+class FakeElectricKiwiServer(object):
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.logins = 0
+        self.valid_sid = None
+        self.failures = 0  # number of 503s to return before succeeding
+
+        self.app = web.Application()
+        self.app.router.add_get("/at/", self.at)
+        self.app.router.add_post("/login/", self.login)
+        self.app.router.add_get("/connection/details/1/2/", self.authenticated({"pricing_plan": {}}))
+        self.app.router.add_get("/hop/1/2/", self.authenticated(HOP))
+        self.app.router.add_post("/hop/1/2/", self.authenticated(HOP))
+
+    async def at(self, request):
+        return web.json_response({"data": {"token": "10" + "A" * 32 + "ZZ"}})
+
+    async def login(self, request):
+        self.logins += 1
+        self.valid_sid = "sid-{}".format(self.logins)
+        return web.json_response({"data": {"sid": self.valid_sid, "customer": [CUSTOMER]}})
+
+    def authenticated(self, data):
+        async def handler(request):
+            await asyncio.sleep(self.delay)
+            if self.failures:
+                self.failures -= 1
+                return web.json_response({"error": {"detail": "busy"}}, status=503)
+            if request.headers.get("x-sid") != self.valid_sid or "x-token" not in request.headers:
+                return web.json_response({"error": {"code": 401, "detail": "Session expired"}}, status=401)
+            return web.json_response({"data": data})
+        return handler
+
+
+class TestAsyncElectricKiwi(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fake = FakeElectricKiwiServer()
+        self.server = TestServer(self.fake.app)
+        await self.server.start_server()
+        self.api_url = str(self.server.make_url("")).rstrip("/")
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_concurrent_calls(self):
+        async with AsyncElectricKiwi(api_url=self.api_url) as ek:
+            await ek.ensure_login("me@example.com", "hash")
+
+            started = time.monotonic()
+            details, hop = await asyncio.gather(ek.connection_details(), ek.get_hop_hour())
+
+            self.assertLess(time.monotonic() - started, 2 * self.fake.delay)
+            self.assertEqual(hop.interval, 43)
+            self.assertEqual((await ek.set_hop_hour(43)).interval, 43)
+
+    async def test_expired_session_logs_in_once(self):
+        async with AsyncElectricKiwi(api_url=self.api_url) as ek:
+            await ek.login("me@example.com", "hash")
+            self.fake.valid_sid = "sid-from-another-device"
+
+            hops = await asyncio.gather(*[ek.get_hop_hour() for _ in range(5)])
+
+        self.assertEqual([hop.interval for hop in hops], [43] * 5)
+        self.assertEqual(self.fake.logins, 2)
+
+    async def test_retries_server_errors(self):
+        self.fake.failures = 2
+        async with AsyncElectricKiwi(api_url=self.api_url, backoff=0.01) as ek:
+            await ek.login("me@example.com", "hash")
+            self.assertEqual((await ek.get_hop_hour()).interval, 43)
+
+            # Setting the HOP is not idempotent, so a server error is not retried
+            self.fake.failures = 1
+            with self.assertRaises(ElectricException):
+                await ek.set_hop_hour(43)
+            self.assertEqual(self.fake.failures, 0)
+
+    async def test_requires_an_open_session(self):
+        ek = AsyncElectricKiwi(api_url=self.api_url)
+        with self.assertRaisesRegex(ElectricException, "No open session"):
+            await ek.login("me@example.com", "hash")
+
+        async with ek:
+            await ek.login("me@example.com", "hash")
+        with self.assertRaisesRegex(ElectricException, "No open session"):
+            await ek.get_hop_hour()
+
+    async def test_clients_do_not_share_state(self):
+        async with AsyncElectricKiwi(api_url=self.api_url) as first, \
+                AsyncElectricKiwi(api_url=self.api_url) as second:
+            await first.login("me@example.com", "hash")
+            self.assertIsNone(second._sid)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import unittest
+from unittest import mock
+
+import function_app
+
+HOUSEHOLD = {"name": "default"}
+RESULT = {"start_time": "09:00 PM", "end_time": "10:00 PM", "usage_cost": 0.5, "usage_kwh": 2.0,
+          "intervals": [], "source": "live"}
+ENVIRONMENT = {"PUSHOVER_USER_KEY": "user", "PUSHOVER_API_TOKEN": "token", "HOP_CHART": "false",
+               "AZURE_FUNCTIONS_ENVIRONMENT": "Production"}
+
+
+class TestHourOfPower(unittest.TestCase):
+    def setUp(self):
+        patches = [mock.patch.dict(os.environ, ENVIRONMENT),
+                   mock.patch.object(function_app, "load_households", return_value=[HOUSEHOLD])]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.hour_of_power = function_app.hour_of_power.build().get_user_function()
+
+    def test_notifies_the_hop(self):
+        with mock.patch.object(function_app, "optimise_household", return_value=RESULT) as optimise, \
+                mock.patch.object(function_app, "send_pushover_notification") as notify:
+            self.hour_of_power(None)
+
+        self.assertEqual(optimise.call_args.args[0], HOUSEHOLD)
+        message = notify.call_args.kwargs["message"]
+        self.assertIn("HOP Time: 09:00 PM - 10:00 PM", message)
+        self.assertIn("Estimated Savings: $0.5", message)
+        self.assertIsNone(notify.call_args.kwargs["image"])
+
+    def test_notifies_and_raises_errors(self):
+        with mock.patch.object(function_app, "optimise_household", side_effect=Exception("login failed")), \
+                mock.patch.object(function_app, "send_pushover_notification") as notify:
+            with self.assertRaisesRegex(Exception, "login failed"):
+                self.hour_of_power(None)
+
+        self.assertEqual(notify.call_args.kwargs["title"], "Hour of Power Optimiser - Error")
+        self.assertEqual(notify.call_args.kwargs["message"], "An error occurred: login failed")
+
+    def test_notifies_configuration_errors(self):
+        with mock.patch.object(function_app, "load_households", side_effect=ValueError("Duplicate household names")), \
+                mock.patch.object(function_app, "send_pushover_notification") as notify:
+            with self.assertRaises(ValueError):
+                self.hour_of_power(None)
+
+        self.assertEqual(notify.call_args.kwargs["title"], "Hour of Power Optimiser - Error")
+        self.assertIn("Duplicate household names", notify.call_args.kwargs["message"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from libs import history_cache
+from libs.history_cache import HistoryCache, SQLiteHistoryStore
+
+
+def reading(minutes_ago, state, now):
+    return {"state": str(state), "last_changed": (now - timedelta(minutes=minutes_ago)).isoformat()}
+
+
+class TestHistoryCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = HistoryCache(SQLiteHistoryStore(os.path.join(self.tmp.name, "history.db")))
+        self.now = datetime.now(timezone.utc)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_only_fetches_after_watermark(self):
+        first = [{"entity_id": "sensor.kwh"}, reading(90, 1.0, self.now), reading(60, 2.0, self.now),
+                 {"state": "unavailable", "last_changed": self.now.isoformat()}]
+        second = [reading(60, 2.0, self.now), reading(30, 3.0, self.now)]
+
+        with mock.patch.object(history_cache, "get_usage_data", side_effect=[first, second]) as fetch:
+            self.cache.get_usage_data("http://ha", "token", "sensor.kwh")
+            usage_data = self.cache.get_usage_data("http://ha", "token", "sensor.kwh")
+
+        self.assertEqual([obj["state"] for obj in usage_data], ["1.0", "2.0", "3.0"])
+        first_start = fetch.call_args_list[0].kwargs["start_time"]
+        second_start = fetch.call_args_list[1].kwargs["start_time"]
+        self.assertLess(first_start, self.now - timedelta(hours=23))
+        self.assertEqual(second_start, self.now - timedelta(minutes=60))
+
+    def test_prunes_old_readings(self):
+        store = self.cache.store
+        store.append("sensor.kwh", [reading(60 * 24 * 40, 1.0, self.now), reading(10, 2.0, self.now)])
+
+        with mock.patch.object(history_cache, "get_usage_data", return_value=[{}]):
+            self.cache.get_usage_data("http://ha", "token", "sensor.kwh", lookback=timedelta(days=60))
+
+        self.assertEqual([obj["state"] for obj in store.read("sensor.kwh", 0)], ["2.0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
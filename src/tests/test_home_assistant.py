@@ -0,0 +1,100 @@
+import json
+import unittest
+from urllib.parse import unquote
+from datetime import datetime, timedelta, timezone
+
+from libs.data import (calculate_optimal_hop, calculate_optimal_hop_from_statistics,
+                       optimal_hop_from_arrays)
+from libs.home_assistant import (clean_usage_data, get_statistics, get_usage_arrays, get_usage_data,
+                                 parse_history_stream)
+from tests.fake_home_assistant import FakeHomeAssistant
+
+START = datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc)
+
+
+def make_statistics(start, hours, kwh_per_period):
+    rows = []
+    total = 100.0
+    for i in range(hours * 12):
+        change = kwh_per_period(i)
+        total += change
+        period_start = start + timedelta(minutes=5 * i)
+        rows.append({"start": period_start.timestamp() * 1000,
+                     "end": (period_start + timedelta(minutes=5)).timestamp() * 1000,
+                     "sum": total, "change": change})
+    return rows
+
+
+class TestHomeAssistant(unittest.TestCase):
+    def test_usage_data(self):
+        history = [{"entity_id": "sensor.kwh", "state": "1.0", "last_changed": START.isoformat()},
+                   {"state": "unavailable", "last_changed": START.isoformat()},
+                   {"state": "2.0", "last_changed": (START + timedelta(minutes=1)).isoformat()}]
+        with FakeHomeAssistant(history=history) as ha:
+            usage_data = get_usage_data(ha.url, "token", "sensor.kwh",
+                                        start_time=START, end_time=START + timedelta(days=1))
+
+        self.assertEqual(clean_usage_data(usage_data), history[2:])
+        path, query = unquote(ha.requests[0]).split("?")
+        self.assertEqual(path, "/api/history/period/" + START.isoformat())
+        self.assertIn("end_time=" + (START + timedelta(days=1)).isoformat(), query)
+
+    def test_usage_arrays(self):
+        history = [{"entity_id": "sensor.kwh", "state": "1.0", "last_changed": START.isoformat(),
+                    "attributes": {"unit_of_measurement": "kWh"}}]
+        for i in range(1, 2000):
+            state = "unavailable" if i % 100 == 0 else str(1 + i / 1000)
+            history.append({"state": state,
+                            "last_changed": (START + timedelta(seconds=i)).isoformat()})
+
+        with FakeHomeAssistant(history=history) as ha:
+            timestamps, states = get_usage_arrays(ha.url, "token", "sensor.kwh")
+
+        expected = clean_usage_data(history)
+        self.assertEqual(len(states), len(expected))
+        self.assertEqual(states.tolist(), [float(obj["state"]) for obj in expected])
+        self.assertEqual(calculate_optimal_hop(expected), optimal_hop_from_arrays(timestamps, states))
+
+    def test_parse_history_stream_chunk_boundaries(self):
+        body = json.dumps([[{"entity_id": "sensor.kwh", "state": "0"},
+                            {"state": "1.5", "last_changed": "2024-05-01T00:00:05+00:00"},
+                            {"state": "1.0", "last_changed": "2024-05-01T00:00:00.5+12:00"}]]).encode()
+        for size in (1, 3, 7, len(body)):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            timestamps, states = parse_history_stream(chunks)
+            self.assertEqual(states.tolist(), [1.0, 1.5])
+            self.assertEqual(timestamps.tolist(), [1714478400500000000, 1714521605000000000])
+
+        with self.assertRaises(ValueError):
+            parse_history_stream([body[:-10]])
+        self.assertEqual(len(parse_history_stream([b"[]"])[0]), 0)
+
+    def test_statistics_match_history(self):
+        # 1 kWh in the 5 minutes from 9:30pm NZST (09:30 UTC), 0.01 kWh otherwise
+        start = datetime(2024, 5, 1, 0, 0, tzinfo=timezone.utc)
+        statistics = make_statistics(start, 24, lambda i: 1.0 if i == 9 * 12 + 6 else 0.01)
+
+        with FakeHomeAssistant(statistics={"sensor.kwh": statistics}) as ha:
+            fetched = get_statistics(ha.url, "token", "sensor.kwh", start_time=start)
+
+        self.assertEqual(len(fetched), 24 * 12)
+        result = calculate_optimal_hop_from_statistics(fetched)
+
+        # The same meter as raw readings at every period boundary
+        history = [{"state": str(row["sum"]),
+                    "last_changed": datetime.fromtimestamp(row["end"] / 1000, timezone.utc).isoformat()}
+                   for row in statistics]
+        expected = calculate_optimal_hop(history)
+
+        self.assertEqual(result[:2], ("09:00 PM", "10:00 PM"))
+        self.assertEqual(result[:2], expected[:2])
+        self.assertAlmostEqual(result[3], 1.11)
+
+    def test_statistics_bad_token(self):
+        with FakeHomeAssistant() as ha:
+            with self.assertRaises(Exception):
+                get_statistics(ha.url, "wrong", "sensor.kwh", start_time=START)
+
+
+if __name__ == '__main__':
+    unittest.main()
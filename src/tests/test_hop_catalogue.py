@@ -0,0 +1,111 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from unittest import mock
+
+from libs import households
+from libs.data import NZDT
+from libs.hop_catalogue import HopCatalogue, HopCatalogueCache
+from libs.hop_history import SQLiteDecisionStore
+
+
+def hop_response(inactive=()):
+    start = datetime(2024, 5, 1)
+    return {"intervals": {
+        str(slot + 1): {"start_time": (start + timedelta(minutes=30 * slot)).strftime("%-I:%M %p"),
+                        "end_time": (start + timedelta(minutes=30 * slot + 30)).strftime("%-I:%M %p"),
+                        "active": 0 if slot + 1 in inactive else 1}
+        for slot in range(48)}}
+
+
+class TestHopCatalogue(unittest.TestCase):
+    def test_maps_times_to_intervals(self):
+        catalogue = HopCatalogue.from_response(hop_response(inactive=(14, 15)))
+        self.assertEqual(catalogue.interval_id(datetime(2024, 5, 1, 21, 0, tzinfo=NZDT)), 43)
+        self.assertEqual(catalogue.interval_id(datetime(2024, 5, 1, 9, 30, tzinfo=timezone.utc)), 44)
+        self.assertEqual(catalogue.interval_id(datetime(2024, 5, 1, 0, 0)), 1)
+        with self.assertRaises(ValueError):
+            catalogue.interval_id(datetime(2024, 5, 1, 21, 15, tzinfo=NZDT))
+
+        self.assertFalse(catalogue.is_eligible(14))
+        self.assertTrue(catalogue.is_eligible(43))
+        self.assertEqual(catalogue.to_json(), HopCatalogue.from_json(catalogue.to_json()).to_json())
+
+        # Formatted like the optimiser results, which used to be looked up in a list of strings
+        midnight = datetime(2024, 5, 1, tzinfo=NZDT)
+        self.assertEqual([catalogue.start_time(i) for i in range(1, 49)],
+                         [(midnight + timedelta(minutes=30 * s)).strftime("%I:%M %p") for s in range(48)])
+
+    def test_choose_skips_intervals_electric_kiwi_does_not_allow(self):
+        start = datetime(2024, 5, 1, 21, tzinfo=NZDT)
+        intervals = [(start, start + timedelta(hours=1), 0.5, 2.0),
+                     (start + timedelta(minutes=15), start + timedelta(minutes=75), 0.4, 1.8),
+                     (start + timedelta(minutes=30), start + timedelta(minutes=90), 0.3, 1.5)]
+        self.assertEqual(HopCatalogue.default().choose(intervals), (intervals[0], 43))
+        self.assertEqual(HopCatalogue.from_response(hop_response(inactive=(43,))).choose(intervals),
+                         (intervals[2], 44))
+        self.assertIsNone(HopCatalogue.from_response(hop_response(inactive=(43, 44))).choose(intervals))
+
+    def test_set_household_hop_uses_an_allowed_interval(self):
+        ek = mock.Mock()
+        ek.hop_catalogue.return_value = HopCatalogue.from_response(hop_response(inactive=(43,)))
+        start = datetime(2024, 5, 1, 21, tzinfo=NZDT)
+        intervals = [(start, start + timedelta(hours=1), 0.5, 2.0),
+                     (start - timedelta(hours=1), start, 0.25, 1.0)]
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteDecisionStore(os.path.join(tmp, "history.db"))
+            with mock.patch.dict(os.environ, {"HOP_HISTORY": store.path}):
+                result = households.set_household_hop({"name": "home"}, ("09:00 PM", "10:00 PM", 0.5, 2.0, intervals),
+                                                       "live", ek=ek)
+            record, = store.query("home", date(2024, 5, 1), date(2024, 5, 1))
+
+        ek.set_hop_hour.assert_called_once_with(41)
+        self.assertEqual((result["start_time"], result["end_time"], result["usage_cost"]), ("08:00 PM", "09:00 PM", 0.25))
+        # History records the interval that was set, not the best one
+        self.assertEqual((record["slot"], record["start_time"]), (40, "08:00 PM"))
+
+
+class TestHopCatalogueCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "hop.json")
+        self.fetch = mock.Mock(return_value=HopCatalogue.from_response(hop_response(inactive=(1,))))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_fetched_once_and_persisted(self):
+        cache = HopCatalogueCache(self.path)
+        self.assertFalse(cache.get(self.fetch).is_eligible(1))
+        cache.get(self.fetch)
+        self.assertFalse(HopCatalogueCache(self.path).get(self.fetch).is_eligible(1))
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_expiry_and_failures(self):
+        cache = HopCatalogueCache(self.path, ttl=0.01)
+        cache.get(self.fetch)
+        time.sleep(0.02)
+        self.assertFalse(cache.get(mock.Mock(side_effect=ConnectionError())).is_eligible(1))  # stale
+        self.assertTrue(HopCatalogueCache(ttl=0).get(mock.Mock(side_effect=ConnectionError())).is_eligible(1))
+
+    def test_unreadable_file_is_no_cache(self):
+        for contents in ('{"catalogue": {"sta', '[]', '{"catalogue": {}, "saved_at": 0}'):
+            with open(self.path, 'w') as f:
+                f.write(contents)
+            self.assertFalse(HopCatalogueCache(self.path).get(self.fetch).is_eligible(1))
+        self.assertEqual(self.fetch.call_count, 3)
+        self.assertFalse(HopCatalogueCache(self.path).get(self.fetch).is_eligible(1))  # rewritten by the fetch
+        self.assertEqual(self.fetch.call_count, 3)
+
+    def test_unwritable_file_is_no_cache(self):
+        cache = HopCatalogueCache(os.path.join(self.tmp.name, "missing", "hop.json"))
+        self.assertFalse(cache.get(self.fetch).is_eligible(1))
+        self.assertFalse(cache.get(self.fetch).is_eligible(1))
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
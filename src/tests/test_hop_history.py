@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+from libs import households
+from libs.data import NZDT
+from libs.hop_catalogue import HopCatalogue
+from libs.hop_history import (SQLiteDecisionStore, _months, decision_record, format_decisions,
+                              record_decision, summarise_decisions)
+
+
+def make_result(day, hour, saving=0.5, source="live"):
+    midnight = datetime(day.year, day.month, day.day, tzinfo=NZDT)
+    intervals = [(midnight + timedelta(minutes=30 * slot), midnight + timedelta(minutes=30 * slot + 60),
+                  saving if slot == hour * 2 else 0.1, 2.0) for slot in range(0, 46)]
+    return {"start_time": f"{hour % 12 or 12:02d}:00 {'AM' if hour < 12 else 'PM'}", "end_time": "",
+            "usage_cost": saving, "usage_kwh": 2.0, "intervals": intervals, "source": source}
+
+
+class TestHopHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "history.db")
+        self.store = SQLiteDecisionStore(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_record(self):
+        record = decision_record("home", make_result(date(2024, 5, 1), 21))
+        self.assertEqual((record["day"], record["slot"], record["saving"]), ("2024-05-01", 42, 0.5))
+        self.assertEqual(record["intervals"][2], [2, 2.0, 0.1])
+
+    def test_range_queries(self):
+        start = date(2024, 1, 1)
+        for day in range(366):
+            current = start + timedelta(days=day)
+            record_decision("home", make_result(current, 21 if day % 3 else 7, saving=1.0), self.store)
+            record_decision("away", make_result(current, 1), self.store)
+
+        # A provisional decision is replaced by the final one for the same day
+        record_decision("home", make_result(date(2024, 5, 2), 18, source="provisional"), self.store)
+        record_decision("home", make_result(date(2024, 5, 2), 21, saving=1.0), self.store)
+
+        summary = summarise_decisions(self.store.query("home", date(2024, 5, 1), date(2024, 5, 31)))
+
+        self.assertEqual(summary["days"], 31)
+        self.assertEqual(summary["saving"], 31.0)
+        self.assertEqual((summary["most_common_slot"], summary["sources"]), (42, {"live": 31}))
+        self.assertIn("Most common HOP: 21:00", format_decisions(summary))
+        self.assertEqual(format_decisions(summarise_decisions([])), "No Hour of Power decisions recorded")
+
+    def test_months(self):
+        self.assertEqual(list(_months(date(2023, 11, 30), date(2024, 2, 1))),
+                         ["2023-11", "2023-12", "2024-01", "2024-02"])
+
+    def test_set_household_hop_records(self):
+        ek = mock.Mock()
+        ek.hop_catalogue.return_value = HopCatalogue.default()
+        result = make_result(date(2024, 5, 1), 21)
+        with mock.patch.dict(os.environ, {"HOP_HISTORY": self.path}), \
+                mock.patch.object(households, "login_household", return_value=ek):
+            households.set_household_hop({"name": "home"}, tuple(result[k] for k in (
+                "start_time", "end_time", "usage_cost", "usage_kwh", "intervals")), "live")
+        ek.set_hop_hour.assert_called_once_with(43)
+        self.assertEqual([r["slot"] for r in self.store.query("home", date(2024, 5, 1), date(2024, 5, 1))], [42])
+
+    def test_store_failures_do_not_fail_the_run(self):
+        ek = mock.Mock()
+        ek.hop_catalogue.return_value = HopCatalogue.default()
+        result = make_result(date(2024, 5, 1), 21)
+        with mock.patch.dict(os.environ, {"HOP_HISTORY": "blob"}), \
+                mock.patch("libs.hop_history._build_decision_store", side_effect=ConnectionError("storage down")):
+            decision = households.set_household_hop({"name": "home"}, tuple(result[k] for k in (
+                "start_time", "end_time", "usage_cost", "usage_kwh", "intervals")), "live", ek=ek)
+        ek.set_hop_hour.assert_called_once_with(43)
+        self.assertEqual(decision["start_time"], "09:00 PM")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+
+from libs.hop_score import HopScoreRepository, format_summary, score_consumption, summarise_scores
+
+
+def make_day(day, seed):
+    rng = random.Random(seed + day.toordinal())
+    intervals = {str(i): {"consumption": "{:.3f}".format(rng.uniform(0, 1.5)), "hop_best": 0}
+                 for i in range(1, 49)}
+    best = max(range(1, 48), key=lambda i: float(intervals[str(i)]["consumption"]) +
+               float(intervals[str(i + 1)]["consumption"]))
+    intervals[str(best)]["hop_best"] = 1
+    chosen = best if rng.random() < 0.5 else rng.randrange(1, 48)
+    adjustment = Decimal(intervals[str(chosen)]["consumption"]) + Decimal(intervals[str(chosen + 1)]["consumption"])
+    return {"consumption_adjustment": str(adjustment), "intervals": intervals}
+
+
+def original_score(consumption):
+    # The Decimal loop hop_score used to run
+    wrong_kwh = Decimal('0.0')
+    hop_savings = Decimal('0.0')
+    for day in consumption.values():
+        hop_usage = Decimal(day['consumption_adjustment'])
+        hop_savings += hop_usage
+        for interval in range(1, 48):
+            if day['intervals'][str(interval)]['hop_best']:
+                hop_best = Decimal(day['intervals'][str(interval)]['consumption']) + \
+                    Decimal(day['intervals'][str(interval + 1)]['consumption'])
+                break
+        if hop_best - hop_usage > Decimal('0.01'):
+            wrong_kwh += hop_best - hop_usage
+    return float(hop_savings), float(wrong_kwh), float(Decimal(100) - wrong_kwh / hop_savings * 100)
+
+
+class FakeConsumptionRepository(object):
+    def __init__(self, path):
+        self.path = path
+        self.requests = []
+
+    def get(self, start_date, end_date):
+        self.requests.append((start_date, end_date))
+        days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        return {day.isoformat(): make_day(day, 0) for day in days}
+
+
+class FakeElectricKiwi(object):
+    _customer = {"id": 1, "connection": {"id": 2}}
+
+
+class TestHopScore(unittest.TestCase):
+    def test_matches_decimal_loop(self):
+        start = date(2024, 3, 1)
+        consumption = {(start + timedelta(days=i)).isoformat(): make_day(start + timedelta(days=i), 1)
+                       for i in range(60)}
+
+        _, hop_wh, best_wh = score_consumption(consumption)
+        summary = summarise_scores(hop_wh, best_wh, rate="0.25")
+
+        hop_kwh, missed_kwh, score = original_score(consumption)
+        self.assertAlmostEqual(summary["hop_kwh"], hop_kwh)
+        self.assertAlmostEqual(summary["missed_kwh"], missed_kwh)
+        self.assertAlmostEqual(summary["score"], round(score, 2))
+        self.assertEqual(summary["hop_savings"], round(hop_kwh * 0.25, 2))
+        self.assertIn("HOP Score:", format_summary(summary))
+
+    def test_extending_the_range_only_scores_new_days(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            consumption = FakeConsumptionRepository(os.path.join(tmp, "c.db"))
+            scores = HopScoreRepository(FakeElectricKiwi(), consumption=consumption)
+            today = date.today()
+
+            first = scores.summary(today - timedelta(days=30), today - timedelta(days=10))
+            self.assertEqual(first["days"], 21)
+
+            consumption.requests.clear()
+            dates, _, _ = scores.days(today - timedelta(days=40), today - timedelta(days=10))
+            self.assertEqual(len(dates), 31)
+            self.assertEqual(consumption.requests, [(today - timedelta(days=40), today - timedelta(days=31))])
+
+            consumption.requests.clear()
+            self.assertEqual(scores.summary(today - timedelta(days=30), today - timedelta(days=10)), first)
+            self.assertEqual(consumption.requests, [])
+
+    def test_recent_days_are_rescored(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            consumption = FakeConsumptionRepository(os.path.join(tmp, "c.db"))
+            scores = HopScoreRepository(FakeElectricKiwi(), consumption=consumption)
+            today = date.today()
+
+            scores.days(today - timedelta(days=10))
+            consumption.requests.clear()
+            scores.days(today - timedelta(days=10))
+            self.assertEqual(consumption.requests, [(today - timedelta(days=3), today)])
+
+
+if __name__ == '__main__':
+    unittest.main()
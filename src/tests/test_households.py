@@ -0,0 +1,183 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from libs import households
+from libs.data import NZDT
+from libs.deadline import Deadline
+from libs.electrickiwi import Hour
+from libs.hop_catalogue import HopCatalogue
+from libs.households import (analyse_household_within_budget, load_households, run_households,
+                             summarise_results)
+from libs.usage_index import UsageIndexStore
+
+
+class FakeOptimise(object):
+    """
+    Stands in for optimise_household, counting how many households run at once.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, household):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        if household["name"] == "broken":
+            raise Exception("login failed")
+        return {"start_time": "09:00 PM"}
+
+
+class TestHouseholds(unittest.TestCase):
+    def test_load_households_from_json(self):
+        config = '[{"name": "a", "customer_index": 1}, {}]'
+        with mock.patch.dict(os.environ, {"HOUSEHOLDS": config}):
+            self.assertEqual([h["name"] for h in load_households()], ["a", "household-1"])
+
+    def test_load_households_rejects_duplicate_names(self):
+        config = '[{"name": "a"}, {"name": "b"}, {"name": "a"}]'
+        with mock.patch.dict(os.environ, {"HOUSEHOLDS": config}):
+            with self.assertRaisesRegex(ValueError, "Duplicate household names.*: a"):
+                load_households()
+
+    def test_failures_are_isolated(self):
+        config = [{"name": f"home-{i}"} for i in range(50)] + [{"name": "broken"}]
+
+        optimise = FakeOptimise()
+        with mock.patch.object(households, "optimise_household", optimise):
+            results = run_households(config, max_workers=25)
+
+        self.assertGreater(optimise.max_active, 1)
+        self.assertLessEqual(optimise.max_active, 25)
+        self.assertEqual(sum(r["ok"] for r in results.values()), 50)
+        self.assertEqual(results["broken"], {"ok": False, "error": "login failed"})
+        self.assertIn("Succeeded: 50/51", summarise_results(results))
+
+    @mock.patch.object(households, "optimise_household", lambda h: time.sleep(1))
+    def test_timeout(self):
+        results = run_households([{"name": "slow"}], timeout=0.05)
+        self.assertEqual(results["slow"], {"ok": False, "error": "timed out"})
+
+
+class TestTimeBudget(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "index.db")
+        self.env = mock.patch.dict(os.environ, {"USAGE_INDEX": path})
+        self.env.start()
+        self.store = UsageIndexStore(path)
+
+        # Last week's live run liked 10pm
+        start = datetime.now(NZDT).replace(hour=22, minute=0, second=0, microsecond=0) - timedelta(weeks=1)
+        self.store.update("home", [(start, start + timedelta(hours=1), 0.5, 4.0),
+                                   (start - timedelta(hours=1), start, 0.1, 1.0)])
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp.cleanup()
+
+    def live(self, delay):
+        start = datetime.now(NZDT).replace(hour=1, minute=0, second=0, microsecond=0)
+
+        def analyse(household, timings=None, deadline=None):
+            time.sleep(delay)
+            return "01:00 AM", "02:00 AM", 0.2, 2.0, [(start, start + timedelta(hours=1), 0.2, 2.0)]
+        return mock.patch.object(households, "analyse_household", analyse)
+
+    def test_live_result_within_budget(self):
+        with self.live(0):
+            result, source = analyse_household_within_budget({"name": "home"}, budget=1)
+        self.assertEqual((result[0], source), ("01:00 AM", "live"))
+        self.assertEqual(self.store.load("home").count.sum(), 3)
+
+    def test_falls_back_to_prediction(self):
+        with self.live(0.5):
+            result, source = analyse_household_within_budget({"name": "home"}, budget=0.05)
+        self.assertEqual((result[0], source), ("10:00 PM", "predicted"))
+
+        # The late live result still reaches the index
+        time.sleep(0.6)
+        self.assertEqual(self.store.load("home").count.sum(), 3)
+
+    def test_waits_without_history(self):
+        with self.live(0.1):
+            result, source = analyse_household_within_budget({"name": "new"}, budget=0.01)
+        self.assertEqual((result[0], source), ("01:00 AM", "live"))
+
+    def test_deadline_shortens_budget(self):
+        with self.live(0.5):
+            result, source = analyse_household_within_budget({"name": "home"}, budget=10, deadline=in_seconds(0.05))
+        self.assertEqual(source, "predicted")
+
+        with self.live(0.5):
+            result, source = analyse_household_within_budget({"name": "new"}, budget=10, deadline=in_seconds(0.05))
+        self.assertEqual((result, source), (None, "timeout"))
+
+
+def in_seconds(seconds):
+    return Deadline(datetime.now(timezone.utc) + timedelta(seconds=seconds))
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.ek = mock.Mock()
+        self.ek.get_hop_hour.return_value = Hour(37, "6:00 PM", "7:00 PM")
+        self.ek.hop_catalogue.return_value = HopCatalogue.default()
+        self.env = mock.patch.dict(os.environ, {"HOP_SET_RESERVE_SECONDS": "0.2"})
+        self.env.start()
+        os.environ.pop("USAGE_INDEX", None)
+        os.environ.pop("HOP_HISTORY", None)
+
+    def tearDown(self):
+        self.env.stop()
+
+    def run_pipeline(self, analyse_delay, login_delay=0.2, deadline=5):
+        start = datetime.now(NZDT).replace(hour=21, minute=0, second=0, microsecond=0)
+
+        def analyse(household, timings=None, deadline=None):
+            time.sleep(analyse_delay)
+            return "09:00 PM", "10:00 PM", 0.2, 2.0, [(start, start + timedelta(hours=1), 0.2, 2.0)]
+
+        def login(household, timeout=None):
+            time.sleep(login_delay)
+            return self.ek
+
+        with mock.patch.object(households, "analyse_household", analyse), \
+                mock.patch.object(households, "login_household", login):
+            started = time.monotonic()
+            result = households.optimise_household({"name": "home"}, deadline=in_seconds(deadline))
+            return result, time.monotonic() - started
+
+    def test_login_runs_alongside_analysis(self):
+        result, elapsed = self.run_pipeline(analyse_delay=0.2)
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(result["source"], "live")
+        self.ek.set_hop_hour.assert_called_once_with(43)
+        self.assertLessEqual(self.ek.timeout, 5)
+
+    def test_keeps_previous_hop_after_deadline(self):
+        result, elapsed = self.run_pipeline(analyse_delay=2, deadline=0.5)
+        self.assertLess(elapsed, 1)
+        self.assertEqual((result["start_time"], result["source"]), ("06:00 PM", "previous"))
+        self.ek.set_hop_hour.assert_not_called()
+
+    def test_deadline_before_midnight(self):
+        now = datetime(2024, 5, 1, 23, 55, tzinfo=NZDT)
+        deadline = Deadline.before_midnight(margin=30, now=now)
+        self.assertEqual(deadline.at, datetime(2024, 5, 2, 0, 0, tzinfo=NZDT) - timedelta(seconds=30))
+        self.assertEqual(in_seconds(-1).timeout(), 1.0)
+        self.assertLessEqual(in_seconds(100).timeout(limit=30), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
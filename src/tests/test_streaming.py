@@ -0,0 +1,111 @@
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime, timezone
+
+from libs.data import calculate_optimal_hop
+from libs.streaming import (MemorySlotStore, SQLiteSlotStore, StreamingOptimiser, listen,
+                            readings_from_payload)
+from tests.fake_home_assistant import FakeHomeAssistant
+from tests.test_data import make_usage_data, normalise
+
+DAY = date(2024, 5, 1)
+
+
+def make_day(step_seconds=60, seed=0):
+    # What the function sees at 23:55 on 1 May 2024 in New Zealand
+    return make_usage_data(datetime(2024, 4, 30, 11, 55, tzinfo=timezone.utc), 24, step_seconds, seed)
+
+
+class TestStreamingOptimiser(unittest.TestCase):
+    def test_matches_calculate_optimal_hop(self):
+        for step in (60, 97, 300):
+            data = make_day(step)
+            optimiser = StreamingOptimiser(MemorySlotStore())
+            optimiser.ingest("home", data)
+            with self.subTest(step=step):
+                self.assertEqual(normalise(optimiser.decide("home", DAY)), normalise(calculate_optimal_hop(data)))
+
+    def test_out_of_order_and_duplicate_readings(self):
+        data = make_day()
+        pushed = data + random.Random(1).sample(data, 300) + [{"state": "unavailable", "last_changed": data[5]["last_changed"]}]
+        random.Random(2).shuffle(pushed)
+
+        optimiser = StreamingOptimiser(MemorySlotStore())
+        for i in range(0, len(pushed), 7):
+            optimiser.ingest("home", pushed[i:i + 7])
+
+        self.assertEqual(normalise(optimiser.decide("home", DAY)), normalise(calculate_optimal_hop(data)))
+
+    def test_concurrent_sqlite_merges(self):
+        data = make_day()
+        random.Random(3).shuffle(data)
+        with tempfile.TemporaryDirectory() as tmp:
+            optimiser = StreamingOptimiser(SQLiteSlotStore(os.path.join(tmp, "slots.db")))
+            threads = [threading.Thread(target=optimiser.ingest, args=("home", data[i::8])) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(normalise(optimiser.decide("home", DAY)), normalise(calculate_optimal_hop(data)))
+            self.assertIsNone(optimiser.decide("other", DAY))
+
+    def test_old_days_are_pruned(self):
+        store = MemorySlotStore()
+        optimiser = StreamingOptimiser(store, retention_days=0)
+        optimiser.ingest("home", make_day())
+        optimiser.decide("home", DAY)
+        self.assertEqual({row[0] for row in store.read("home", "2024-01-01", "2024-12-31")}, {"2024-05-01"})
+
+    def test_readings_from_payload(self):
+        state = {"state": "1.5", "last_changed": "2024-05-01T00:00:00+00:00"}
+        self.assertEqual(readings_from_payload(state), [state])
+        self.assertEqual(readings_from_payload([state, state]), [state, state])
+        self.assertEqual(readings_from_payload({"event_type": "state_changed",
+                                                "data": {"old_state": None, "new_state": state}}), [state])
+        self.assertEqual(readings_from_payload({"variables": {"trigger": {"to_state": state}}}), [state])
+        self.assertEqual(readings_from_payload({"new_state": None}), [])
+
+
+class TestListen(unittest.TestCase):
+    def test_subscribes_backfills_and_reconnects(self):
+        data = make_day(step_seconds=300)
+        first, rest = data[:150], data[150:]
+        household = {"name": "home", "home_assistant_entity_id": "sensor.kwh",
+                     "home_assistant_access_token": "token"}
+
+        with FakeHomeAssistant(history=[{"entity_id": "sensor.kwh"}] + first) as ha:
+            household["home_assistant_url"] = ha.url
+            optimiser = StreamingOptimiser(MemorySlotStore())
+            stop = threading.Event()
+            worker = threading.Thread(target=listen, args=(household, optimiser, stop, 0.05))
+            worker.start()
+            try:
+                ha.wait_for_subscribers()
+                for obj in reversed(rest[:60]):
+                    ha.push_state("sensor.kwh", obj["state"], obj["last_changed"])
+                    ha.push_state("sensor.other", "0", obj["last_changed"])
+
+                ha.disconnect_subscribers()
+                time.sleep(0.1)
+                ha.wait_for_subscribers()
+                for obj in rest[50:]:
+                    ha.push_state("sensor.kwh", obj["state"], obj["last_changed"])
+
+                deadline = time.monotonic() + 5
+                while optimiser.decide("home", DAY) is None or \
+                        normalise(optimiser.decide("home", DAY)) != normalise(calculate_optimal_hop(data)):
+                    self.assertLess(time.monotonic(), deadline, "pushed readings never arrived")
+                    time.sleep(0.05)
+            finally:
+                stop.set()
+                worker.join(5)
+            self.assertFalse(worker.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+
+from libs.tariff import DEFAULT_TARIFF, HOLIDAY, PLANS, WEEKDAY, WEEKEND, Tariff, time_to_slot
+
+
+class TestTariff(unittest.TestCase):
+    def test_rate_lookup(self):
+        times = np.array(['2024-05-01T07:30', '2024-05-01T12:00', '2024-05-01T23:30',
+                          '2024-05-04T07:30'], dtype='datetime64[m]')  # Wed x3, Sat
+        np.testing.assert_array_equal(DEFAULT_TARIFF.rate_at(times),
+                                      [0.2208, 0.1546, 0.1104, 0.1546])
+
+    def test_hop_eligible(self):
+        eligible = DEFAULT_TARIFF.hop_eligible
+        self.assertFalse(eligible[WEEKDAY, time_to_slot('0630')])  # runs into peak
+        self.assertFalse(eligible[WEEKEND, time_to_slot('1630')])  # excluded by EK
+        self.assertFalse(eligible[WEEKDAY, time_to_slot('2330')])
+        self.assertTrue(eligible[WEEKDAY, time_to_slot('2100')])
+        self.assertEqual(eligible.sum(axis=1).tolist(), [33, 33, 33])
+
+    def test_holidays_use_weekend_rates(self):
+        tariff = Tariff('test', weekday=[['0700', '2300', 0.3], ['2300', '0700', 0.1]],
+                        weekend=0.2, holidays=['2024-12-25'])
+        days = np.array(['2024-12-24', '2024-12-25', '2024-12-28'], dtype='datetime64[D]')
+        self.assertEqual(tariff.day_types(days).tolist(), [WEEKDAY, HOLIDAY, WEEKEND])
+
+        kwh = np.ones((3, 48))
+        np.testing.assert_allclose(tariff.daily_costs(days, kwh),
+                                   [32 * 0.3 + 16 * 0.1, 48 * 0.2, 48 * 0.2])
+
+    def test_discount(self):
+        self.assertAlmostEqual(PLANS['stay_ahead'].apply_discount(100.0), 88.5)
+
+    def test_bands_must_cover_day(self):
+        with self.assertRaises(ValueError):
+            Tariff('gap', weekday=[['0700', '2300', 0.3]])
+
+
+if __name__ == '__main__':
+    unittest.main()
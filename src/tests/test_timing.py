@@ -0,0 +1,58 @@
+import os
+import pstats
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from libs.households import analyse_household
+from libs.timing import Timings
+from tests.fake_home_assistant import FakeHomeAssistant
+from tests.test_data import make_usage_data
+
+
+class TestTimings(unittest.TestCase):
+    def test_spans(self):
+        timings = Timings(household="home")
+        with timings.span("fetch") as span:
+            span["rows"] = 10
+            span["bytes"] = 2048
+        with self.assertRaises(ValueError):
+            with timings.span("optimise"):
+                raise ValueError()
+
+        self.assertEqual([span["stage"] for span in timings.spans], ["fetch", "optimise"])
+        self.assertEqual(timings.spans[0]["household"], "home")
+        self.assertEqual(timings.spans[1]["error"], "ValueError")
+        self.assertEqual(timings.summary().splitlines()[0].split(" (")[1], "10 rows, 2 KB)")
+
+    def test_profile_only_when_enabled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            timings = Timings(household="home/1")
+            with timings.span("optimise", profile=True):
+                sum(range(1000))
+            self.assertNotIn("profile", timings.spans[0])
+
+            with mock.patch.dict(os.environ, {"HOP_PROFILE": tmp}):
+                with timings.span("optimise", profile=True):
+                    sum(range(1000))
+            path = timings.spans[1]["profile"]
+            self.assertEqual(os.path.dirname(path), tmp)
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_analyse_household_stages(self):
+        data = make_usage_data(datetime(2024, 5, 1, 11, 55, tzinfo=timezone.utc), 24, 60)
+        with FakeHomeAssistant(history=[{"entity_id": "sensor.kwh"}] + data) as ha:
+            household = {"name": "home", "home_assistant_url": ha.url,
+                         "home_assistant_access_token": "token", "home_assistant_entity_id": "sensor.kwh"}
+            for optimiser, stages in [("numpy", ["fetch", "optimise"]), ("pandas", ["fetch", "clean", "optimise"])]:
+                timings = Timings(household="home")
+                with mock.patch.dict(os.environ, {"HOP_OPTIMISER": optimiser}), self.subTest(optimiser=optimiser):
+                    self.assertIsNotNone(analyse_household(household, timings))
+                    self.assertEqual([span["stage"] for span in timings.spans], stages)
+                    self.assertAlmostEqual(timings.spans[0]["rows"], len(data), delta=2)
+                    self.assertGreater(timings.spans[0]["bytes"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from libs.data import NZDT, calculate_optimal_hop
+from libs.usage_index import UsageIndex, UsageIndexStore
+from tests.test_data import make_usage_data
+
+
+class TestUsageIndex(unittest.TestCase):
+    def setUp(self):
+        # Wednesday 1 May 2024 in New Zealand
+        self.result = calculate_optimal_hop(
+            make_usage_data(datetime(2024, 4, 30, 11, 55, tzinfo=timezone.utc), 24, 60))
+
+    def test_predicts_last_result_for_same_weekday(self):
+        index = UsageIndex()
+        index.update(self.result[4])
+
+        predicted = index.predict(datetime(2024, 5, 8, tzinfo=NZDT).date())
+        self.assertEqual(predicted[:4], self.result[:4])
+
+    def test_rerunning_a_day_is_a_no_op(self):
+        index = UsageIndex()
+        self.assertGreater(index.update(self.result[4]), 0)
+        mean = index.mean.copy()
+        self.assertEqual(index.update(self.result[4]), 0)
+        self.assertTrue((index.mean == mean).all())
+
+    def test_moving_average(self):
+        start = datetime(2024, 5, 1, 22, tzinfo=NZDT)
+        index = UsageIndex(alpha=0.5)
+        for week, kwh in enumerate([1.0, 3.0, 3.0]):
+            day = start + timedelta(weeks=week)
+            index.update([(day, day + timedelta(hours=1), 0, kwh)])
+        self.assertEqual(index.mean[2, 44], 2.5)
+        self.assertEqual(index.count[2, 44], 3)
+
+    def test_no_history(self):
+        self.assertIsNone(UsageIndex().predict(datetime(2024, 5, 8).date()))
+
+    def test_store_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = UsageIndexStore(os.path.join(tmp, "index.db"))
+            store.update("home", self.result[4])
+
+            loaded = store.load("home")
+            self.assertEqual(loaded.to_json(), store.load("home").to_json())
+            self.assertEqual(loaded.predict(datetime(2024, 5, 8).date())[0], self.result[0])
+            self.assertEqual(store.load("other").count.sum(), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
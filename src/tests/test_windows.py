@@ -0,0 +1,126 @@
+import itertools
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.synthetic import DST_ENDS, DST_STARTS, DEFAULT_START, generate_readings
+from libs.data import (HALF_HOUR_NS, HOUR_NS, NZDT, _readings_to_arrays, interpolated_window_usage,
+                       optimal_hop_from_arrays, to_local)
+from libs.tariff import DEFAULT_TARIFF, WEEKDAY, WEEKEND
+from libs.windows import best_day_windows, best_windows, optimal_hop, optimal_windows, window_sums
+
+
+def brute_force(values, length, count):
+    # Highest total of the most windows that fit, trying every combination
+    for k in range(count, 0, -1):
+        totals = [sum(values[list(starts)]) for starts in itertools.combinations(range(len(values)), k)
+                  if all(b - a >= length for a, b in zip(starts, starts[1:]))]
+        if totals and np.isfinite(max(totals)):
+            return max(totals)
+    return -np.inf
+
+
+class TestBestWindows(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            values = rng.integers(0, 5, size=rng.integers(1, 12)).astype(float)
+            values[rng.random(len(values)) < 0.3] = -np.inf
+            length, count = int(rng.integers(1, 4)), int(rng.integers(1, 4))
+
+            starts, totals = best_windows(values, length, count)
+            chosen = [s for s in starts[0] if s >= 0]
+            self.assertEqual(totals[0], brute_force(values, length, count))
+            if chosen:
+                self.assertEqual(values[chosen].sum(), totals[0])
+                self.assertTrue(all(b - a >= length for a, b in zip(chosen, chosen[1:])))
+
+    def test_ties_and_batches(self):
+        starts, totals = best_windows([[1, 3, 3, -np.inf], [-np.inf] * 4], length=2)
+        self.assertEqual(starts.tolist(), [[1], [-1]])
+        self.assertEqual(totals[0], 3)
+
+        starts, _ = best_windows([[5, 1, 1, 5]], length=2, count=3)
+        self.assertEqual(starts.tolist(), [[0, 3, -1]])
+
+    def test_window_sums(self):
+        np.testing.assert_array_equal(window_sums([1, 2, 3, 4], 3), [[6, 9]])
+
+
+class TestOptimalWindows(unittest.TestCase):
+    def test_reproduces_single_hop(self):
+        for start in (DEFAULT_START, DST_ENDS, DST_STARTS):
+            for seed in range(4):
+                readings = generate_readings(days=1, resolution=60, start=start, seed=seed, gaps=seed % 2)
+                timestamps, states = _readings_to_arrays(readings)
+                self.assertEqual(optimal_hop(timestamps, states), optimal_hop_from_arrays(timestamps, states))
+
+    def test_hop_across_the_night_rate(self):
+        # Wednesday 15 May 2024 with heavy use 22:30-23:30, an hour running into the night rate
+        start = datetime(2024, 5, 14, 23, 55, tzinfo=NZDT)
+        readings, state = [], 1000.0
+        for minute in range(24 * 60):
+            moment = start + timedelta(minutes=minute)
+            state += 5 / 60 if moment.hour * 60 + moment.minute in range(22 * 60 + 30, 23 * 60 + 30) else 0.5 / 60
+            readings.append({"state": str(round(state, 3)), "last_changed": moment.isoformat()})
+        timestamps, states = _readings_to_arrays(readings)
+
+        hop = optimal_hop(timestamps, states)
+        self.assertEqual(hop, optimal_hop_from_arrays(timestamps, states))
+        self.assertEqual(hop[:2], ("10:30 PM", "11:30 PM"))
+
+        # Priced per half-hour, the half after 23:00 is at the cheaper night rate
+        window, = optimal_windows(timestamps, states, per_slot=True)[0]
+        self.assertEqual(window[0].astimezone(NZDT).strftime("%H:%M"), "22:30")
+        self.assertLess(window[2], hop[2])
+
+    def test_windows_are_priced_per_half_hour(self):
+        timestamps, states = _readings_to_arrays(generate_readings(days=2, resolution=60))
+        _, intervals = optimal_windows(timestamps, states, length=2 * HOUR_NS, per_slot=True)
+        for start, _, cost, _ in intervals:
+            halves = int(start.timestamp()) * 10**9 + np.arange(4) * HALF_HOUR_NS
+            kwh, covered = interpolated_window_usage(timestamps, states, halves, HALF_HOUR_NS)
+            if covered.all():
+                self.assertAlmostEqual(cost, (kwh * DEFAULT_TARIFF.rate_at(to_local(halves))).sum(), delta=0.005)
+
+    def test_two_hours_and_weekend_only(self):
+        timestamps, states = _readings_to_arrays(generate_readings(days=3, resolution=60))
+
+        windows, _ = optimal_windows(timestamps, states, length=2 * HOUR_NS, count=2)
+        self.assertEqual(len(windows), 2)
+        self.assertGreaterEqual((windows[1][0] - windows[0][1]).total_seconds(), 0)
+        self.assertTrue(all(DEFAULT_TARIFF.off_peak[DEFAULT_TARIFF.index(to_local(np.array(
+            [int(w[0].timestamp()) * 10**9 + i * HALF_HOUR_NS for i in range(4)])))].all() for w in windows))
+
+        # 1 May 2024 was a Wednesday, so the 4th and 5th are the weekend
+        windows, intervals = optimal_windows(timestamps, states, length=HALF_HOUR_NS, count=3,
+                                             day_types=(WEEKEND,))
+        self.assertEqual(len(windows), 3)
+        self.assertTrue(all(start.weekday() >= 5 for start, _, _, _ in intervals))
+
+    def test_batch_over_days(self):
+        rng = np.random.default_rng(1)
+        days = np.arange('2021-01-01', '2024-01-01', dtype='datetime64[D]')
+        kwh = rng.uniform(0, 2, (len(days), 48))
+
+        starts, totals = best_day_windows(days, kwh, slots=2, count=3)
+
+        # One window per day is the best eligible hour of each day
+        single, _ = best_day_windows(days, kwh, slots=2)
+        types = DEFAULT_TARIFF.day_types(days)
+        priced = kwh * DEFAULT_TARIFF.rates[types]
+        hours = priced[:, :-1] + priced[:, 1:]
+        expected = np.argmax(np.where(DEFAULT_TARIFF.hop_eligible[types][:, :-1], hours, -np.inf), axis=1)
+        np.testing.assert_array_equal(single[:, 0], expected)
+        self.assertTrue((np.diff(starts, axis=1) >= 2).all())
+
+        weekdays, _ = best_day_windows(days, kwh, count=2, day_types=(WEEKDAY,))
+        self.assertTrue((weekdays[types != WEEKDAY] == -1).all())
+
+    def test_eligibility_generalises_hop(self):
+        np.testing.assert_array_equal(DEFAULT_TARIFF.window_eligible(2), DEFAULT_TARIFF.hop_eligible)
+
+
+if __name__ == '__main__':
+    unittest.main()